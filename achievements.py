@@ -0,0 +1,173 @@
+"""
+IDFS StarGuide - Achievement Engine
+Rule-based achievements evaluated against per-user progress counters
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Each rule sees the user's updated progress counters and the submitted assessment
+ACHIEVEMENT_RULES = [
+    {
+        'id': 'first-steps',
+        'name': 'First Steps',
+        'description': 'Complete your first assessment',
+        'check': lambda progress, assessment: progress['assessment_count'] >= 1
+    },
+    {
+        'id': 'high-scorer',
+        'name': 'High Scorer',
+        'description': 'Score 80% or higher',
+        'check': lambda progress, assessment: assessment['score'] >= 80
+    },
+    {
+        'id': 'perfectionist',
+        'name': 'Perfectionist',
+        'description': 'Achieve a perfect score',
+        'check': lambda progress, assessment: assessment['score'] == 100
+    },
+    {
+        'id': 'quick-learner',
+        'name': 'Quick Learner',
+        'description': 'Complete an assessment in under 5 minutes',
+        'check': lambda progress, assessment: assessment.get('timeTaken', 0) < 300
+    },
+    {
+        'id': 'streak-master',
+        'name': 'Streak Master',
+        'description': 'Maintain a 7-day learning streak',
+        'check': lambda progress, assessment: progress['streak'] >= 7
+    },
+    {
+        'id': 'knowledge-seeker',
+        'name': 'Knowledge Seeker',
+        'description': 'Complete 20 assessments',
+        'check': lambda progress, assessment: progress['assessment_count'] >= 20
+    }
+]
+
+PROGRESS_COLUMNS = [
+    'assessment_count', 'best_score', 'high_score_count', 'perfect_count',
+    'streak', 'last_assessment_date', 'unlocked'
+]
+
+
+def load_progress(cursor, user_id):
+    """Read a user's progress row, backfilling it from history the first time"""
+    row = cursor.execute('''
+        SELECT assessment_count, best_score, high_score_count, perfect_count,
+               streak, last_assessment_date, unlocked
+        FROM user_progress WHERE user_id = ?
+    ''', (user_id,)).fetchone()
+
+    if row is not None:
+        progress = dict(zip(PROGRESS_COLUMNS, row))
+        progress['unlocked'] = set(filter(None, (progress['unlocked'] or '').split(',')))
+        return progress
+
+    return backfill_progress(cursor, user_id)
+
+
+def backfill_progress(cursor, user_id):
+    """Rebuild progress counters from the assessments and achievements tables"""
+    stats = cursor.execute('''
+        SELECT COUNT(*), MAX(score),
+               SUM(CASE WHEN score >= 80 THEN 1 ELSE 0 END),
+               SUM(CASE WHEN score = 100 THEN 1 ELSE 0 END)
+        FROM assessments WHERE user_id = ?
+    ''', (user_id,)).fetchone()
+
+    dates = [row[0] for row in cursor.execute('''
+        SELECT DISTINCT DATE(completed_at) FROM assessments
+        WHERE user_id = ? ORDER BY 1 DESC
+    ''', (user_id,))]
+
+    # Count consecutive days ending at the most recent assessment
+    streak = 0
+    previous = None
+    for value in dates:
+        day = datetime.strptime(value, '%Y-%m-%d').date()
+        if previous is not None and previous - day != timedelta(days=1):
+            break
+        streak += 1
+        previous = day
+
+    unlocked = {row[0] for row in cursor.execute('''
+        SELECT achievement_id FROM achievements WHERE user_id = ?
+    ''', (user_id,))}
+
+    return {
+        'assessment_count': stats[0] or 0,
+        'best_score': stats[1] or 0,
+        'high_score_count': stats[2] or 0,
+        'perfect_count': stats[3] or 0,
+        'streak': streak,
+        'last_assessment_date': dates[0] if dates else None,
+        'unlocked': unlocked
+    }
+
+
+def record_assessment(cursor, user_id, assessment, today=None):
+    """Update progress for a new assessment and award newly unlocked achievements
+
+    Must run before the assessment row itself is inserted, inside the same
+    transaction. Returns the achievements unlocked by this assessment only.
+    """
+    today = today or datetime.utcnow().date()
+    progress = load_progress(cursor, user_id)
+    score = assessment['score']
+
+    # Update counters
+    progress['assessment_count'] += 1
+    progress['best_score'] = max(progress['best_score'], score)
+    progress['high_score_count'] += 1 if score >= 80 else 0
+    progress['perfect_count'] += 1 if score == 100 else 0
+
+    last_date = progress['last_assessment_date']
+    if last_date != today.isoformat():
+        yesterday = (today - timedelta(days=1)).isoformat()
+        progress['streak'] = progress['streak'] + 1 if last_date == yesterday else 1
+        progress['last_assessment_date'] = today.isoformat()
+
+    # Evaluate every rule in memory; only new unlocks are written
+    earned = [
+        rule for rule in ACHIEVEMENT_RULES
+        if rule['id'] not in progress['unlocked'] and rule['check'](progress, assessment)
+    ]
+    progress['unlocked'].update(rule['id'] for rule in earned)
+
+    cursor.execute('''
+        INSERT INTO user_progress (user_id, assessment_count, best_score, high_score_count,
+                                   perfect_count, streak, last_assessment_date, unlocked)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            assessment_count = excluded.assessment_count,
+            best_score = excluded.best_score,
+            high_score_count = excluded.high_score_count,
+            perfect_count = excluded.perfect_count,
+            streak = excluded.streak,
+            last_assessment_date = excluded.last_assessment_date,
+            unlocked = excluded.unlocked
+    ''', (
+        user_id,
+        progress['assessment_count'],
+        progress['best_score'],
+        progress['high_score_count'],
+        progress['perfect_count'],
+        progress['streak'],
+        progress['last_assessment_date'],
+        ','.join(sorted(progress['unlocked']))
+    ))
+
+    if earned:
+        cursor.executemany('''
+            INSERT INTO achievements (user_id, achievement_id) VALUES (?, ?)
+        ''', [(user_id, rule['id']) for rule in earned])
+
+    achievements_earned = [
+        {'id': rule['id'], 'name': rule['name'], 'description': rule['description']}
+        for rule in earned
+    ]
+    return achievements_earned, progress
@@ -9,6 +9,7 @@ window.StarGuideAI = {
     isTyping: false,
     currentProvider: 'openai',
     streamController: null,
+    conversationId: Date.now().toString(36) + Math.random().toString(36).slice(2),
     
     // Provider configurations
     providers: {
@@ -272,6 +273,7 @@ window.StarGuideAI = {
                 body: JSON.stringify({
                     message: message,
                     provider: this.currentProvider,
+                    conversationId: this.conversationId,
                     context: this.getChatContext(),
                     stream: true
                 })
@@ -0,0 +1,122 @@
+"""
+IDFS StarGuide - AI Gateway
+A single asyncio event loop thread that runs provider I/O for the Flask request threads
+"""
+
+import asyncio
+import queue
+import threading
+import logging
+from concurrent.futures import TimeoutError as FutureTimeout
+
+logger = logging.getLogger(__name__)
+
+
+class AIGateway:
+    """Own one event loop in a daemon thread and bridge Flask threads onto it
+
+    run() submits a coroutine and blocks the calling thread until it
+    finishes; iterate() consumes an async generator as a plain iterator.
+    Provider calls therefore cost a coroutine on the loop, not a thread each.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'timed_out': 0, 'streams': 0, 'active': 0}
+
+    def start(self):
+        """Start the event loop thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='ai-gateway', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self._stats[key] += delta
+
+    def submit(self, coro):
+        """Schedule a coroutine on the loop and return a concurrent.futures.Future"""
+        self._count('submitted')
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the loop and wait for its result"""
+        future = self.submit(coro)
+        self._count('active')
+        try:
+            result = future.result(timeout)
+        except FutureTimeout:
+            future.cancel()
+            self._count('timed_out')
+            raise
+        except Exception:
+            self._count('failed')
+            raise
+        finally:
+            self._count('active', -1)
+        self._count('completed')
+        return result
+
+    def iterate(self, agen, timeout=None):
+        """Consume an async generator from a regular thread
+
+        Items are handed over through a queue; closing the returned iterator
+        (e.g. when a client disconnects) cancels the generator on the loop.
+        """
+        items = queue.Queue()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    items.put(('item', item))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                items.put(('error', e))
+            else:
+                items.put(('end', None))
+
+        self._count('streams')
+        future = self.submit(pump())
+
+        def consume():
+            try:
+                while True:
+                    try:
+                        kind, value = items.get(timeout=timeout)
+                    except queue.Empty:
+                        self._count('timed_out')
+                        raise TimeoutError(f"No stream item within {timeout}s")
+                    if kind == 'item':
+                        yield value
+                    elif kind == 'error':
+                        raise value
+                    else:
+                        return
+            finally:
+                future.cancel()
+
+        return consume()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def stop(self, cleanup=None):
+        """Run an optional cleanup coroutine function on the loop, then stop it"""
+        if self._thread is None:
+            return
+        if cleanup is not None:
+            try:
+                self.run(cleanup(), timeout=5)
+            except Exception as e:
+                logger.error(f"AI gateway shutdown error: {str(e)}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+        self._thread = None
@@ -0,0 +1,366 @@
+"""
+IDFS StarGuide - AI Provider Orchestrator
+Sequential, raced or hedged dispatch across AI providers under a total latency budget
+"""
+
+import asyncio
+import threading
+import time
+import logging
+
+from ai_gateway import AIGateway
+from provider_health import HealthRegistry
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_MODES = ('sequential', 'race', 'hedged')
+
+
+class StreamInterrupted(Exception):
+    """The winning provider's stream failed or stalled after its first token"""
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+class ProviderOrchestrator:
+    """Dispatch a prompt to providers and return the first good answer
+
+    providers maps a provider name to a coroutine function
+    (message, context, timeout=...) returning the response text. In 'hedged'
+    mode a second provider is tried once the first has been running longer
+    than its observed p95 latency; in 'race' mode every provider starts at
+    once. Calls run as tasks on the AI gateway's event loop, so losers are
+    cancelled outright. Providers are routed and gated by a HealthRegistry of
+    circuit breakers.
+
+    streamers maps a provider name to an async generator function
+    (message, context, timeout=...) yielding text chunks; stream() applies the
+    same dispatch to the first token.
+
+    admit, if given, is called with a provider name before each call and
+    can return False to skip that provider (e.g. it is over its rate limit).
+    """
+
+    def __init__(self, providers, mode='hedged', hedge_delay=None, default_hedge_delay=2.0,
+                 min_hedge_delay=0.25, budget=20.0, health=None, streamers=None,
+                 idle_timeout=30.0, gateway=None, admit=None):
+        if mode not in DISPATCH_MODES:
+            raise ValueError(f"Unknown dispatch mode: {mode}")
+
+        self.providers = providers
+        self.mode = mode
+        self.hedge_delay = hedge_delay
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.budget = budget
+        self.health = health or HealthRegistry(providers)
+        self.streamers = streamers or {}
+        self.idle_timeout = idle_timeout
+        self.admit = admit
+
+        self._owns_gateway = gateway is None
+        self.gateway = gateway or AIGateway()
+        self.gateway.start()
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'answered': 0,
+            'hedges': 0,
+            'budget_exhausted': 0,
+            'cancelled': 0,
+            'streams': 0,
+            'streams_completed': 0,
+            'streams_abandoned': 0,
+            'last_first_token_ms': None,
+            'wins': {name: 0 for name in providers},
+            'errors': {name: 0 for name in providers}
+        }
+
+    def hedge_delay_for(self, name):
+        """Seconds to wait on a provider before hedging: fixed, or its observed p95"""
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        p95 = self.health.providers[name].latency_quantile(0.95, min_samples=20)
+        if p95 is None:
+            return self.default_hedge_delay
+        return max(self.min_hedge_delay, p95 / 1000)
+
+    def _allow(self, name):
+        # The breaker goes first so a refused probe does not spend a rate limit token
+        if not self.health.allow(name):
+            return False
+        if self.admit is not None and not self.admit(name):
+            self.health.release(name)
+            return False
+        return True
+
+    def _error(self, name, started):
+        self.health.record(name, False, (time.time() - started) * 1000)
+        with self._lock:
+            self._stats['errors'][name] += 1
+
+    async def _call(self, name, message, context, deadline):
+        timeout = max(0.1, deadline - time.time())
+        started = time.time()
+        try:
+            response = await asyncio.wait_for(self.providers[name](message, context, timeout=timeout), timeout)
+        except asyncio.CancelledError:
+            # Lost the race: free a half-open probe without counting against the provider
+            self.health.release(name)
+            raise
+        except asyncio.TimeoutError:
+            logger.error(f"{name} error: timed out after {timeout:.1f}s")
+            self._error(name, started)
+            return None
+        except Exception as e:
+            logger.error(f"{name} error: {str(e)}")
+            self._error(name, started)
+            return None
+
+        self.health.record(name, bool(response), (time.time() - started) * 1000)
+        return response
+
+    def complete(self, message, context, order, mode=None, budget=None):
+        """Return (response, provider) from the first provider to answer, or (None, None)"""
+        budget = budget if budget is not None else self.budget
+        order = self.health.route([name for name in order if name in self.providers])
+        with self._lock:
+            self._stats['requests'] += 1
+        # The coroutine enforces the budget itself; the margin only covers loop scheduling
+        return self.gateway.run(self._complete(message, context, order, mode or self.mode, budget), timeout=budget + 1)
+
+    async def _complete(self, message, context, order, mode, budget):
+        deadline = time.time() + budget
+        waiting = list(order)
+        pending = {}
+
+        def launch():
+            # Skip providers whose breaker or rate limit refuses the call
+            while waiting:
+                name = waiting.pop(0)
+                if self._allow(name):
+                    pending[asyncio.ensure_future(self._call(name, message, context, deadline))] = name
+                    return name
+            return None
+
+        name = launch()
+        if mode == 'race':
+            while waiting:
+                launch()
+        next_hedge = time.time() + self.hedge_delay_for(name) if name else None
+
+        try:
+            while pending or waiting:
+                now = time.time()
+                if now >= deadline:
+                    with self._lock:
+                        self._stats['budget_exhausted'] += 1
+                    break
+
+                # Nothing in flight (the previous provider failed): move on to the next one
+                if not pending:
+                    name = launch()
+                    if name is None:
+                        break
+                    next_hedge = now + self.hedge_delay_for(name)
+                    continue
+
+                wait_until = deadline
+                if mode == 'hedged' and waiting:
+                    wait_until = min(deadline, next_hedge)
+
+                done, _ = await asyncio.wait(list(pending), timeout=max(0, wait_until - now),
+                                             return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    name = pending.pop(task)
+                    response = task.result()
+                    if response:
+                        with self._lock:
+                            self._stats['answered'] += 1
+                            self._stats['wins'][name] += 1
+                        return response, name
+
+                if not done and mode == 'hedged' and waiting and time.time() >= next_hedge:
+                    name = launch()
+                    if name is not None:
+                        next_hedge = time.time() + self.hedge_delay_for(name)
+                        with self._lock:
+                            self._stats['hedges'] += 1
+        finally:
+            self._cancel(pending.values(), exhausted=time.time() >= deadline, started=deadline - budget)
+            for task in pending:
+                task.cancel()
+
+        return None, None
+
+    def _cancel(self, names, exhausted, started):
+        """Account for calls being cancelled; running out the budget counts as a failure"""
+        names = list(names)
+        for name in names:
+            if exhausted:
+                self._error(name, started)
+        with self._lock:
+            self._stats['cancelled'] += len(names)
+
+    async def _pump(self, name, message, context, deadline, events):
+        """Run one provider stream, forwarding chunks to events until done or cancelled"""
+        started = time.time()
+        produced = False
+        try:
+            async for chunk in self.streamers[name](message, context, timeout=max(0.1, deadline - started)):
+                if chunk:
+                    produced = True
+                    events.put_nowait((name, 'chunk', chunk))
+
+            # Health sees whole-response latency, comparable with complete()
+            self.health.record(name, produced, (time.time() - started) * 1000)
+            events.put_nowait((name, 'end', None))
+        except asyncio.CancelledError:
+            if not produced:
+                self.health.release(name)
+            raise
+        except Exception as e:
+            logger.error(f"{name} stream error: {str(e)}")
+            self._error(name, started)
+            events.put_nowait((name, 'error', str(e)))
+
+    def stream(self, message, context, order, mode=None, budget=None):
+        """Return (provider, chunks) from the first provider to produce a token, or (None, None)
+
+        The latency budget and hedging apply to the first token; after that the
+        winner's chunks are relayed until it finishes or stalls for idle_timeout.
+        """
+        budget = budget if budget is not None else self.budget
+        order = self.health.route([name for name in order if name in self.streamers])
+        with self._lock:
+            self._stats['streams'] += 1
+
+        chunks = self.gateway.iterate(
+            self._stream(message, context, order, mode or self.mode, budget),
+            timeout=max(budget, self.idle_timeout) + 1
+        )
+        name = next(chunks, None)
+        if name is None:
+            return None, None
+        return name, chunks
+
+    async def _stream(self, message, context, order, mode, budget):
+        """Yield the winning provider's name, then its chunks"""
+        started = time.time()
+        deadline = started + budget
+        events = asyncio.Queue()
+        waiting = list(order)
+        running = {}  # provider -> pump task
+        winner = None
+        completed = False
+
+        def launch():
+            while waiting:
+                name = waiting.pop(0)
+                if self._allow(name):
+                    running[name] = asyncio.ensure_future(self._pump(name, message, context, deadline, events))
+                    return name
+            return None
+
+        name = launch()
+        if mode == 'race':
+            while waiting:
+                launch()
+        next_hedge = time.time() + self.hedge_delay_for(name) if name else None
+
+        try:
+            while running and winner is None:
+                now = time.time()
+                if now >= deadline:
+                    with self._lock:
+                        self._stats['budget_exhausted'] += 1
+                    self._cancel(running, exhausted=True, started=started)
+                    return
+
+                wait_until = deadline
+                if mode == 'hedged' and waiting:
+                    wait_until = min(deadline, next_hedge)
+
+                try:
+                    name, kind, payload = await asyncio.wait_for(events.get(), max(0, wait_until - now))
+                except asyncio.TimeoutError:
+                    if mode == 'hedged' and waiting and time.time() >= next_hedge:
+                        name = launch()
+                        if name is not None:
+                            next_hedge = time.time() + self.hedge_delay_for(name)
+                            with self._lock:
+                                self._stats['hedges'] += 1
+                    continue
+
+                if name not in running:
+                    continue
+
+                if kind == 'chunk':
+                    winner = name
+                    break
+
+                # That provider ended without producing anything: fall over to the next one
+                del running[name]
+                if not running:
+                    name = launch()
+                    if name is not None:
+                        next_hedge = time.time() + self.hedge_delay_for(name)
+
+            if winner is None:
+                return
+
+            for name, task in running.items():
+                if name != winner:
+                    task.cancel()
+            self._cancel([name for name in running if name != winner], exhausted=False, started=started)
+            with self._lock:
+                self._stats['answered'] += 1
+                self._stats['wins'][winner] += 1
+                self._stats['last_first_token_ms'] = round((time.time() - started) * 1000, 1)
+
+            yield winner
+            yield payload
+            while True:
+                try:
+                    name, kind, payload = await asyncio.wait_for(events.get(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    raise StreamInterrupted(f"{winner} stream stalled for {self.idle_timeout}s")
+                if name != winner:
+                    continue
+                if kind == 'error':
+                    raise StreamInterrupted(f"{winner} stream failed: {payload}")
+                if kind == 'end':
+                    completed = True
+                    return
+                yield payload
+        finally:
+            # Also reached when the consumer goes away (client disconnect)
+            for task in running.values():
+                task.cancel()
+            if winner is not None:
+                with self._lock:
+                    self._stats['streams_completed' if completed else 'streams_abandoned'] += 1
+
+    def stats(self):
+        """Snapshot of dispatch counters"""
+        with self._lock:
+            snapshot = {
+                key: dict(value) if isinstance(value, dict) else value
+                for key, value in self._stats.items()
+            }
+        snapshot['mode'] = self.mode
+        return snapshot
+
+    def shutdown(self):
+        """Stop the gateway if this orchestrator created it"""
+        if self._owns_gateway:
+            self.gateway.stop()
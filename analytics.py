@@ -0,0 +1,182 @@
+"""
+IDFS StarGuide - Analytics Rollups
+Per-user and per-subject assessment totals maintained incrementally
+
+Usage: python analytics.py rebuild [--user USER_ID]
+       python analytics.py check
+"""
+
+import argparse
+import os
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def apply_assessment(cursor, user_id, subject, score, time_taken, achievements_unlocked=0):
+    """Fold one new assessment into the rollups
+
+    Call inside the submitting transaction, after the assessment and any new
+    achievements are inserted. A user with no rollup row yet (history from
+    before rollups existed) is rebuilt from the raw tables instead, which
+    already include this assessment.
+    """
+    if cursor.execute('SELECT 1 FROM user_stats WHERE user_id = ?', (user_id,)).fetchone() is None:
+        rebuild_rollups(cursor, user_id)
+        return
+
+    cursor.execute('''
+        INSERT INTO user_stats (user_id, total_assessments, score_sum, best_score, total_time, achievements_unlocked)
+        VALUES (?, 1, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            total_assessments = total_assessments + 1,
+            score_sum = score_sum + excluded.score_sum,
+            best_score = MAX(best_score, excluded.best_score),
+            total_time = total_time + excluded.total_time,
+            achievements_unlocked = achievements_unlocked + excluded.achievements_unlocked,
+            updated_at = CURRENT_TIMESTAMP
+    ''', (user_id, score, score, time_taken or 0, achievements_unlocked))
+
+    cursor.execute('''
+        INSERT INTO user_subject_stats (user_id, subject, count, score_sum)
+        VALUES (?, ?, 1, ?)
+        ON CONFLICT(user_id, subject) DO UPDATE SET
+            count = count + 1,
+            score_sum = score_sum + excluded.score_sum
+    ''', (user_id, subject, score))
+
+
+def load_user_stats(cursor, user_id):
+    """Rollup rows for the dashboard, rebuilding them once for users with older history"""
+    stats = cursor.execute('''
+        SELECT total_assessments, score_sum, best_score, total_time, achievements_unlocked
+        FROM user_stats WHERE user_id = ?
+    ''', (user_id,)).fetchone()
+
+    if stats is None:
+        rebuild_rollups(cursor, user_id)
+        stats = cursor.execute('''
+            SELECT total_assessments, score_sum, best_score, total_time, achievements_unlocked
+            FROM user_stats WHERE user_id = ?
+        ''', (user_id,)).fetchone()
+
+    subjects = cursor.execute('''
+        SELECT subject, count, score_sum FROM user_subject_stats
+        WHERE user_id = ? AND subject != 'mixed'
+    ''', (user_id,)).fetchall()
+
+    return stats, subjects
+
+
+def rebuild_rollups(cursor, user_id=None):
+    """Recompute rollups from the raw assessments and achievements tables"""
+    user_filter = 'WHERE user_id = ?' if user_id else ''
+    params = (user_id,) if user_id else ()
+
+    cursor.execute(f"DELETE FROM user_stats {user_filter}", params)
+    cursor.execute(f"DELETE FROM user_subject_stats {user_filter}", params)
+
+    if user_id:
+        users_query = 'SELECT ? AS user_id'
+    else:
+        users_query = 'SELECT user_id FROM assessments UNION SELECT user_id FROM achievements'
+
+    cursor.execute(f'''
+        INSERT INTO user_stats (user_id, total_assessments, score_sum, best_score, total_time, achievements_unlocked)
+        SELECT u.user_id,
+               (SELECT COUNT(*) FROM assessments a WHERE a.user_id = u.user_id),
+               (SELECT COALESCE(SUM(score), 0) FROM assessments a WHERE a.user_id = u.user_id),
+               (SELECT COALESCE(MAX(score), 0) FROM assessments a WHERE a.user_id = u.user_id),
+               (SELECT COALESCE(SUM(time_taken), 0) FROM assessments a WHERE a.user_id = u.user_id),
+               (SELECT COUNT(*) FROM achievements h WHERE h.user_id = u.user_id)
+        FROM ({users_query}) u
+        WHERE u.user_id IS NOT NULL
+    ''', params)
+
+    cursor.execute(f'''
+        INSERT INTO user_subject_stats (user_id, subject, count, score_sum)
+        SELECT user_id, subject, COUNT(*), COALESCE(SUM(score), 0)
+        FROM assessments {user_filter}
+        GROUP BY user_id, subject
+    ''', params)
+
+
+def check_rollups(cursor):
+    """Compare rollups against the raw tables and return a list of mismatches"""
+    mismatches = []
+
+    rows = cursor.execute('''
+        SELECT u.user_id,
+               COALESCE(s.total_assessments, 0), COALESCE(s.score_sum, 0), COALESCE(s.best_score, 0),
+               COALESCE(s.total_time, 0), COALESCE(s.achievements_unlocked, 0),
+               (SELECT COUNT(*) FROM assessments a WHERE a.user_id = u.user_id),
+               (SELECT COALESCE(SUM(score), 0) FROM assessments a WHERE a.user_id = u.user_id),
+               (SELECT COALESCE(MAX(score), 0) FROM assessments a WHERE a.user_id = u.user_id),
+               (SELECT COALESCE(SUM(time_taken), 0) FROM assessments a WHERE a.user_id = u.user_id),
+               (SELECT COUNT(*) FROM achievements h WHERE h.user_id = u.user_id)
+        FROM (SELECT user_id FROM assessments UNION SELECT user_id FROM achievements
+              UNION SELECT user_id FROM user_stats) u
+        LEFT JOIN user_stats s ON s.user_id = u.user_id
+        WHERE u.user_id IS NOT NULL
+    ''').fetchall()
+
+    fields = ['total_assessments', 'score_sum', 'best_score', 'total_time', 'achievements_unlocked']
+    for row in rows:
+        for i, field in enumerate(fields):
+            if row[1 + i] != row[6 + i]:
+                mismatches.append({'user_id': row[0], 'field': field, 'rollup': row[1 + i], 'actual': row[6 + i]})
+
+    subject_rows = cursor.execute('''
+        SELECT k.user_id, k.subject,
+               COALESCE(s.count, 0), COALESCE(s.score_sum, 0),
+               COALESCE(a.count, 0), COALESCE(a.score_sum, 0)
+        FROM (SELECT user_id, subject FROM user_subject_stats
+              UNION SELECT user_id, subject FROM assessments) k
+        LEFT JOIN user_subject_stats s ON s.user_id = k.user_id AND s.subject = k.subject
+        LEFT JOIN (
+            SELECT user_id, subject, COUNT(*) AS count, COALESCE(SUM(score), 0) AS score_sum
+            FROM assessments GROUP BY user_id, subject
+        ) a ON a.user_id = k.user_id AND a.subject = k.subject
+        WHERE COALESCE(s.count, 0) != COALESCE(a.count, 0)
+           OR COALESCE(s.score_sum, 0) != COALESCE(a.score_sum, 0)
+    ''').fetchall()
+
+    for row in subject_rows:
+        mismatches.append({
+            'user_id': row[0],
+            'field': f"subject:{row[1]}",
+            'rollup': {'count': row[2], 'score_sum': row[3]},
+            'actual': {'count': row[4], 'score_sum': row[5]}
+        })
+
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain StarGuide analytics rollups')
+    parser.add_argument('command', choices=['rebuild', 'check'])
+    parser.add_argument('--user', help='Only rebuild this user')
+    parser.add_argument('--database', default=os.environ.get('DATABASE_PATH', 'starguide.db'))
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database, timeout=10)
+    cursor = conn.cursor()
+
+    if args.command == 'rebuild':
+        rebuild_rollups(cursor, args.user)
+        conn.commit()
+        print("✅ Analytics rollups rebuilt")
+    else:
+        mismatches = check_rollups(cursor)
+        for mismatch in mismatches:
+            print(f"❌ {mismatch['user_id']} {mismatch['field']}: rollup={mismatch['rollup']} actual={mismatch['actual']}")
+        print(f"{'✅' if not mismatches else '⚠️'} {len(mismatches)} mismatches found")
+        conn.close()
+        raise SystemExit(1 if mismatches else 0)
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
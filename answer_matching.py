@@ -0,0 +1,453 @@
+"""
+IDFS StarGuide - Answer Matching
+Registry of answer matchers built once per question on first use and keyed by question type
+"""
+
+import ast
+import json
+import operator
+import re
+import logging
+from fractions import Fraction
+
+logger = logging.getLogger(__name__)
+
+# Matcher factories by name. A factory takes (correct_answer, options) and returns
+# a callable(user_answer) -> bool, or None when it cannot handle that answer key.
+MATCHERS = {}
+
+# Matchers tried in order for each question type; 'text' is always the last resort
+QUESTION_TYPE_MATCHERS = {
+    'multiple-choice': ('multiple_choice',),
+    'fractions': ('fraction', 'numeric_units'),
+    'probability': ('fraction', 'numeric_units'),
+    'conversion': ('fraction', 'numeric_units'),
+    'percentage': ('numeric_units', 'fraction'),
+    'algebra': ('algebra', 'numeric_units'),
+    'physics': ('numeric_units', 'algebra', 'synonyms'),
+    'chemistry': ('numeric_units', 'synonyms'),
+    'biology': ('numeric_units', 'synonyms'),
+    'vocabulary': ('synonyms',),
+    'grammar': ('synonyms',),
+    'literature': ('synonyms',),
+    'people': ('synonyms',),
+    'ancient': ('synonyms',),
+    'civilizations': ('synonyms',)
+}
+DEFAULT_MATCHERS = ('numeric_units', 'synonyms')
+
+# Accepted alternative answers; every entry in a group matches every other
+SYNONYM_GROUPS = [
+    {'carbon dioxide', 'co2'},
+    {'water', 'h2o'},
+    {'oxygen', 'o2'},
+    {'newton', 'newtons', 'n'},
+    {'mitochondria', 'mitochondrion'},
+    {'shakespeare', 'william shakespeare'},
+    {'george washington', 'washington', 'president washington'},
+    {'great pyramid of giza', 'great pyramid', 'pyramid of giza', 'pyramids of giza'},
+    {'egyptian', 'egyptians', 'ancient egyptians', 'egypt'},
+    {'joyful', 'cheerful', 'glad', 'delighted', 'elated', 'content'},
+    {'kind', 'kindly', 'generous', 'charitable', 'well-meaning', 'caring'},
+    {'?', 'question mark'}
+]
+
+UNITS = {
+    '%': 'percent', 'percent': 'percent',
+    'm/s': 'm/s', 'meters per second': 'm/s', 'metres per second': 'm/s', 'mps': 'm/s',
+    'm': 'm', 'meter': 'm', 'meters': 'm', 'metre': 'm', 'metres': 'm',
+    'cm': 'cm', 'centimeters': 'cm', 'km': 'km', 'kilometers': 'km',
+    'kg': 'kg', 'kilograms': 'kg', 'g': 'g', 'grams': 'g',
+    's': 's', 'sec': 's', 'seconds': 's',
+    'n': 'n', 'newtons': 'n', 'j': 'j', 'joules': 'j',
+    'degrees': 'degrees', '°': 'degrees',
+    'units': 'units', 'square units': 'units^2', 'units^2': 'units^2', 'sq units': 'units^2'
+}
+
+NUMERIC_TOLERANCE = 0.01
+
+# Recent verdicts remembered per question; classmates tend to submit the same answers
+MATCH_CACHE_SIZE = 64
+
+_SUPERSCRIPTS = str.maketrans('⁰¹²³⁴⁵⁶⁷⁸⁹⁻', '0123456789-')
+_SUBSCRIPTS = str.maketrans('₀₁₂₃₄₅₆₇₈₉', '0123456789')
+_SUPERSCRIPT_RUN = re.compile('[⁰¹²³⁴⁵⁶⁷⁸⁹⁻]+')
+_SCIENTIFIC = re.compile(r'^([-+]?\d*\.?\d+)\s*(?:[x×*]\s*10\s*\^?\s*|e)([-+]?\d+)$')
+_NUMBER_WITH_UNIT = re.compile(r'^([-+]?[\d.,]+(?:\s*(?:[x×*]\s*10\s*\^?\s*|e)[-+]?\d+)?(?:\s*/\s*\d+)?)\s*(.*)$')
+_GROUPED_NUMBER = re.compile(r'[-+]?\d{1,3}(,\d{3})+(\.\d+)?')
+_EXPRESSION_CHARACTERS = re.compile(r'[0-9a-z.+\-*/()]+')
+_ASSIGNMENT = re.compile(r'^[a-z]\s*=\s*')
+_IMPLICIT_MULTIPLY = re.compile(r'(?<=[0-9a-z)])(?=[a-z(])|(?<=\))(?=[0-9])')
+_TRAILING_PUNCTUATION = '.,!;:'
+_QUOTES = '"\''
+_ARTICLES = ('the ', 'a ', 'an ')
+_SAMPLE_POINTS = ((0.37, 1.91, -2.53), (1.73, -0.61, 2.29), (-1.19, 2.71, 0.83))
+_MAX_EXPRESSION_LENGTH = 100
+_MAX_POWERS = 4
+
+
+def register_matcher(name):
+    """Decorator adding a matcher factory to the registry"""
+    def decorator(factory):
+        MATCHERS[name] = factory
+        return factory
+    return decorator
+
+
+def compile_matcher(question_type, correct_answer, options=None):
+    """Build the grading callable for one question
+
+    An answer equal to the key after strip() and lower() (the legacy
+    comparison) is accepted straight away. Only other answers reach the
+    question type's matchers, which are built on the first such answer, so
+    loading a question costs one string normalisation.
+    """
+    expected = str(correct_answer).strip().lower()
+    fallback = _memoize(_lazy_matcher(question_type, correct_answer, options))
+
+    def match(answer):
+        return str(answer).strip().lower() == expected or fallback(answer)
+
+    def uncached(answer):
+        return str(answer).strip().lower() == expected or bool(fallback.uncached(answer))
+
+    match.uncached = uncached
+    return match
+
+
+def _lazy_matcher(question_type, correct_answer, options):
+    """Matcher that builds the real one on first use (a race only builds it twice)"""
+    built = []
+
+    def match(answer):
+        if not built:
+            built.append(_build_matcher(question_type, correct_answer, options))
+        return built[0](answer)
+    return match
+
+
+def _build_matcher(question_type, correct_answer, options):
+    """The first registered matcher for the question type that accepts this answer key"""
+    parsed_options = _parse_options(options)
+    if parsed_options:
+        names = ('multiple_choice',)
+    else:
+        names = QUESTION_TYPE_MATCHERS.get(question_type, DEFAULT_MATCHERS)
+
+    for name in names + ('text',):
+        try:
+            matcher = MATCHERS[name](correct_answer, parsed_options)
+        except Exception as e:
+            logger.warning(f"Could not compile {name} matcher for {correct_answer!r}: {str(e)}")
+            matcher = None
+        if matcher is not None:
+            return matcher
+
+    return MATCHERS['text'](correct_answer, parsed_options)
+
+
+def _memoize(matcher):
+    """Wrap a matcher with a small bounded cache of recent verdicts"""
+    verdicts = {}
+
+    def match(answer):
+        verdict = verdicts.get(answer)
+        if verdict is None:
+            verdict = bool(matcher(answer))
+            if len(verdicts) >= MATCH_CACHE_SIZE:
+                try:
+                    verdicts.pop(next(iter(verdicts)), None)
+                except (RuntimeError, StopIteration):
+                    verdicts.clear()
+            verdicts[answer] = verdict
+        return verdict
+
+    match.uncached = matcher
+    return match
+
+
+def _parse_options(options):
+    if not options:
+        return None
+    if isinstance(options, (list, tuple)):
+        return list(options)
+    try:
+        parsed = json.loads(options)
+    except (TypeError, ValueError):
+        return None
+    return parsed if isinstance(parsed, list) and parsed else None
+
+
+def clean_text(answer):
+    """Lowercase, collapse whitespace and turn x² into x^2 and CO₂ into co2"""
+    text = _SUPERSCRIPT_RUN.sub(lambda m: '^' + m.group().translate(_SUPERSCRIPTS), str(answer))
+    text = ' '.join(text.translate(_SUBSCRIPTS).lower().split())
+    stripped = text.rstrip(_TRAILING_PUNCTUATION).strip(_QUOTES).strip()
+    return stripped or text
+
+
+def parse_number(text):
+    """Parse plain, comma-grouped, scientific or fractional numbers; None if not numeric"""
+    return _parse_cleaned(clean_text(text).replace(' ', ''))
+
+
+def _parse_cleaned(text):
+    """parse_number() for text already through clean_text() with spaces removed"""
+    if _GROUPED_NUMBER.fullmatch(text):
+        text = text.replace(',', '')
+
+    match = _SCIENTIFIC.match(text)
+    if match:
+        try:
+            return float(match.group(1)) * 10 ** int(match.group(2))
+        except OverflowError:
+            return None
+
+    if '/' in text:
+        numerator, _, denominator = text.partition('/')
+        try:
+            return float(Fraction(int(numerator), int(denominator)))
+        except (ValueError, ZeroDivisionError):
+            return None
+
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _split_unit(text):
+    text = clean_text(text)
+    match = _NUMBER_WITH_UNIT.match(text)
+    if not match:
+        return None, None
+    value = _parse_cleaned(match.group(1).replace(' ', ''))
+    if value is None:
+        return None, None
+    unit = match.group(2).strip()
+    return value, UNITS.get(unit, unit) if unit else None
+
+
+def _tolerance(correct_text, value):
+    """Half a unit in the last place for scientific notation, otherwise the fixed tolerance"""
+    match = _SCIENTIFIC.match(clean_text(correct_text).replace(' ', ''))
+    if not match:
+        return NUMERIC_TOLERANCE
+    mantissa = match.group(1).lstrip('+-')
+    decimals = len(mantissa.partition('.')[2])
+    return 0.5 * 10 ** (int(match.group(2)) - decimals)
+
+
+@register_matcher('text')
+def text_matcher(correct_answer, options):
+    """Case-insensitive equality with the legacy numeric tolerance"""
+    expected = clean_text(correct_answer)
+    expected_number = parse_number(expected)
+
+    def match(answer):
+        answer = clean_text(answer)
+        if answer == expected:
+            return True
+        if expected_number is not None:
+            value = parse_number(answer)
+            return value is not None and abs(value - expected_number) < NUMERIC_TOLERANCE
+        return False
+    return match
+
+
+@register_matcher('numeric_units')
+def numeric_units_matcher(correct_answer, options):
+    """Numbers with optional units; units must agree when both sides give one"""
+    expected, expected_unit = _split_unit(correct_answer)
+    if expected is None or (expected_unit is not None and expected_unit not in UNITS.values()):
+        return None
+    tolerance = _tolerance(correct_answer, expected)
+
+    def match(answer):
+        value, unit = _split_unit(answer)
+        if value is None or abs(value - expected) > tolerance:
+            return False
+        return unit is None or expected_unit is None or unit == expected_unit
+    return match
+
+
+@register_matcher('fraction')
+def fraction_matcher(correct_answer, options):
+    """Exact fractions in any form; decimals are accepted when correctly rounded"""
+    text = clean_text(correct_answer).replace(' ', '')
+    try:
+        expected = Fraction(text)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+    def match(answer):
+        answer = re.sub(r'^([-+]?)\.', r'\g<1>0.', clean_text(answer).replace(' ', ''))
+        try:
+            value = Fraction(answer)
+        except (ValueError, ZeroDivisionError):
+            return False
+        if value == expected:
+            return True
+
+        # "0.8333" for 5/6: accept decimals rounded to at least two places
+        decimals = len(answer.partition('.')[2]) if '.' in answer and '/' not in answer else 0
+        return decimals >= 2 and abs(value - expected) <= Fraction(1, 2 * 10 ** decimals)
+    return match
+
+
+_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.Pow: operator.pow
+}
+
+
+def _compile_expression(text):
+    """Compile a restricted arithmetic expression like (x+2)(x+3) into a function of its variables
+
+    Returns (function of a name -> value dict, variable names, whether the
+    expression is a product of factors), or (None, None, False) when the text
+    is not a simple expression. The tree is turned into nested closures in
+    one pass, which is much cheaper than compile() for answers seen once.
+    """
+    text = clean_text(text)
+    text = _ASSIGNMENT.sub('', text).replace(' ', '').replace('×', '*').replace('^', '**')
+    if not text or len(text) > _MAX_EXPRESSION_LENGTH or not _EXPRESSION_CHARACTERS.fullmatch(text):
+        return None, None, False
+    text = _IMPLICIT_MULTIPLY.sub('*', text)
+
+    try:
+        tree = ast.parse(text, mode='eval')
+    except SyntaxError:
+        return None, None, False
+
+    names = set()
+    powers = [0]
+    try:
+        function = _closure(tree.body, names, powers)
+    except ValueError:
+        return None, None, False
+
+    factored = '(' in text and isinstance(tree.body, ast.BinOp) and isinstance(tree.body.op, ast.Mult)
+    return function, names, factored
+
+
+def _closure(node, names, powers):
+    """Function evaluating one expression node; raises ValueError for anything not allowed"""
+    if isinstance(node, ast.Constant):
+        value = node.value
+        if type(value) not in (int, float):
+            raise ValueError(value)
+        return lambda env: value
+
+    if isinstance(node, ast.Name):
+        if len(node.id) != 1:
+            raise ValueError(node.id)
+        names.add(node.id)
+        name = node.id
+        return lambda env: env[name]
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        operand = _closure(node.operand, names, powers)
+        if isinstance(node.op, ast.USub):
+            return lambda env: -operand(env)
+        return operand
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+        if isinstance(node.op, ast.Pow):
+            # Keep exponents small so a crafted answer cannot build huge integers
+            powers[0] += 1
+            exponent = node.right
+            if powers[0] > _MAX_POWERS or not (isinstance(exponent, ast.Constant)
+                                               and type(exponent.value) is int and exponent.value <= 10):
+                raise ValueError('exponent')
+        apply = _OPERATORS[type(node.op)]
+        left = _closure(node.left, names, powers)
+        right = _closure(node.right, names, powers)
+        return lambda env: apply(left(env), right(env))
+
+    raise ValueError(type(node).__name__)
+
+
+def _evaluate(function, names, points):
+    return function(dict(zip(sorted(names), points)))
+
+
+@register_matcher('algebra')
+def algebra_matcher(correct_answer, options):
+    """Algebraic equivalence, checked by evaluating both sides at fixed sample points"""
+    code, names, factored = _compile_expression(correct_answer)
+    if code is None or len(names) > len(_SAMPLE_POINTS[0]):
+        return None
+
+    try:
+        expected = [_evaluate(code, names, points) for points in _SAMPLE_POINTS]
+    except (ArithmeticError, TypeError):
+        return None
+
+    def match(answer):
+        answer_code, answer_names, answer_factored = _compile_expression(answer)
+        if answer_code is None or answer_names != names:
+            return False
+
+        # "Factor: ..." questions must be answered in factored form
+        if factored and not answer_factored:
+            return False
+
+        try:
+            for points, value in zip(_SAMPLE_POINTS, expected):
+                if abs(_evaluate(answer_code, answer_names, points) - value) > 1e-9 * max(1.0, abs(value)):
+                    return False
+        except (ArithmeticError, TypeError):
+            return False
+        return True
+    return match
+
+
+def _strip_articles(text):
+    for article in _ARTICLES:
+        if text.startswith(article):
+            return text[len(article):]
+    return text
+
+
+@register_matcher('synonyms')
+def synonyms_matcher(correct_answer, options):
+    """Free-text answers with accepted synonyms, ignoring case and leading articles"""
+    expected = _strip_articles(clean_text(correct_answer))
+    accepted = {expected}
+    for group in SYNONYM_GROUPS:
+        if expected in group:
+            accepted |= group
+
+    def match(answer):
+        return _strip_articles(clean_text(answer)) in accepted
+    return match
+
+
+@register_matcher('multiple_choice')
+def multiple_choice_matcher(correct_answer, options):
+    """Multiple choice answered by 0-based index, option letter or option text"""
+    if not options:
+        return None
+
+    texts = [clean_text(option) for option in options]
+    expected = clean_text(correct_answer)
+    if expected.isdigit() and int(expected) < len(options):
+        correct_index = int(expected)
+    elif expected in texts:
+        correct_index = texts.index(expected)
+    elif len(expected) == 1 and 'a' <= expected < chr(ord('a') + len(options)):
+        correct_index = ord(expected) - ord('a')
+    else:
+        return None
+
+    def match(answer):
+        answer = clean_text(answer)
+
+        # The assessment UI submits the 0-based index of the clicked option
+        if answer.isdigit() and int(answer) < len(options):
+            return int(answer) == correct_index
+        if len(answer) == 1 and 'a' <= answer < chr(ord('a') + len(options)):
+            return ord(answer) - ord('a') == correct_index
+        return answer == texts[correct_index]
+    return match
@@ -3,12 +3,11 @@ IDFS StarGuide - Complete Backend Implementation (100% Feature Complete)
 Multi-provider AI integration with OpenAI, Claude, and Gemini
 """
 
-from flask import Flask, render_template, request, jsonify, session, send_from_directory, Response
+from flask import Flask, render_template, request, jsonify, session, send_from_directory, Response, g, has_app_context
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room, leave_room
 import os
 import json
-import sqlite3
 import random
 import hashlib
 import uuid
@@ -21,7 +20,28 @@ import threading
 import time
 import asyncio
 import aiohttp
-import requests
+import atexit
+from db_pool import ConnectionPool
+from question_bank import QuestionIndex, UsageCounters, AnswerKeyCache
+from achievements import record_assessment
+from analytics import apply_assessment, load_user_stats
+from event_pipeline import EventPipeline
+from ai_orchestrator import ProviderOrchestrator, StreamInterrupted
+from provider_health import HealthRegistry
+from provider_http import ProviderHTTPClient
+from ai_gateway import AIGateway
+from response_cache import ResponseCache, normalize
+from intent_router import IntentRouter
+from conversation_store import ConversationStore
+from rate_limiter import RateLimiter
+from single_flight import SingleFlight, StreamAbandoned
+from state_store import MemoryBackend, StateNamespace, connect_backend, parse_address
+from socket_fanout import BrokerManager
+from pod_chat import PodChat, utc_timestamp
+from pod_directory import PodDirectory
+from timer_wheel import TimerWheel
+from battle_engine import BattleEngine
+from matchmaking import Matchmaker, RatingStore, bot_opponent
 
 # Load environment variables
 load_dotenv()
@@ -34,7 +54,17 @@ app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
 
 # Initialize CORS and SocketIO
 CORS(app, resources={r"/api/*": {"origins": "*"}})
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+
+# With several workers, emits and room changes go through a message queue: tcp://host:port for
+# the broker in socket_fanout.py, or any URL Flask-SocketIO supports (redis://, amqp://)
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+if SOCKETIO_MESSAGE_QUEUE and SOCKETIO_MESSAGE_QUEUE.startswith('tcp://'):
+    socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading',
+                        client_manager=BrokerManager(SOCKETIO_MESSAGE_QUEUE))
+elif SOCKETIO_MESSAGE_QUEUE:
+    socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading', message_queue=SOCKETIO_MESSAGE_QUEUE)
+else:
+    socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -45,36 +75,179 @@ AI_PROVIDERS = {
     'openai': {
         'api_key': os.environ.get('OPENAI_API_KEY'),
         'model': 'gpt-3.5-turbo',
+        'url': os.environ.get('OPENAI_API_BASE', 'https://api.openai.com/v1'),
+        'pool_size': int(os.environ.get('OPENAI_HTTP_POOL_SIZE', os.environ.get('AI_HTTP_POOL_SIZE', 10))),
+        'concurrency': int(os.environ.get('OPENAI_CONCURRENCY', os.environ.get('AI_PROVIDER_CONCURRENCY', 20))),
+        'rate_limit': (
+            int(os.environ.get('OPENAI_RATE_BURST', 20)),
+            float(os.environ.get('OPENAI_RATE_PER_MINUTE', 300))
+        ),
         'available': bool(os.environ.get('OPENAI_API_KEY'))
     },
     'claude': {
         'api_key': os.environ.get('CLAUDE_API_KEY'),
         'model': 'claude-3-sonnet-20240229',
+        'url': os.environ.get('CLAUDE_API_URL', 'https://api.anthropic.com/v1/messages'),
+        'pool_size': int(os.environ.get('CLAUDE_HTTP_POOL_SIZE', os.environ.get('AI_HTTP_POOL_SIZE', 10))),
+        'concurrency': int(os.environ.get('CLAUDE_CONCURRENCY', os.environ.get('AI_PROVIDER_CONCURRENCY', 20))),
+        'rate_limit': (
+            int(os.environ.get('CLAUDE_RATE_BURST', 20)),
+            float(os.environ.get('CLAUDE_RATE_PER_MINUTE', 300))
+        ),
         'available': bool(os.environ.get('CLAUDE_API_KEY'))
     },
     'gemini': {
         'api_key': os.environ.get('GEMINI_API_KEY'),
         'model': 'gemini-pro',
+        'url': os.environ.get('GEMINI_API_URL', 'https://generativelanguage.googleapis.com/v1beta/models'),
+        'pool_size': int(os.environ.get('GEMINI_HTTP_POOL_SIZE', os.environ.get('AI_HTTP_POOL_SIZE', 10))),
+        'concurrency': int(os.environ.get('GEMINI_CONCURRENCY', os.environ.get('AI_PROVIDER_CONCURRENCY', 20))),
+        'rate_limit': (
+            int(os.environ.get('GEMINI_RATE_BURST', 20)),
+            float(os.environ.get('GEMINI_RATE_PER_MINUTE', 300))
+        ),
         'available': bool(os.environ.get('GEMINI_API_KEY'))
     }
 }
 
+# Provider I/O runs as coroutines on one event loop thread
+ai_gateway = AIGateway()
+ai_gateway.start()
+
+# Pooled keep-alive HTTP sessions, one per provider, each capped at its concurrency quota
+provider_http = {
+    name: ProviderHTTPClient(
+        name,
+        pool_size=config['pool_size'],
+        concurrency=config['concurrency'],
+        connect_timeout=float(os.environ.get('AI_CONNECT_TIMEOUT', 3.05)),
+        read_timeout=float(os.environ.get('AI_READ_TIMEOUT', 30))
+    )
+    for name, config in AI_PROVIDERS.items()
+}
+
+async def close_provider_http():
+    for client in provider_http.values():
+        await client.close()
+
+atexit.register(ai_gateway.stop, close_provider_http)
+
 # Initialize OpenAI
 if AI_PROVIDERS['openai']['available']:
     openai.api_key = AI_PROVIDERS['openai']['api_key']
-
-# Global state
-online_users = {}
-active_battles = {}
-active_pods = {}
+    openai.api_base = AI_PROVIDERS['openai']['url']
+
+# Live state shared by request threads and Socket.IO handlers; STATE_STORE_ADDRESS points
+# every worker at one store served by `python state_store.py --authkey` with the same STATE_STORE_AUTHKEY
+if os.environ.get('STATE_STORE_ADDRESS'):
+    if not os.environ.get('STATE_STORE_AUTHKEY'):
+        # Never fall back to SECRET_KEY: unset, it is random per process and every worker would fail to authenticate
+        raise RuntimeError("STATE_STORE_ADDRESS is set but STATE_STORE_AUTHKEY is not; set it to the "
+                           "--authkey the state store was started with")
+    state_backend = connect_backend(
+        parse_address(os.environ['STATE_STORE_ADDRESS']),
+        os.environ['STATE_STORE_AUTHKEY'].encode()
+    )
+else:
+    state_backend = MemoryBackend(
+        shards=int(os.environ.get('STATE_SHARDS', 16)),
+        sweep_interval=float(os.environ.get('STATE_SWEEP_INTERVAL', 30))
+    )
+    state_backend.start()
+    atexit.register(state_backend.stop)
+
+online_users = StateNamespace(
+    state_backend, 'online_users',
+    ttl=float(os.environ['STATE_ONLINE_TTL']) if os.environ.get('STATE_ONLINE_TTL') else None
+)
+active_battles = StateNamespace(state_backend, 'battles', ttl=float(os.environ.get('STATE_BATTLE_TTL', 1800)))
+active_pods = StateNamespace(state_backend, 'pods', ttl=float(os.environ.get('STATE_POD_TTL', 7200)))
+question_index = QuestionIndex()
+
+# Database connection pool
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'starguide.db')
+db_pool = ConnectionPool(
+    DATABASE_PATH,
+    max_size=int(os.environ.get('DB_POOL_SIZE', 8)),
+    checkout_timeout=float(os.environ.get('DB_POOL_TIMEOUT', 5))
+)
+atexit.register(db_pool.close_all)
+
+# Question usage/success counters are buffered and written in batches
+question_counters = UsageCounters(
+    db_pool.connection,
+    interval=float(os.environ.get('QUESTION_COUNTER_FLUSH_INTERVAL', 5)),
+    max_pending=int(os.environ.get('QUESTION_COUNTER_MAX_PENDING', 500))
+)
+
+# Analytics events are queued and written in batches by a background thread
+analytics_events = EventPipeline(
+    db_pool.connection,
+    max_queue=int(os.environ.get('ANALYTICS_QUEUE_SIZE', 10000)),
+    batch_size=int(os.environ.get('ANALYTICS_BATCH_SIZE', 500)),
+    flush_interval=float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', 1)),
+    spill_dir=os.environ.get('ANALYTICS_SPILL_DIR'),
+    spill_format=os.environ.get('ANALYTICS_SPILL_FORMAT', 'ndjson')
+)
+
+# Pod chat: broadcast first, recent history from memory, rows group-committed in the background
+pod_chat = PodChat(
+    db_pool.connection,
+    history_size=int(os.environ.get('POD_HISTORY_SIZE', 50)),
+    max_pods=int(os.environ.get('POD_HISTORY_MAX_PODS', 5000)),
+    max_queue=int(os.environ.get('POD_MESSAGE_QUEUE_SIZE', 10000)),
+    batch_size=int(os.environ.get('POD_MESSAGE_BATCH_SIZE', 500)),
+    flush_interval=float(os.environ.get('POD_MESSAGE_FLUSH_INTERVAL', 0.2))
+)
+
+# Pod list from memory; member counts follow joins and leaves, create_pod() invalidates it
+pod_directory = PodDirectory(db_pool.connection, max_age=float(os.environ.get('POD_DIRECTORY_MAX_AGE', 30)))
+
+# Answer keys are preloaded; call answer_keys.invalidate(question_id) after editing a question
+answer_keys = AnswerKeyCache(db_pool.connection)
+
+# Battles: question sets preloaded at match time, AI turns and deadlines on one timer wheel
+battle_timers = TimerWheel(tick=float(os.environ.get('BATTLE_TIMER_TICK', 0.1)))
+battle_engine = BattleEngine(
+    active_battles,
+    question_index,
+    answer_keys,
+    db_pool.connection,
+    battle_timers,
+    notify=lambda user_id, event, payload: socketio.emit(event, payload, room=f'user_{user_id}'),
+    questions_per_battle=int(os.environ.get('BATTLE_QUESTIONS', 5)),
+    time_limit=float(os.environ.get('BATTLE_TIME_LIMIT', 300)),
+    on_finish=lambda battle: battle_ratings.record_battle(battle)
+)
+
+# Matchmaking: Glicko ratings written behind, rating-band queue with a bot after BATTLE_BOT_AFTER seconds
+battle_ratings = RatingStore(db_pool.connection, interval=float(os.environ.get('RATING_FLUSH_INTERVAL', 5)))
+matchmaker = Matchmaker(
+    band_size=int(os.environ.get('MATCH_BAND_SIZE', 50)),
+    base_window=float(os.environ.get('MATCH_BASE_WINDOW', 100)),
+    widen_rate=float(os.environ.get('MATCH_WIDEN_RATE', 10)),
+    max_window=float(os.environ.get('MATCH_MAX_WINDOW', 400)),
+    bot_after=float(os.environ.get('BATTLE_BOT_AFTER', 20)),
+    on_match=lambda ticket, opponent: start_match(ticket, opponent)
+)
 
 # Database helper
 def get_db():
-    """Get database connection with row factory"""
-    db = sqlite3.connect('starguide.db', timeout=10)
-    db.row_factory = sqlite3.Row
+    """Check out a pooled connection; close() returns it to the pool"""
+    db = db_pool.acquire()
+
+    # Track checkouts so request teardown can reclaim any that were not closed
+    if has_app_context():
+        g.setdefault('db_checkouts', []).append(db)
+
     return db
 
+@app.teardown_appcontext
+def release_db(exception):
+    """Return connections left open by a request (e.g. on error paths)"""
+    for db in g.pop('db_checkouts', []):
+        db_pool.reclaim(db)
+
 def init_db():
     """Initialize database with all required tables"""
     db = get_db()
@@ -130,7 +303,9 @@ def init_db():
         hint TEXT,
         tags TEXT,
         usage_count INTEGER DEFAULT 0,
-        success_rate REAL DEFAULT 0
+        success_rate REAL DEFAULT 0,
+        attempt_count INTEGER DEFAULT 0,
+        correct_count INTEGER DEFAULT 0
     );
 
     -- Achievements
@@ -142,6 +317,40 @@ def init_db():
         FOREIGN KEY (user_id) REFERENCES users (id)
     );
 
+    -- Per-user achievement progress counters
+    CREATE TABLE IF NOT EXISTS user_progress (
+        user_id TEXT PRIMARY KEY,
+        assessment_count INTEGER DEFAULT 0,
+        best_score INTEGER DEFAULT 0,
+        high_score_count INTEGER DEFAULT 0,
+        perfect_count INTEGER DEFAULT 0,
+        streak INTEGER DEFAULT 0,
+        last_assessment_date DATE,
+        unlocked TEXT DEFAULT '',
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    );
+
+    -- Analytics rollups maintained by submit_assessment()
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user_id TEXT PRIMARY KEY,
+        total_assessments INTEGER DEFAULT 0,
+        score_sum INTEGER DEFAULT 0,
+        best_score INTEGER DEFAULT 0,
+        total_time INTEGER DEFAULT 0,
+        achievements_unlocked INTEGER DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS user_subject_stats (
+        user_id TEXT,
+        subject TEXT,
+        count INTEGER DEFAULT 0,
+        score_sum INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, subject),
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    );
+
     -- Battle history
     CREATE TABLE IF NOT EXISTS battles (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -156,6 +365,16 @@ def init_db():
         FOREIGN KEY (user_id) REFERENCES users (id)
     );
 
+    -- Battle ratings (Glicko)
+    CREATE TABLE IF NOT EXISTS player_ratings (
+        user_id TEXT PRIMARY KEY,
+        rating REAL,
+        deviation REAL,
+        games INTEGER DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    );
+
     -- Learning pods
     CREATE TABLE IF NOT EXISTS learning_pods (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -272,6 +491,9 @@ def init_db():
         message TEXT,
         response TEXT,
         response_time INTEGER,
+        cache_status TEXT,
+        saved_ms INTEGER DEFAULT 0,
+        first_token_ms INTEGER,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (user_id) REFERENCES users (id)
     );
@@ -281,10 +503,31 @@ def init_db():
     CREATE INDEX IF NOT EXISTS idx_achievements_user ON achievements(user_id);
     CREATE INDEX IF NOT EXISTS idx_battles_user ON battles(user_id);
     CREATE INDEX IF NOT EXISTS idx_analytics_user ON analytics_events(user_id);
+    CREATE INDEX IF NOT EXISTS idx_analytics_user_created ON analytics_events(user_id, created_at);
     CREATE INDEX IF NOT EXISTS idx_ai_chat_user ON ai_chat_logs(user_id);
+    CREATE INDEX IF NOT EXISTS idx_pod_messages_pod ON pod_messages(pod_id, id);
     '''
 
     db.executescript(schema)
+
+    # Add columns introduced after the original schema to existing databases
+    migrations = {
+        'questions': [
+            ('attempt_count', 'INTEGER DEFAULT 0'),
+            ('correct_count', 'INTEGER DEFAULT 0')
+        ],
+        'ai_chat_logs': [
+            ('cache_status', 'TEXT'),
+            ('saved_ms', 'INTEGER DEFAULT 0'),
+            ('first_token_ms', 'INTEGER')
+        ]
+    }
+    for table, columns in migrations.items():
+        existing = {row['name'] for row in db.execute(f"PRAGMA table_info({table})")}
+        for column, definition in columns:
+            if column not in existing:
+                db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
     db.commit()
     db.close()
     logger.info("Database initialized successfully")
@@ -358,6 +601,7 @@ def populate_question_bank():
             q['hint'],
             q.get('explanation', f"The correct answer is {q['correct_answer']}")
         ))
+        question_index.add(cursor.lastrowid, q['subject'], q['difficulty'])
 
     db.commit()
     db.close()
@@ -372,6 +616,21 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'success': False, 'error': 'Authentication required'}), 401
+
+        db = get_db()
+        user = db.execute('SELECT role FROM users WHERE id = ?', (session['user_id'],)).fetchone()
+        db.close()
+
+        if not user or user['role'] != 'admin':
+            return jsonify({'success': False, 'error': 'Admin access required'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 # Routes
 @app.route('/')
 def index():
@@ -387,11 +646,48 @@ def send_static(path):
 
 @app.route('/api/ai-providers-status', methods=['GET'])
 def ai_providers_status():
-    """Get AI provider availability status"""
+    """Get AI provider availability and live health"""
+    health = provider_health.snapshot()
+
+    # Top-level flags stay booleans: configured and not currently tripped
+    status = {
+        name: config['available'] and health[name]['state'] != 'open'
+        for name, config in AI_PROVIDERS.items()
+    }
+    status['health'] = {
+        name: dict(health[name], configured=config['available'])
+        for name, config in AI_PROVIDERS.items()
+    }
+    return jsonify(status)
+
+@app.route('/api/admin/metrics', methods=['GET'])
+@admin_required
+def admin_metrics():
+    """Get internal performance counters for monitoring"""
     return jsonify({
-        'openai': AI_PROVIDERS['openai']['available'],
-        'claude': AI_PROVIDERS['claude']['available'],
-        'gemini': AI_PROVIDERS['gemini']['available']
+        'success': True,
+        'metrics': {
+            'dbPool': db_pool.stats(),
+            'questionCounters': question_counters.stats(),
+            'answerKeys': answer_keys.stats(),
+            'analyticsEvents': analytics_events.stats(),
+            'aiDispatch': ai_orchestrator.stats(),
+            'providerHttp': {name: client.stats() for name, client in provider_http.items()},
+            'aiGateway': ai_gateway.stats(),
+            'rateLimits': rate_limiter.stats(),
+            'coalescing': ai_flights.stats(),
+            'liveState': state_backend.stats(),
+            'podChat': pod_chat.stats(),
+            'podDirectory': pod_directory.stats(),
+            'battles': battle_engine.stats(),
+            'battleTimers': battle_timers.stats(),
+            'matchmaking': matchmaker.stats(),
+            'ratings': battle_ratings.stats(),
+            'socketFanout': socketio.server.manager.stats() if isinstance(socketio.server.manager, BrokerManager) else None,
+            'responseCache': response_cache.stats(),
+            'fallbackRouter': fallback_router.stats(),
+            'conversations': conversations.stats()
+        }
     })
 
 @app.route('/api/demo-login', methods=['POST'])
@@ -423,14 +719,15 @@ def demo_login():
         session['user_id'] = demo_id
         session['username'] = demo_username
         session['is_demo'] = True
+        session['role'] = 'student'
         session.permanent = True
 
         # Track online user
-        online_users[demo_id] = {
+        online_users.set(demo_id, {
             'username': demo_username,
             'level': 1,
             'status': 'online'
-        }
+        })
 
         # Emit online users update
         socketio.emit('online_users_update', {'count': len(online_users)})
@@ -463,9 +760,9 @@ def logout():
         user_id = session.get('user_id')
 
         # Remove from online users
-        if user_id in online_users:
-            del online_users[user_id]
+        if online_users.delete(user_id):
             socketio.emit('online_users_update', {'count': len(online_users)})
+        matchmaker.cancel(user_id)
 
         # Clear session
         session.clear()
@@ -541,42 +838,46 @@ def ai_chat():
         data = request.json
         message = data.get('message', '')
         provider = data.get('provider', 'openai')
-        context = data.get('context', '')
+        conversation_id = data.get('conversationId')
+        context = chat_context(session['user_id'], conversation_id, message, data.get('context', ''))
         stream = data.get('stream', False)
 
-        start_time = time.time()
-
-        # Try the requested provider first
-        response = None
-
-        if AI_PROVIDERS.get(provider, {}).get('available'):
-            try:
-                if provider == 'openai':
-                    response = call_openai(message, context, stream)
-                elif provider == 'claude':
-                    response = call_claude(message, context)
-                elif provider == 'gemini':
-                    response = call_gemini(message, context)
-            except Exception as e:
-                logger.error(f"{provider} error: {str(e)}")
+        # Every provider streams token chunks; the log row is written when the stream ends
+        if stream:
+            chat = open_chat_stream(session['user_id'], conversation_id, message, context, provider)
+            return Response(
+                stream_response(chat),
+                mimetype='text/event-stream',
+                headers={
+                    'Cache-Control': 'no-cache',
+                    'Connection': 'keep-alive',
+                    'X-Accel-Buffering': 'no'
+                }
+            )
 
-        # Fallback to other providers
-        if not response:
-            for fallback_provider, config in AI_PROVIDERS.items():
-                if fallback_provider != provider and config['available']:
-                    try:
-                        if fallback_provider == 'openai':
-                            response = call_openai(message, context)
-                        elif fallback_provider == 'claude':
-                            response = call_claude(message, context)
-                        elif fallback_provider == 'gemini':
-                            response = call_gemini(message, context)
-
-                        if response:
-                            provider = fallback_provider  # Update to successful provider
-                            break
-                    except Exception as e:
-                        logger.error(f"{fallback_provider} fallback error: {str(e)}")
+        start_time = time.time()
+        requested = provider
+        saved_ms = 0
+
+        # Repeated and near-identical prompts are answered from the response cache
+        cached = response_cache.get(message, context, requested)
+        if cached:
+            response, provider = cached.response, cached.provider
+            cache_status, saved_ms = cached.tier, cached.response_time
+        else:
+            cache_status = 'miss'
+            response = None
+            # Throttled users get a local answer rather than an error
+            if rate_limiter.allow_user(session['user_id'], user_role()):
+                (response, provider), coalesced = ai_flights.do(
+                    flight_key(message, context, requested),
+                    lambda: ai_orchestrator.complete(message, context, provider_order(requested))
+                )
+                if coalesced:
+                    cache_status = 'coalesced'
+            if response and cache_status == 'miss':
+                response_cache.put(message, context, requested, response, provider,
+                                   int((time.time() - start_time) * 1000))
 
         # Final fallback to local responses
         if not response:
@@ -586,40 +887,15 @@ def ai_chat():
         response_time = int((time.time() - start_time) * 1000)
 
         # Log chat interaction
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('''
-            INSERT INTO ai_chat_logs (user_id, provider, message, response, response_time)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (session['user_id'], provider, message[:500], response[:1000], response_time))
-
-        cursor.execute('''
-            INSERT INTO analytics_events (user_id, event_type, event_data)
-            VALUES (?, ?, ?)
-        ''', (session['user_id'], 'ai_chat', json.dumps({
-            'provider': provider,
-            'message_length': len(message),
-            'response_time': response_time
-        })))
-
-        db.commit()
-        db.close()
-
-        if stream and provider in ['openai']:
-            return Response(
-                stream_response(response),
-                mimetype='text/plain',
-                headers={
-                    'Cache-Control': 'no-cache',
-                    'Connection': 'keep-alive'
-                }
-            )
+        log_chat(session['user_id'], provider, message, response, response_time, cache_status, saved_ms)
+        conversations.add_exchange(session['user_id'], conversation_id, message, response)
 
         return jsonify({
             'success': True,
             'response': response,
             'provider': provider,
-            'responseTime': response_time
+            'responseTime': response_time,
+            'cache': cache_status
         })
 
     except Exception as e:
@@ -630,15 +906,14 @@ def ai_chat():
             'provider': 'local'
         })
 
-def call_openai(message, context, stream=False):
-    """Call OpenAI API"""
-    if not AI_PROVIDERS['openai']['available']:
-        raise Exception("OpenAI not available")
+STARMENTOR_PROMPT = "You are StarMentor, an encouraging AI tutor for K-12 students. Be friendly, helpful, and use space/star metaphors when appropriate."
 
+def openai_messages(message, context):
+    """Chat messages for the OpenAI API"""
     messages = [
         {
             "role": "system",
-            "content": "You are StarMentor, an encouraging AI tutor for K-12 students. Be friendly, helpful, and use space/star metaphors when appropriate. Keep responses concise but informative."
+            "content": f"{STARMENTOR_PROMPT} Keep responses concise but informative."
         }
     ]
 
@@ -646,32 +921,17 @@ def call_openai(message, context, stream=False):
         messages.append({"role": "assistant", "content": f"Previous context: {context}"})
 
     messages.append({"role": "user", "content": message})
+    return messages
 
-    response = openai.ChatCompletion.create(
-        model=AI_PROVIDERS['openai']['model'],
-        messages=messages,
-        max_tokens=300,
-        temperature=0.7,
-        stream=stream
-    )
-
-    if stream:
-        return response
-    else:
-        return response.choices[0].message.content
-
-def call_claude(message, context):
-    """Call Claude API"""
-    if not AI_PROVIDERS['claude']['available']:
-        raise Exception("Claude not available")
-
+def claude_request(message, context, stream=False):
+    """Headers and body for the Claude messages API"""
     headers = {
         'Content-Type': 'application/json',
         'x-api-key': AI_PROVIDERS['claude']['api_key'],
         'anthropic-version': '2023-06-01'
     }
 
-    prompt = f"You are StarMentor, an encouraging AI tutor for K-12 students. Be friendly, helpful, and use space/star metaphors when appropriate.\n\n"
+    prompt = f"{STARMENTOR_PROMPT}\n\n"
     if context:
         prompt += f"Previous context: {context}\n\n"
     prompt += f"Human: {message}\n\nAssistant:"
@@ -686,27 +946,17 @@ def call_claude(message, context):
             }
         ]
     }
+    if stream:
+        data['stream'] = True
 
-    response = requests.post(
-        'https://api.anthropic.com/v1/messages',
-        headers=headers,
-        json=data,
-        timeout=30
-    )
-
-    if response.status_code == 200:
-        return response.json()['content'][0]['text']
-    else:
-        raise Exception(f"Claude API error: {response.status_code}")
-
-def call_gemini(message, context):
-    """Call Gemini API"""
-    if not AI_PROVIDERS['gemini']['available']:
-        raise Exception("Gemini not available")
+    return headers, data
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent?key={AI_PROVIDERS['gemini']['api_key']}"
+def gemini_request(message, context, stream=False):
+    """URL and body for the Gemini generateContent (or SSE streaming) API"""
+    method = 'streamGenerateContent?alt=sse&' if stream else 'generateContent?'
+    url = f"{AI_PROVIDERS['gemini']['url']}/{AI_PROVIDERS['gemini']['model']}:{method}key={AI_PROVIDERS['gemini']['api_key']}"
 
-    prompt = f"You are StarMentor, an encouraging AI tutor for K-12 students. Be friendly, helpful, and use space/star metaphors when appropriate.\n\n"
+    prompt = f"{STARMENTOR_PROMPT}\n\n"
     if context:
         prompt += f"Previous context: {context}\n\n"
     prompt += f"Question: {message}"
@@ -727,127 +977,355 @@ def call_gemini(message, context):
         }
     }
 
-    response = requests.post(url, json=data, timeout=30)
+    return url, data
 
-    if response.status_code == 200:
-        result = response.json()
+async def call_openai(message, context, timeout=30):
+    """Call OpenAI API"""
+    if not AI_PROVIDERS['openai']['available']:
+        raise Exception("OpenAI not available")
+
+    client = provider_http['openai']
+    async with client.slot():
+        # openai reads its aiohttp session from a context variable, set per task
+        openai.aiosession.set(client.session)
+        response = await openai.ChatCompletion.acreate(
+            model=AI_PROVIDERS['openai']['model'],
+            messages=openai_messages(message, context),
+            max_tokens=300,
+            temperature=0.7,
+            request_timeout=(min(client.connect_timeout, timeout), timeout)
+        )
+
+    return response.choices[0].message.content
+
+async def call_claude(message, context, timeout=30):
+    """Call Claude API"""
+    if not AI_PROVIDERS['claude']['available']:
+        raise Exception("Claude not available")
+
+    headers, data = claude_request(message, context)
+
+    status, result = await provider_http['claude'].post_json(
+        AI_PROVIDERS['claude']['url'],
+        headers=headers,
+        json=data,
+        timeout=timeout
+    )
+
+    if status == 200:
+        return result['content'][0]['text']
+    else:
+        raise Exception(f"Claude API error: {status}")
+
+async def call_gemini(message, context, timeout=30):
+    """Call Gemini API"""
+    if not AI_PROVIDERS['gemini']['available']:
+        raise Exception("Gemini not available")
+
+    url, data = gemini_request(message, context)
+
+    status, result = await provider_http['gemini'].post_json(url, json=data, timeout=timeout)
+
+    if status == 200:
         return result['candidates'][0]['content']['parts'][0]['text']
     else:
-        raise Exception(f"Gemini API error: {response.status_code}")
+        raise Exception(f"Gemini API error: {status}")
 
-def stream_response(response):
-    """Stream OpenAI response"""
-    for chunk in response:
-        if chunk.choices[0].delta.get('content'):
-            content = chunk.choices[0].delta.content
+# Streaming variants: each yields text chunks as the provider produces them
+async def stream_openai(message, context, timeout=30):
+    """Stream OpenAI API tokens"""
+    if not AI_PROVIDERS['openai']['available']:
+        raise Exception("OpenAI not available")
+
+    client = provider_http['openai']
+    async with client.slot():
+        openai.aiosession.set(client.session)
+        response = await openai.ChatCompletion.acreate(
+            model=AI_PROVIDERS['openai']['model'],
+            messages=openai_messages(message, context),
+            max_tokens=300,
+            temperature=0.7,
+            stream=True,
+            request_timeout=(min(client.connect_timeout, timeout), timeout)
+        )
+        async for chunk in response:
+            content = chunk.choices[0].delta.get('content')
+            if content:
+                yield content
+
+async def stream_claude(message, context, timeout=30):
+    """Stream Claude API tokens"""
+    if not AI_PROVIDERS['claude']['available']:
+        raise Exception("Claude not available")
+
+    headers, data = claude_request(message, context, stream=True)
+    events = provider_http['claude'].post_events(
+        AI_PROVIDERS['claude']['url'],
+        headers=headers,
+        json=data,
+        timeout=timeout
+    )
+
+    async for event in events:
+        if event.get('type') == 'content_block_delta':
+            yield event['delta'].get('text', '')
+        elif event.get('type') == 'message_stop':
+            break
+        elif event.get('type') == 'error':
+            raise Exception(f"Claude API error: {event.get('error')}")
+
+async def stream_gemini(message, context, timeout=30):
+    """Stream Gemini API tokens"""
+    if not AI_PROVIDERS['gemini']['available']:
+        raise Exception("Gemini not available")
+
+    url, data = gemini_request(message, context, stream=True)
+
+    async for event in provider_http['gemini'].post_events(url, json=data, timeout=timeout):
+        for candidate in event.get('candidates', [])[:1]:
+            for part in candidate.get('content', {}).get('parts', []):
+                yield part.get('text', '')
+
+# Provider health: rolling error rates, latency histograms and circuit breakers
+provider_health = HealthRegistry(
+    list(AI_PROVIDERS),
+    routing_slack=float(os.environ.get('AI_ROUTING_SLACK', 2)),
+    window=float(os.environ.get('AI_HEALTH_WINDOW', 60)),
+    min_calls=int(os.environ.get('AI_BREAKER_MIN_CALLS', 5)),
+    failure_threshold=float(os.environ.get('AI_BREAKER_FAILURE_RATE', 0.5)),
+    consecutive_failures=int(os.environ.get('AI_BREAKER_CONSECUTIVE_FAILURES', 5)),
+    cooldown=float(os.environ.get('AI_BREAKER_COOLDOWN', 30))
+)
+
+# AI chat rate limits: (burst, refill per minute) per user by role, and per provider quota
+AI_RATE_LIMITS = {
+    role: (
+        int(os.environ.get(f'AI_RATE_{role.upper()}_BURST', burst)),
+        float(os.environ.get(f'AI_RATE_{role.upper()}_PER_MINUTE', per_minute))
+    )
+    for role, burst, per_minute in (('student', 5, 10), ('teacher', 10, 30), ('admin', 20, 60))
+}
+rate_limiter = RateLimiter(
+    AI_RATE_LIMITS,
+    provider_limits={name: config['rate_limit'] for name, config in AI_PROVIDERS.items()}
+)
+
+# Provider dispatch: sequential, raced or hedged under a per-request latency budget
+ai_orchestrator = ProviderOrchestrator(
+    {'openai': call_openai, 'claude': call_claude, 'gemini': call_gemini},
+    mode=os.environ.get('AI_DISPATCH_MODE', 'hedged'),
+    hedge_delay=float(os.environ['AI_HEDGE_DELAY']) if os.environ.get('AI_HEDGE_DELAY') else None,
+    budget=float(os.environ.get('AI_LATENCY_BUDGET', 20)),
+    health=provider_health,
+    streamers={'openai': stream_openai, 'claude': stream_claude, 'gemini': stream_gemini},
+    idle_timeout=float(os.environ.get('AI_READ_TIMEOUT', 30)),
+    gateway=ai_gateway,
+    admit=rate_limiter.allow_provider
+)
+atexit.register(ai_orchestrator.shutdown)
+
+# Server-side tutoring history; providers get a token-budgeted slice of it as context
+conversations = ConversationStore(
+    max_turns=int(os.environ.get('AI_CONVERSATION_TURNS', 20)),
+    max_conversations=int(os.environ.get('AI_CONVERSATION_MAX', 10000)),
+    max_bytes=int(os.environ.get('AI_CONVERSATION_MAX_MB', 64)) * 1024 * 1024,
+    idle_ttl=float(os.environ.get('AI_CONVERSATION_IDLE_TTL', 7200)),
+    token_budget=int(os.environ.get('AI_CONTEXT_TOKENS', 400))
+)
+
+# Local responses when no provider answers; topics and keywords live in fallback_intents.json
+fallback_router = IntentRouter.from_file(os.environ.get(
+    'FALLBACK_INTENTS_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fallback_intents.json')
+))
+
+# Provider answers are reused for repeated and near-identical prompts
+response_cache = ResponseCache(
+    ttl=float(os.environ.get('AI_CACHE_TTL', 3600)),
+    max_entries=int(os.environ.get('AI_CACHE_MAX_ENTRIES', 5000)),
+    max_bytes=int(os.environ.get('AI_CACHE_MAX_MB', 32)) * 1024 * 1024,
+    similarity_threshold=float(os.environ.get('AI_CACHE_SIMILARITY', 0.8))
+)
+
+# Identical prompts in flight at the same time (a projected question) share one provider call
+ai_flights = SingleFlight()
+
+def flight_key(message, context, provider):
+    return (normalize(message), normalize(context), provider)
+
+def stream_response(chat):
+    """Format a chat stream as server-sent events"""
+    try:
+        for content in chat['chunks']:
             yield f"data: {json.dumps({'content': content})}\n\n"
+    except (StreamInterrupted, StreamAbandoned) as e:
+        logger.error(f"AI stream error: {str(e)}")
 
-    yield f"data: {json.dumps({'done': True})}\n\n"
+    yield f"data: {json.dumps({'done': True, 'provider': chat['provider'], 'cache': chat['cache']})}\n\n"
 
-def generate_fallback_response(message, context):
-    """Generate enhanced fallback responses"""
-    message_lower = message.lower()
-
-    # Advanced keyword matching with more sophisticated responses
-    if any(word in message_lower for word in ['math', 'calculate', 'solve', 'equation', 'algebra']):
-        responses = [
-            "🔢 Math is the universal language! Whether you're working with basic arithmetic or advanced calculus, remember to break problems into smaller steps. What specific math concept would you like to explore?",
-            "✨ Numbers are like stars in the cosmos - they follow patterns and rules that help us understand the universe! What mathematical challenge can I help you navigate?",
-            "🚀 Every great space explorer needs strong math skills! From calculating trajectories to understanding data, math powers our journey through knowledge. What problem are we solving?"
-        ]
-        return random.choice(responses)
+def provider_order(provider):
+    """Configured providers, requested one first; the orchestrator reorders by health"""
+    order = [provider] + [name for name in AI_PROVIDERS if name != provider]
+    return [name for name in order if AI_PROVIDERS.get(name, {}).get('available')]
 
-    elif any(word in message_lower for word in ['science', 'biology', 'chemistry', 'physics', 'experiment']):
-        responses = [
-            "🔬 Science is like exploring uncharted galaxies - every discovery leads to new questions! The scientific method is your spaceship: observe, hypothesize, test, and conclude. What scientific mystery are we investigating?",
-            "⚗️ From the smallest atoms to the largest galaxies, science helps us understand how everything works! What aspect of our amazing universe would you like to explore?",
-            "🌟 Science is everywhere around us! Whether it's the chemistry of stars, the biology of life, or the physics of motion, there's always something fascinating to discover. What's sparking your curiosity?"
-        ]
-        return random.choice(responses)
+def user_role():
+    """The signed-in user's role, looked up once per session"""
+    if 'role' not in session:
+        db = get_db()
+        user = db.execute('SELECT role FROM users WHERE id = ?', (session['user_id'],)).fetchone()
+        db.close()
+        session['role'] = user['role'] if user else None
+    return session['role']
 
-    elif any(word in message_lower for word in ['english', 'writing', 'grammar', 'literature', 'reading']):
-        responses = [
-            "📚 Language is the bridge between minds! Whether you're crafting the perfect sentence or analyzing great literature, words have the power to change the world. What writing or reading challenge can I help with?",
-            "✍️ Every word is a star, and every sentence is a constellation! Strong communication skills will serve you well throughout your cosmic journey. What aspect of English are we working on?",
-            "🎭 From Shakespeare's sonnets to modern stories, literature connects us across time and space! Grammar gives structure to our thoughts. What language arts adventure shall we embark on?"
-        ]
-        return random.choice(responses)
+def chat_context(user_id, conversation_id, message, client_context):
+    """Provider context from the server-side conversation, or the client's as a fallback"""
+    context = conversations.context_for(user_id, conversation_id, message)
 
-    elif any(word in message_lower for word in ['help', 'stuck', 'confused', "don't understand", 'difficult']):
-        responses = [
-            "🤝 Every star explorer faces challenges - that's how we grow stronger! Remember, confusion is just curiosity in disguise. Let's break down whatever you're working on into smaller, manageable pieces. What specific part is giving you trouble?",
-            "💪 Getting stuck is part of the learning process! Even the greatest minds in history faced moments of uncertainty. The key is persistence and asking the right questions. What can we tackle together?",
-            "🧭 When the path gets foggy, we navigate by the stars! Let's find your North Star by identifying exactly what you need help with. Every problem has a solution - we just need to find the right approach."
-        ]
-        return random.choice(responses)
+    # No server history yet (new conversation, or after a restart): keep the tail of the client's
+    if context is None and client_context:
+        context = client_context[-conversations.token_budget * 4:]
 
-    elif any(word in message_lower for word in ['motivation', 'encourage', 'give up', 'hard', 'tired']):
-        responses = [
-            "🌟 Remember, you're not just learning facts - you're building the skills that will help you reach for the stars! Every challenge you overcome makes you stronger and more capable. You've got this!",
-            "🚀 Learning is like space travel - it takes time, energy, and persistence to reach your destination. But the view from the top is always worth the journey! Keep pushing forward, explorer!",
-            "💫 The cosmos didn't form overnight, and neither does mastery! Every expert was once a beginner, every master was once a student. Your dedication today is building the foundation for tomorrow's success!"
-        ]
-        return random.choice(responses)
+    return context or ''
 
-    elif any(word in message_lower for word in ['code', 'programming', 'computer', 'technology']):
-        responses = [
-            "💻 Programming is like learning to speak with computers! Just like human languages, it has syntax, grammar, and vocabulary. Start with the basics and build up your skills step by step. What programming concept interests you?",
-            "🔧 Code is the magic that brings ideas to life in the digital realm! Whether you're building websites, apps, or games, programming gives you the power to create. What would you like to build?",
-            "⚡ Technology is advancing at light speed, and programming skills are your ticket to the future! Every line of code you write is a step toward digital mastery. What coding challenge can I help with?"
-        ]
-        return random.choice(responses)
+def log_chat(user_id, provider, message, response, response_time, cache_status=None, saved_ms=0, first_token_ms=None):
+    """Write the ai_chat_logs row and queue the analytics event for one exchange"""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute('''
+        INSERT INTO ai_chat_logs (user_id, provider, message, response, response_time, cache_status, saved_ms, first_token_ms)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, provider, message[:500], response[:1000], response_time, cache_status, saved_ms, first_token_ms))
+
+    db.commit()
+    db.close()
+
+    analytics_events.emit(user_id, 'ai_chat', {
+        'provider': provider,
+        'message_length': len(message),
+        'response_time': response_time
+    })
+
+def open_chat_stream(user_id, conversation_id, message, context, provider):
+    """Start a streamed reply from the cache, the fastest provider or the local fallback
+
+    Returns a dict with the answering provider, cache status and a chunks
+    generator; the exchange is logged (and cached) once the generator finishes.
+    """
+    start_time = time.time()
+    cached = response_cache.get(message, context, provider)
 
+    if cached:
+        answered_by, chunks = cached.provider, iter([cached.response])
+        cache_status, saved_ms = cached.tier, cached.response_time
     else:
-        responses = [
-            "🌟 Your curiosity is out of this world! I'm here to help you explore any subject that interests you. Whether it's math, science, English, or anything else, let's discover something amazing together. What would you like to learn about?",
-            "🚀 Welcome to the cosmos of knowledge! Every question is a doorway to new understanding. I'm excited to help you on your learning journey. What subject shall we explore today?",
-            "✨ The universe is full of fascinating topics to explore! From the mysteries of mathematics to the wonders of science, from the power of words to the logic of code - there's always something new to discover. What sparks your interest?"
-        ]
-        return random.choice(responses)
+        answered_by, chunks = None, None
+        cache_status, saved_ms = 'miss', 0
+        # Throttled users get a local answer rather than an error
+        if rate_limiter.allow_user(user_id, user_role()):
+            answered_by, chunks, coalesced = ai_flights.stream(
+                flight_key(message, context, provider),
+                lambda: ai_orchestrator.stream(message, context, provider_order(provider))
+            )
+            if coalesced:
+                cache_status = 'coalesced'
+        if chunks is None:
+            answered_by, chunks = 'local', iter([generate_fallback_response(message, context)])
+
+    first_token_ms = int((time.time() - start_time) * 1000)
+
+    def relay():
+        parts = []
+        completed = False
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+            completed = True
+        finally:
+            response = ''.join(parts)
+            response_time = int((time.time() - start_time) * 1000)
+            if completed and cache_status == 'miss' and answered_by != 'local' and response:
+                response_cache.put(message, context, provider, response, answered_by, response_time)
+            try:
+                log_chat(user_id, answered_by, message, response, response_time,
+                         cache_status, saved_ms, first_token_ms)
+                conversations.add_exchange(user_id, conversation_id, message, response)
+            except Exception as e:
+                logger.error(f"AI chat log error: {str(e)}")
+
+    return {'provider': answered_by, 'cache': cache_status, 'chunks': relay()}
+
+def generate_fallback_response(message, context):
+    """Generate enhanced fallback responses"""
+    return fallback_router.respond(message, context)
 
 # Continue with all other existing routes...
 # (All the previous routes from the original backend remain the same)
 
+def start_match(player, opponent):
+    """Create the battle for a matchmaking pairing (opponent None: a rated bot) and tell both players"""
+    if opponent is None:
+        rival = bot_opponent(player.rating)
+    else:
+        rival = {'id': opponent.user_id, 'name': opponent.name, 'rating': int(opponent.rating), 'human': True}
+
+    battle_id = f"battle_{uuid.uuid4().hex[:8]}"
+    questions = battle_engine.create(battle_id, player.user_id, rival, player.subject)
+    if questions is None:
+        # Both tickets have left the queue, so both clients must hear the search ended
+        logger.error(f"No questions for battle between {player.user_id} and {rival['id']}")
+        for waiting in (player, opponent):
+            if waiting is not None:
+                socketio.emit('battle_error', {'error': 'No questions available', 'subject': player.subject},
+                              room=f'user_{waiting.user_id}')
+        return None
+
+    found = {'battleId': battle_id, 'questions': questions, 'timeLimit': battle_engine.time_limit}
+    socketio.emit('battle_found', dict(found, opponent=rival), room=f'user_{player.user_id}')
+    if opponent is not None:
+        socketio.emit('battle_found', dict(found, opponent={
+            'id': player.user_id, 'name': player.name, 'rating': int(player.rating), 'human': True
+        }), room=f'user_{opponent.user_id}')
+    return dict(found, opponent=rival)
+
 @app.route('/api/find-battle', methods=['POST'])
 @login_required
 def find_battle():
-    """Find a battle opponent"""
+    """Queue for a battle opponent of similar rating"""
     try:
         user_id = session['user_id']
+        subject = (request.get_json(silent=True) or {}).get('subject')
+        rating, _ = battle_ratings.get(user_id)
+
+        player, opponent = matchmaker.enqueue(
+            user_id, rating, name=session.get('username', 'Unknown'),
+            subject=None if subject in (None, 'mixed') else subject
+        )
+        if opponent is None:
+            # Paired later (battle_found over the socket), with a bot once BATTLE_BOT_AFTER passes
+            return jsonify({
+                'success': True,
+                'queued': True,
+                'rating': int(rating),
+                'botAfter': matchmaker.bot_after
+            })
 
-        # Simulate finding an opponent
-        opponents = [
-            {"id": "ai_1", "name": "CosmoKid", "level": random.randint(1, 10), "rating": random.randint(800, 1200)},
-            {"id": "ai_2", "name": "StarSeeker", "level": random.randint(1, 10), "rating": random.randint(800, 1200)},
-            {"id": "ai_3", "name": "GalaxyBrain", "level": random.randint(1, 10), "rating": random.randint(800, 1200)},
-            {"id": "ai_4", "name": "NebulaKnight", "level": random.randint(1, 10), "rating": random.randint(800, 1200)}
-        ]
+        battle = start_match(player, opponent)
+        if battle is None:
+            return jsonify({'success': False, 'error': 'No questions available'}), 404
 
-        opponent = random.choice(opponents)
-        battle_id = f"battle_{uuid.uuid4().hex[:8]}"
-
-        # Store battle state
-        active_battles[battle_id] = {
-            'id': battle_id,
-            'user_id': user_id,
-            'opponent': opponent,
-            'user_score': 0,
-            'opponent_score': 0,
-            'current_question': 0,
-            'questions': [],
-            'start_time': datetime.now()
-        }
-
-        return jsonify({
-            'success': True,
-            'battleId': battle_id,
-            'opponent': opponent
-        })
+        return jsonify(dict(battle, success=True, queued=False, rating=int(rating)))
 
     except Exception as e:
         logger.error(f"Find battle error: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/cancel-battle-search', methods=['POST'])
+@login_required
+def cancel_battle_search():
+    """Leave the matchmaking queue"""
+    return jsonify({'success': True, 'cancelled': matchmaker.cancel(session['user_id'])})
+
 @app.route('/api/create-pod', methods=['POST'])
 @login_required
 def create_pod():
@@ -881,13 +1359,14 @@ def create_pod():
 
         db.commit()
         db.close()
+        pod_directory.invalidate()
 
         # Store in active pods
-        active_pods[pod_id] = {
+        active_pods.set(pod_id, {
             'id': pod_id,
             'name': data['name'],
             'members': [user_id]
-        }
+        })
 
         return jsonify({
             'success': True,
@@ -903,32 +1382,81 @@ def create_pod():
 def get_pods():
     """Get available learning pods"""
     try:
-        db = get_db()
-        cursor = db.cursor()
+        subject = request.args.get('subject')
+        full = request.args.get('full')
+        if full is not None:
+            full = full.lower() in ('1', 'true', 'yes')
 
-        pods = cursor.execute('''
-            SELECT p.*, u.username as creator_name,
-                   COUNT(pm.user_id) as member_count
-            FROM learning_pods p
-            JOIN users u ON p.creator_id = u.id
-            LEFT JOIN pod_members pm ON p.id = pm.pod_id
-            WHERE p.is_active = 1
-            GROUP BY p.id
-            ORDER BY p.created_at DESC
-            LIMIT 20
-        ''').fetchall()
-
-        db.close()
+        pods = pod_directory.list(subject=subject, full=full, limit=min(request.args.get('limit', 20, type=int), 100))
 
         return jsonify({
             'success': True,
-            'pods': [dict(row) for row in pods]
+            'pods': pods
         })
 
     except Exception as e:
         logger.error(f"Get pods error: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/pods/leave', methods=['POST'])
+@login_required
+def leave_pod():
+    """Give up membership of a pod; the pod's last admin cannot leave"""
+    try:
+        user_id = session['user_id']
+        try:
+            pod_id = int((request.json or {}).get('podId'))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'podId is required'}), 400
+
+        outcome = pod_directory.leave(pod_id, user_id)
+        if outcome == 'last_admin':
+            return jsonify({'success': False, 'error': 'The last admin cannot leave the pod'}), 409
+        if outcome == 'not_member':
+            return jsonify({'success': False, 'error': 'Not a member of this pod'}), 404
+
+        active_pods.remove_member(pod_id, 'members', user_id)
+        username = session.get('username', 'Unknown')
+        socketio.emit('member_left', {
+            'username': username,
+            'message': f'{username} left the pod'
+        }, room=f'pod_{pod_id}')
+
+        return jsonify({'success': True})
+
+    except Exception as e:
+        logger.error(f"Leave pod error: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/pods/<int:pod_id>/messages', methods=['GET'])
+@login_required
+def get_pod_messages(pod_id):
+    """Page through a pod's message history, newest first"""
+    try:
+        if not pod_directory.is_member(pod_id, session['user_id']):
+            return jsonify({'success': False, 'error': 'Not a member of this pod'}), 403
+
+        before = request.args.get('before', type=int)
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+
+        # One extra row tells us whether an older page exists without a COUNT
+        rows = pod_chat.page(pod_id, before=before, limit=limit + 1)
+        more = len(rows) > limit
+        rows = rows[:limit]
+
+        # Rows as arrays under one field list, serialized without whitespace
+        body = json.dumps({
+            'success': True,
+            'fields': ['id', 'username', 'message', 'sentAt'],
+            'messages': rows,
+            'nextCursor': rows[-1][0] if more else None
+        }, separators=(',', ':'))
+        return Response(body, mimetype='application/json')
+
+    except Exception as e:
+        logger.error(f"Get pod messages error: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/get-daily-challenges', methods=['GET'])
 @login_required
 def get_daily_challenges():
@@ -1099,27 +1627,8 @@ def get_analytics():
         db = get_db()
         cursor = db.cursor()
 
-        # Get assessment stats
-        assessment_stats = cursor.execute('''
-            SELECT 
-                COUNT(*) as total_assessments,
-                AVG(score) as avg_score,
-                MAX(score) as best_score,
-                SUM(time_taken) as total_time
-            FROM assessments
-            WHERE user_id = ?
-        ''', (user_id,)).fetchone()
-
-        # Get subject performance
-        subject_performance = cursor.execute('''
-            SELECT 
-                subject,
-                COUNT(*) as count,
-                AVG(score) as avg_score
-            FROM assessments
-            WHERE user_id = ? AND subject != 'mixed'
-            GROUP BY subject
-        ''', (user_id,)).fetchall()
+        # Get assessment and subject stats from the rollup tables
+        assessment_stats, subject_performance = load_user_stats(cursor, user_id)
 
         # Get recent activity
         recent_activity = cursor.execute('''
@@ -1130,25 +1639,27 @@ def get_analytics():
             LIMIT 20
         ''', (user_id,)).fetchall()
 
-        # Get achievement progress
-        total_achievements = cursor.execute('''
-            SELECT COUNT(*) FROM achievements WHERE user_id = ?
-        ''', (user_id,)).fetchone()[0]
-
+        # Persist rollups rebuilt for users seen here for the first time
+        db.commit()
         db.close()
 
+        total_assessments = assessment_stats['total_assessments']
+
         return jsonify({
             'success': True,
             'analytics': {
                 'assessments': {
-                    'total': assessment_stats['total_assessments'] or 0,
-                    'averageScore': round(assessment_stats['avg_score'] or 0, 1),
-                    'bestScore': assessment_stats['best_score'] or 0,
-                    'totalTime': assessment_stats['total_time'] or 0
+                    'total': total_assessments,
+                    'averageScore': round(assessment_stats['score_sum'] / total_assessments, 1) if total_assessments else 0,
+                    'bestScore': assessment_stats['best_score'] if total_assessments else 0,
+                    'totalTime': assessment_stats['total_time']
                 },
-                'subjects': [dict(row) for row in subject_performance],
+                'subjects': [
+                    {'subject': row['subject'], 'count': row['count'], 'avg_score': row['score_sum'] / row['count']}
+                    for row in subject_performance
+                ],
                 'achievements': {
-                    'unlocked': total_achievements,
+                    'unlocked': assessment_stats['achievements_unlocked'],
                     'total': 20  # Total available achievements
                 },
                 'recentActivity': [dict(row) for row in recent_activity]
@@ -1170,6 +1681,12 @@ def submit_assessment():
         db = get_db()
         cursor = db.cursor()
 
+        # Take the write lock up front so progress counters are read and written atomically
+        cursor.execute('BEGIN IMMEDIATE')
+
+        # Update progress counters and award achievements (before the row is saved)
+        achievements_earned, progress = record_assessment(cursor, user_id, data)
+
         # Save assessment
         cursor.execute('''
             INSERT INTO assessments (user_id, type, subject, score, total_questions, time_taken, questions_data)
@@ -1184,6 +1701,9 @@ def submit_assessment():
             json.dumps(data.get('answers', []))
         ))
 
+        # Keep dashboard rollups in step with the raw assessments table
+        apply_assessment(cursor, user_id, data['subject'], data['score'], data['timeTaken'], len(achievements_earned))
+
         # Calculate XP earned
         base_xp = 10
         score_bonus = int(data['score'] / 10)
@@ -1192,12 +1712,9 @@ def submit_assessment():
         # Update user profile
         cursor.execute('''
             UPDATE user_profiles 
-            SET xp = xp + ?, last_activity = CURRENT_TIMESTAMP
+            SET xp = xp + ?, streak = ?, last_activity = CURRENT_TIMESTAMP
             WHERE user_id = ?
-        ''', (xp_earned, user_id))
-
-        # Check for achievements
-        achievements_earned = check_achievements(cursor, user_id, data)
+        ''', (xp_earned, progress['streak'], user_id))
 
         # Check for level up
         profile = cursor.execute('''
@@ -1212,15 +1729,18 @@ def submit_assessment():
                 UPDATE user_profiles SET level = ? WHERE user_id = ?
             ''', (new_level, user_id))
 
-        # Track analytics event
-        cursor.execute('''
-            INSERT INTO analytics_events (user_id, event_type, event_data)
-            VALUES (?, ?, ?)
-        ''', (user_id, 'assessment_completed', json.dumps(data)))
-
         db.commit()
         db.close()
 
+        # Track analytics event (summary only; answers are already stored on the assessment)
+        analytics_events.emit(user_id, 'assessment_completed', {
+            'type': data['type'],
+            'subject': data['subject'],
+            'score': data['score'],
+            'totalQuestions': data['totalQuestions'],
+            'timeTaken': data['timeTaken']
+        })
+
         return jsonify({
             'success': True,
             'xpEarned': xp_earned,
@@ -1234,69 +1754,16 @@ def submit_assessment():
         logger.error(f"Submit assessment error: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-def check_achievements(cursor, user_id, assessment_data):
-    """Check and award achievements"""
-    achievements_earned = []
-
-    # First assessment
-    count = cursor.execute('''
-        SELECT COUNT(*) as count FROM assessments WHERE user_id = ?
-    ''', (user_id,)).fetchone()['count']
-
-    if count == 1:
-        cursor.execute('''
-            INSERT OR IGNORE INTO achievements (user_id, achievement_id)
-            VALUES (?, ?)
-        ''', (user_id, 'first-steps'))
-        achievements_earned.append({
-            'id': 'first-steps',
-            'name': 'First Steps',
-            'description': 'Complete your first assessment'
-        })
-
-    # High scorer
-    if assessment_data['score'] >= 80:
-        cursor.execute('''
-            INSERT OR IGNORE INTO achievements (user_id, achievement_id)
-            VALUES (?, ?)
-        ''', (user_id, 'high-scorer'))
-        achievements_earned.append({
-            'id': 'high-scorer',
-            'name': 'High Scorer',
-            'description': 'Score 80% or higher'
-        })
-
-    # Perfect score
-    if assessment_data['score'] == 100:
-        cursor.execute('''
-            INSERT OR IGNORE INTO achievements (user_id, achievement_id)
-            VALUES (?, ?)
-        ''', (user_id, 'perfectionist'))
-        achievements_earned.append({
-            'id': 'perfectionist',
-            'name': 'Perfectionist',
-            'description': 'Achieve a perfect score'
-        })
-
-    # Quick learner (complete in under 5 minutes)
-    if assessment_data.get('timeTaken', 0) < 300:
-        cursor.execute('''
-            INSERT OR IGNORE INTO achievements (user_id, achievement_id)
-            VALUES (?, ?)
-        ''', (user_id, 'quick-learner'))
-        achievements_earned.append({
-            'id': 'quick-learner',
-            'name': 'Quick Learner',
-            'description': 'Complete an assessment in under 5 minutes'
-        })
-
-    return achievements_earned
-
 # WebSocket events
 @socketio.on('connect')
 def handle_connect():
     """Handle socket connection"""
     logger.info(f"Client connected: {request.sid}")
+
+    # Per-user room for server-initiated events (battle opponent moves and results)
+    if 'user_id' in session:
+        join_room(f"user_{session['user_id']}")
+
     emit('connected', {'message': 'Connected to StarGuide server'})
 
 @socketio.on('disconnect')
@@ -1307,9 +1774,36 @@ def handle_disconnect():
     # Remove from online users if authenticated
     if 'user_id' in session:
         user_id = session['user_id']
-        if user_id in online_users:
-            del online_users[user_id]
+        if online_users.delete(user_id):
             socketio.emit('online_users_update', {'count': len(online_users)})
+        matchmaker.cancel(user_id)
+
+@socketio.on('ai_chat')
+def handle_ai_chat(data):
+    """Stream an AI chat reply as Socket.IO events"""
+    if 'user_id' not in session:
+        return
+
+    user_id = session['user_id']
+    request_id = data.get('requestId')
+    conversation_id = data.get('conversationId')
+    message = data.get('message', '')
+
+    chat = open_chat_stream(
+        user_id,
+        conversation_id,
+        message,
+        chat_context(user_id, conversation_id, message, data.get('context', '')),
+        data.get('provider', 'openai')
+    )
+
+    try:
+        for content in chat['chunks']:
+            emit('ai_chat_chunk', {'requestId': request_id, 'content': content})
+    except (StreamInterrupted, StreamAbandoned) as e:
+        logger.error(f"AI stream error: {str(e)}")
+
+    emit('ai_chat_done', {'requestId': request_id, 'provider': chat['provider'], 'cache': chat['cache']})
 
 @socketio.on('join_pod')
 def handle_join_pod(data):
@@ -1321,13 +1815,20 @@ def handle_join_pod(data):
     user_id = session['user_id']
     username = session.get('username', 'Unknown')
 
+    # Record membership (keeps the directory's member_count current)
+    try:
+        outcome = pod_directory.join(int(pod_id), user_id)
+    except (TypeError, ValueError):
+        outcome = 'missing'
+    if outcome in ('full', 'missing'):
+        emit('pod_error', {'podId': pod_id, 'error': 'Pod is full' if outcome == 'full' else 'Pod not found'})
+        return
+
     # Join socket room
     join_room(f'pod_{pod_id}')
 
     # Add to active pod members
-    if pod_id in active_pods:
-        if user_id not in active_pods[pod_id]['members']:
-            active_pods[pod_id]['members'].append(user_id)
+    active_pods.add_member(pod_id, 'members', user_id)
 
     # Notify pod members
     emit('member_joined', {
@@ -1335,6 +1836,19 @@ def handle_join_pod(data):
         'message': f'{username} joined the pod'
     }, room=f'pod_{pod_id}')
 
+    # Recent messages for the newcomer, served from memory
+    emit('pod_history', {'podId': pod_id, 'messages': pod_chat.history(pod_id)})
+
+@socketio.on('leave_pod')
+def handle_leave_pod(data):
+    """Stop receiving a pod's live messages; membership is given up through POST /api/pods/leave"""
+    if 'user_id' not in session:
+        return
+
+    pod_id = data.get('podId')
+    leave_room(f'pod_{pod_id}')
+    active_pods.remove_member(pod_id, 'members', session['user_id'])
+
 @socketio.on('pod_message')
 def handle_pod_message(data):
     """Handle pod chat messages"""
@@ -1350,25 +1864,15 @@ def handle_pod_message(data):
     user_id = session['user_id']
     username = session.get('username', 'Unknown')
 
-    # Save message to database
-    try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('''
-            INSERT INTO pod_messages (pod_id, user_id, message)
-            VALUES (?, ?, ?)
-        ''', (pod_id, user_id, message))
-        db.commit()
-        db.close()
-    except Exception as e:
-        logger.error(f"Save pod message error: {str(e)}")
-
-    # Broadcast to pod members
-    emit('new_message', {
+    entry = {
         'username': username,
         'message': message,
-        'timestamp': datetime.now().isoformat()
-    }, room=f'pod_{pod_id}')
+        'timestamp': utc_timestamp()
+    }
+
+    # Broadcast to pod members, then record it (ring buffer now, database in the next batch)
+    emit('new_message', entry, room=f'pod_{pod_id}')
+    pod_chat.post(pod_id, user_id, entry)
 
 @socketio.on('battle_move')
 def handle_battle_move(data):
@@ -1379,16 +1883,10 @@ def handle_battle_move(data):
     battle_id = data.get('battleId')
     answer = data.get('answer')
 
-    if battle_id in active_battles:
-        battle = active_battles[battle_id]
-        # Process battle move
-        # In a real implementation, this would handle the battle logic
-
-        emit('battle_update', {
-            'userScore': battle['user_score'],
-            'opponentScore': battle['opponent_score'],
-            'currentQuestion': battle['current_question']
-        })
+    result = battle_engine.move(battle_id, session['user_id'], answer)
+    if result:
+        question_counters.record_attempt(result['questionId'], result['correct'])
+        emit('battle_update', dict(result, battleId=battle_id))
 
 @app.route('/api/get-questions', methods=['POST'])
 @login_required
@@ -1400,29 +1898,26 @@ def get_questions():
         count = data.get('count', 10)
         difficulty = data.get('difficulty')
 
-        db = get_db()
-        cursor = db.cursor()
-
-        # Build query
-        query = "SELECT * FROM questions"
-        params = []
-
-        if subject != 'mixed':
-            query += " WHERE subject = ?"
-            params.append(subject)
+        difficulty = int(difficulty) if difficulty else None
 
-            if difficulty:
-                query += " AND difficulty = ?"
-                params.append(difficulty)
-        elif difficulty:
-            query += " WHERE difficulty = ?"
-            params.append(difficulty)
+        # Sample ids from the in-memory index, then fetch only those rows
+        question_ids = question_index.sample(
+            None if subject == 'mixed' else subject,
+            difficulty,
+            int(count)
+        )
 
-        # Random selection
-        query += " ORDER BY RANDOM() LIMIT ?"
-        params.append(count)
+        db = get_db()
+        cursor = db.cursor()
 
-        questions = cursor.execute(query, params).fetchall()
+        questions = []
+        if question_ids:
+            placeholders = ','.join('?' * len(question_ids))
+            rows = cursor.execute(f'''
+                SELECT id, question, type, hint, difficulty FROM questions WHERE id IN ({placeholders})
+            ''', question_ids).fetchall()
+            rows_by_id = {row['id']: row for row in rows}
+            questions = [rows_by_id[qid] for qid in question_ids if qid in rows_by_id]
 
         # Format questions
         formatted_questions = []
@@ -1435,15 +1930,11 @@ def get_questions():
                 'difficulty': q['difficulty']
             })
 
-        # Log question usage
-        for q in questions:
-            cursor.execute('''
-                UPDATE questions SET usage_count = usage_count + 1 WHERE id = ?
-            ''', (q['id'],))
-
-        db.commit()
         db.close()
 
+        # Log question usage (flushed in batches by question_counters)
+        question_counters.record_usage([q['id'] for q in questions])
+
         return jsonify({
             'success': True,
             'questions': formatted_questions
@@ -1460,48 +1951,30 @@ def validate_answer():
     try:
         data = request.json
         question_id = data.get('questionId')
-        user_answer = str(data.get('answer', '')).strip().lower()
+        user_answer = str(data.get('answer', ''))
 
-        db = get_db()
-        cursor = db.cursor()
+        try:
+            question_id = int(question_id)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Question not found'}), 404
 
         # Get correct answer
-        question = cursor.execute('''
-            SELECT correct_answer, explanation FROM questions WHERE id = ?
-        ''', (question_id,)).fetchone()
+        question = answer_keys.get(question_id)
 
         if not question:
             return jsonify({'success': False, 'error': 'Question not found'}), 404
 
-        correct_answer = str(question['correct_answer']).strip().lower()
-
-        # Check answer
-        is_correct = user_answer == correct_answer
+        # Check answer with the question's matcher (plain compare first)
+        is_correct = question.matcher(user_answer)
 
-        # Handle numeric answers with tolerance
-        try:
-            user_num = float(user_answer)
-            correct_num = float(correct_answer)
-            if abs(user_num - correct_num) < 0.01:
-                is_correct = True
-        except:
-            pass
-
-        # Update question success rate
-        cursor.execute('''
-            UPDATE questions 
-            SET success_rate = (success_rate * usage_count + ?) / (usage_count + 1)
-            WHERE id = ?
-        ''', (1 if is_correct else 0, question_id))
-
-        db.commit()
-        db.close()
+        # Update question success rate (flushed in batches by question_counters)
+        question_counters.record_attempt(question_id, is_correct)
 
         return jsonify({
             'success': True,
             'correct': is_correct,
-            'correctAnswer': question['correct_answer'] if not is_correct else None,
-            'explanation': question['explanation']
+            'correctAnswer': question.answer if not is_correct else None,
+            'explanation': question.explanation
         })
 
     except Exception as e:
@@ -1512,6 +1985,26 @@ def validate_answer():
 init_db()
 populate_question_bank()
 
+with db_pool.connection() as db:
+    question_index.load(db)
+    answer_keys.load(db)
+    fallback_router.load_hints(db)
+
+question_counters.start()
+atexit.register(question_counters.stop)
+analytics_events.start()
+atexit.register(analytics_events.stop)
+pod_chat.start()
+atexit.register(pod_chat.stop)
+battle_ratings.start()
+atexit.register(battle_ratings.stop)
+battle_engine.start()
+atexit.register(battle_engine.stop)
+battle_timers.start()
+atexit.register(battle_timers.stop)
+matchmaker.start()
+atexit.register(matchmaker.stop)
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     logger.info(f"Starting IDFS StarGuide on port {port}")
@@ -0,0 +1,331 @@
+"""
+IDFS StarGuide - Battle Engine
+Head-to-head quiz battles: questions preloaded at match time, moves scored in memory, AI turns on a timer wheel
+"""
+
+import queue
+import random
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+POINTS_PER_QUESTION = 10
+
+# Each side's (score, question index) fields in the battle record
+SIDES = {'user': ('user_score', 'current_question'), 'opponent': ('opponent_score', 'opponent_question')}
+
+
+def ai_accuracy(rating):
+    """Chance an AI opponent of this rating answers correctly"""
+    return min(0.9, max(0.3, (rating - 400) / 1000))
+
+
+class BattleEngine:
+    """Run battles whose state lives in a StateNamespace so any worker can take a move
+
+    create() samples the question set from the QuestionIndex, fetches the
+    public question fields once for the client and warms the answer keys,
+    so move() is one state read, a matcher call and one merge,
+    with no query. The stored record holds only question ids and scores to
+    keep those copies small. The AI opponent's answers and the battle
+    deadline are timers on a shared TimerWheel; a human opponent
+    (opponent['human']) answers through move() like the user instead.
+    Whichever side ends a battle first queues its single battles row; a
+    writer thread inserts queued rows in batches and then calls
+    on_finish(battle) for each, so neither the wheel nor a move waits on
+    SQLite.
+    """
+
+    def __init__(self, battles, question_index, answer_keys, connect, wheel, notify,
+                 questions_per_battle=5, time_limit=300.0, ai_think=(3.0, 12.0), batch_size=500,
+                 flush_interval=0.5, on_finish=None):
+        self.battles = battles
+        self.question_index = question_index
+        self.answer_keys = answer_keys
+        self._connect = connect
+        self.wheel = wheel
+        self.notify = notify
+        self.questions_per_battle = questions_per_battle
+        self.time_limit = time_limit
+        self.ai_think = ai_think
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_finish = on_finish
+
+        self._deadlines = {}  # battle id -> deadline timer (battles created by this process)
+        self._rows = queue.Queue()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {'created': 0, 'moves': 0, 'ai_moves': 0, 'finished': 0, 'timed_out': 0,
+                       'persisted': 0, 'failed': 0}
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self._stats[key] += delta
+
+    def _questions(self, subject):
+        """Public fields of a fresh question set, with answer keys warmed for scoring"""
+        question_ids = self.question_index.sample(subject, None, self.questions_per_battle)
+        if not question_ids:
+            return []
+
+        placeholders = ','.join('?' * len(question_ids))
+        with self._connect() as db:
+            rows = db.execute(f'''
+                SELECT id, question, type, hint, difficulty FROM questions WHERE id IN ({placeholders})
+            ''', question_ids).fetchall()
+        rows_by_id = {row['id']: row for row in rows}
+
+        questions = []
+        for question_id in question_ids:
+            row = rows_by_id.get(question_id)
+            if row is not None and self.answer_keys.get(question_id) is not None:
+                questions.append({
+                    'id': row['id'],
+                    'question': row['question'],
+                    'type': row['type'],
+                    'hint': row['hint'],
+                    'difficulty': row['difficulty']
+                })
+        return questions
+
+    def create(self, battle_id, user_id, opponent, subject=None):
+        """Start a battle against an AI or human opponent; returns its questions, or None if none match"""
+        questions = self._questions(subject)
+        if not questions:
+            return None
+
+        self.battles.set(battle_id, {
+            'id': battle_id,
+            'user_id': user_id,
+            'opponent': opponent,
+            'question_ids': [question['id'] for question in questions],
+            'user_score': 0,
+            'opponent_score': 0,
+            'current_question': 0,
+            'opponent_question': 0,
+            'started_at': time.time()
+        })
+
+        deadline = self.wheel.schedule(self.time_limit, self._expire, battle_id)
+        with self._lock:
+            self._deadlines[battle_id] = deadline
+            self._stats['created'] += 1
+        if not opponent.get('human'):
+            self.wheel.schedule(random.uniform(*self.ai_think), self._ai_turn, battle_id)
+        return questions
+
+    @staticmethod
+    def _sides(battle, user_id):
+        """(own side, other side) for a player in the battle, or None"""
+        if user_id == battle['user_id']:
+            return 'user', 'opponent'
+        if battle['opponent'].get('human') and user_id == battle['opponent']['id']:
+            return 'opponent', 'user'
+        return None
+
+    @staticmethod
+    def _player(battle, side):
+        return battle['user_id'] if side == 'user' else battle['opponent']['id']
+
+    def _notify_progress(self, battle_id, latest, side, correct):
+        """Tell the other side's player (if human) that side just answered"""
+        other = 'opponent' if side == 'user' else 'user'
+        if other == 'opponent' and not latest['opponent'].get('human'):
+            return
+        self.notify(self._player(latest, other), 'battle_update', {
+            'battleId': battle_id,
+            'userScore': latest[SIDES[other][0]],
+            'opponentScore': latest[SIDES[side][0]],
+            'opponentQuestion': latest[SIDES[side][1]],
+            'opponentCorrect': correct
+        })
+
+    def move(self, battle_id, user_id, answer):
+        """Score a player's answer to their current question
+
+        Returns None, leaving the battle as it was, for an unknown battle, a
+        player who has no question left or a question deleted since create().
+        """
+        battle = self.battles.get(battle_id)
+        sides = self._sides(battle, user_id) if battle is not None else None
+        if sides is None:
+            return None
+        (score_field, index_field), (other_score_field, other_index_field) = SIDES[sides[0]], SIDES[sides[1]]
+
+        total = len(battle['question_ids'])
+        index = battle[index_field]
+        if index >= total:
+            return None
+
+        question_id = battle['question_ids'][index]
+        key = self.answer_keys.get(question_id)
+        if key is None:
+            logger.warning(f"Battle {battle_id} move rejected: no answer key for question {question_id}")
+            return None
+        correct = key.matcher(str(answer))
+        score = battle[score_field] + (POINTS_PER_QUESTION if correct else 0)
+
+        # Each side's fields have one writer, so the two sides' merges never overwrite each other
+        latest = self.battles.merge(battle_id, {score_field: score, index_field: index + 1})
+        self._count('moves')
+
+        if latest is not None:
+            self._notify_progress(battle_id, latest, sides[0], correct)
+        finished = latest is None or (index + 1 == total and latest[other_index_field] >= total)
+        if latest is not None and finished:
+            self.finish(battle_id)
+        return {
+            'questionId': question_id,
+            'correct': correct,
+            'correctAnswer': key.answer if not correct else None,
+            'explanation': key.explanation,
+            'userScore': score,
+            'opponentScore': (latest or battle)[other_score_field],
+            'currentQuestion': index + 1,
+            'finished': finished
+        }
+
+    def _ai_turn(self, battle_id):
+        battle = self.battles.get(battle_id)
+        if battle is None:
+            return
+
+        total = len(battle['question_ids'])
+        index = battle['opponent_question']
+        if index >= total:
+            return
+
+        correct = random.random() < ai_accuracy(battle['opponent'].get('rating', 1000))
+        score = battle['opponent_score'] + (POINTS_PER_QUESTION if correct else 0)
+        latest = self.battles.merge(battle_id, {'opponent_score': score, 'opponent_question': index + 1})
+        if latest is None:
+            return
+        self._count('ai_moves')
+        self._notify_progress(battle_id, latest, 'opponent', correct)
+
+        if index + 1 < total:
+            self.wheel.schedule(random.uniform(*self.ai_think), self._ai_turn, battle_id)
+        elif latest['current_question'] >= total:
+            self.finish(battle_id)
+
+    def _expire(self, battle_id):
+        with self._lock:
+            self._deadlines.pop(battle_id, None)
+        if self.finish(battle_id, timed_out=True):
+            self._count('timed_out')
+
+    def finish(self, battle_id, timed_out=False):
+        """End the battle and queue its battles row; returns False if it already ended"""
+        battle = self.battles.get(battle_id)
+        if battle is None or not self.battles.delete(battle_id):
+            return False
+
+        with self._lock:
+            deadline = self._deadlines.pop(battle_id, None)
+            self._stats['finished'] += 1
+        if deadline is not None and not timed_out:
+            self.wheel.cancel(deadline)
+
+        user_id = battle['user_id']
+        opponent_id = battle['opponent']['id']
+        if battle['user_score'] > battle['opponent_score']:
+            winner_id = user_id
+        elif battle['opponent_score'] > battle['user_score']:
+            winner_id = opponent_id
+        else:
+            winner_id = None
+        duration = int(time.time() - battle['started_at'])
+
+        def xp(score, player_id):
+            return 10 + score // 2 + (20 if winner_id == player_id else 0)
+
+        self._rows.put(((user_id, opponent_id, battle['user_score'], battle['opponent_score'], winner_id,
+                         xp(battle['user_score'], user_id), duration), battle))
+
+        sides = ('user', 'opponent') if battle['opponent'].get('human') else ('user',)
+        for side in sides:
+            other = 'opponent' if side == 'user' else 'user'
+            player_id = self._player(battle, side)
+            self.notify(player_id, 'battle_complete', {
+                'battleId': battle_id,
+                'userScore': battle[SIDES[side][0]],
+                'opponentScore': battle[SIDES[other][0]],
+                'winnerId': winner_id,
+                'won': winner_id == player_id,
+                'xpEarned': xp(battle[SIDES[side][0]], player_id),
+                'duration': duration,
+                'timedOut': timed_out
+            })
+        return True
+
+    def start(self):
+        """Start the battles writer"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='battle-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._take_batch(self.flush_interval)
+            if batch:
+                self._write(batch)
+
+    def _take_batch(self, timeout):
+        try:
+            batch = [self._rows.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._rows.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        """Insert a batch of (row, battle) and run on_finish for each battle"""
+        try:
+            with self._connect() as db:
+                db.executemany('''
+                    INSERT INTO battles (user_id, opponent_id, user_score, opponent_score, winner_id, xp_earned, duration)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', [row for row, _ in batch])
+                db.commit()
+            self._count('persisted', len(batch))
+        except Exception as e:
+            logger.error(f"Battle persist error: {str(e)}")
+            self._count('failed', len(batch))
+
+        if self.on_finish is None:
+            return
+        for _, battle in batch:
+            try:
+                self.on_finish(battle)
+            except Exception as e:
+                logger.error(f"Battle finish hook error: {str(e)}")
+
+    def flush(self):
+        """Write every queued battle now"""
+        while True:
+            batch = self._take_batch(0)
+            if not batch:
+                return
+            self._write(batch)
+
+    def stop(self):
+        """Stop the writer and drain the queue"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot.update({'active': len(self.battles), 'queued': self._rows.qsize()})
+        return snapshot
@@ -0,0 +1,996 @@
+"""
+IDFS StarGuide - Performance Benchmarks
+Standalone micro-benchmarks for the backend hot paths
+
+Usage: python benchmarks.py <benchmark> [options]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import socketio
+
+from ai_gateway import AIGateway
+from ai_orchestrator import ProviderOrchestrator, percentile
+from provider_http import ProviderHTTPClient
+from answer_matching import compile_matcher
+from battle_engine import BattleEngine
+from db_pool import ConnectionPool
+from intent_router import IntentRouter
+from matchmaking import Matchmaker
+from pod_chat import PodChat, utc_timestamp
+from question_bank import AnswerKeyCache, QuestionIndex
+from socket_fanout import BrokerManager, start_broker
+from state_store import MemoryBackend, StateNamespace
+from timer_wheel import TimerWheel
+
+SUBJECTS = ['math', 'science', 'english', 'history']
+
+
+def timed(fn, repeat):
+    """Run fn `repeat` times and return the mean wall time in milliseconds"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) * 1000 / repeat
+
+
+def build_question_db(path, rows):
+    """Create a questions table with `rows` synthetic questions"""
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute('''
+        CREATE TABLE questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subject TEXT,
+            difficulty INTEGER,
+            type TEXT,
+            question TEXT,
+            options TEXT,
+            correct_answer TEXT,
+            explanation TEXT,
+            hint TEXT,
+            tags TEXT,
+            usage_count INTEGER DEFAULT 0,
+            success_rate REAL DEFAULT 0
+        )
+    ''')
+    conn.executemany('''
+        INSERT INTO questions (subject, difficulty, type, question, correct_answer, hint, explanation)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        (SUBJECTS[i % 4], i % 3 + 1, 'calculation', f"What is {i} + {i}?", str(i * 2),
+         'Add the numbers', f"The correct answer is {i * 2}")
+        for i in range(rows)
+    ))
+    conn.commit()
+    return conn
+
+
+def bench_question_sampling(args):
+    """ORDER BY RANDOM() versus QuestionIndex sampling plus primary-key fetch"""
+    print(f"{'rows':>10} {'ORDER BY RANDOM() ms':>22} {'index + PK fetch ms':>22} {'speedup':>9}")
+
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = build_question_db(os.path.join(tmp, 'bench.db'), rows)
+
+            def order_by_random():
+                conn.execute('''
+                    SELECT * FROM questions WHERE subject = ? AND difficulty = ?
+                    ORDER BY RANDOM() LIMIT ?
+                ''', ('math', 2, args.count)).fetchall()
+
+            index = QuestionIndex()
+            index.load(conn)
+
+            def index_sample():
+                ids = index.sample('math', 2, args.count)
+                placeholders = ','.join('?' * len(ids))
+                conn.execute(f"SELECT * FROM questions WHERE id IN ({placeholders})", ids).fetchall()
+
+            baseline = timed(order_by_random, args.repeat)
+            indexed = timed(index_sample, args.repeat)
+            conn.close()
+
+        print(f"{rows:>10} {baseline:>22.3f} {indexed:>22.3f} {baseline / indexed:>8.1f}x")
+
+
+# (type, correct answer, options, submitted answer) drawn from the seed question bank
+# (type, answer key, options, an equivalent answer, a wrong answer template filled with the attempt number)
+GRADING_SAMPLES = [
+    ('calculation', '120', None, '120.0', '{i}'),
+    ('fractions', '5/6', None, '0.8333', '{i}/7'),
+    ('algebra', '(x+2)(x+3)', None, '(x+3)(x+2)', '(x+{i})(x+3)'),
+    ('algebra', '6', None, 'x = 6', 'x = {i}'),
+    ('biology', 'carbon dioxide', None, 'CO2', 'oxygen {i}'),
+    ('physics', '299792458', None, '299,792,458 m/s', '{i} m/s'),
+    ('physics', '1/2mv²', None, 'mv^2/2', 'mv^2/{i}'),
+    ('chemistry', '6.02e23', None, '6.02 × 10^23', '{i}.5e23'),
+    ('people', 'George Washington', None, 'Washington', 'John Adams {i}'),
+    ('multiple-choice', '2', '["1943", "1944", "1945", "1946"]', 'C', '{i}')
+]
+
+
+def grading_answers(i, correct, equivalent, wrong):
+    """Attempt i at a question: the key as written half the time, else an equivalent or a distinct wrong answer"""
+    if i % 4 < 2:
+        return correct if i % 2 else correct.upper()
+    return equivalent if i % 4 == 2 else wrong.format(i=i)
+
+
+def legacy_grade(correct_answer, answer):
+    """The original validate_answer() comparison"""
+    answer = str(answer).strip().lower()
+    correct = str(correct_answer).strip().lower()
+    is_correct = answer == correct
+    try:
+        if abs(float(answer) - float(correct)) < 0.01:
+            is_correct = True
+    except ValueError:
+        pass
+    return is_correct
+
+
+def bench_answer_grading(args):
+    """Grading throughput of the compiled matchers versus the legacy compare, on distinct answers"""
+    per_sample = args.attempts // len(GRADING_SAMPLES)
+    answers = [[grading_answers(i, correct, equivalent, wrong) for i in range(per_sample)]
+               for _, correct, _, equivalent, wrong in GRADING_SAMPLES]
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        matchers = [compile_matcher(t, correct, options) for t, correct, options, _, _ in GRADING_SAMPLES]
+    load_us = (time.perf_counter() - started) * 1e6 / (args.repeat * len(GRADING_SAMPLES))
+
+    started = time.perf_counter()
+    for matcher, sample in zip(matchers, GRADING_SAMPLES):
+        matcher(sample[4].format(i=-1))
+    first_us = (time.perf_counter() - started) * 1e6 / len(GRADING_SAMPLES)
+
+    # Interleave questions the way a classroom's submissions arrive
+    attempts = [(matchers[q], GRADING_SAMPLES[q][1], answers[q][i])
+                for i in range(per_sample) for q in range(len(GRADING_SAMPLES))]
+
+    runs = [
+        ('legacy', lambda: sum(1 for _, correct, answer in attempts if legacy_grade(correct, answer))),
+        ('matchers', lambda: sum(1 for matcher, _, answer in attempts if matcher(answer)))
+    ]
+    print(f"load: {load_us:.1f} us per question, first non-trivial grade: {first_us:.1f} us")
+    print(f"{'grader':>10} {'grades/sec':>14} {'accepted':>10}")
+    for label, fn in runs:
+        started = time.perf_counter()
+        accepted = fn()
+        seconds = time.perf_counter() - started
+        print(f"{label:>10} {len(attempts) / seconds:>14,.0f} {accepted / len(attempts):>9.0%}")
+
+    print(f"\n{'type':>16} {'key as written/s':>17} {'other answers/s':>16}")
+    for (question_type, correct, options, _, _), matcher, sample_answers in zip(GRADING_SAMPLES, matchers, answers):
+        plain = [answer for i, answer in enumerate(sample_answers) if i % 4 < 2]
+        other = [answer for i, answer in enumerate(sample_answers) if i % 4 >= 2]
+        rates = []
+        for batch in (plain, other):
+            started = time.perf_counter()
+            for answer in batch:
+                matcher.uncached(answer)
+            rates.append(len(batch) / (time.perf_counter() - started))
+        print(f"{question_type:>16} {rates[0]:>17,.0f} {rates[1]:>16,.0f}")
+
+
+def start_stub_provider(latency, certfile=None, tokens=('stub', ' answer'), token_interval=0.0):
+    """Serve a Claude-shaped reply on a local port after latency() seconds (HTTPS with certfile)
+
+    Requests with "stream": true get Claude SSE events, and paths containing
+    alt=sse get Gemini SSE events, one per token every token_interval seconds.
+    """
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            request_body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            time.sleep(latency())
+
+            if request_body.get('stream') or 'alt=sse' in self.path:
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                def write_chunk(data):
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+
+                try:
+                    for i, token in enumerate(tokens):
+                        if i:
+                            time.sleep(token_interval)
+                        if 'alt=sse' in self.path:
+                            event = {'candidates': [{'content': {'parts': [{'text': token}]}}]}
+                        else:
+                            event = {'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': token}}
+                        write_chunk(f"data: {json.dumps(event)}\n\n".encode())
+                    if 'alt=sse' not in self.path:
+                        write_chunk(f"data: {json.dumps({'type': 'message_stop'})}\n\n".encode())
+                    write_chunk(b'')
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client cancelled the stream
+                    self.close_connection = True
+                return
+
+            time.sleep(token_interval * max(0, len(tokens) - 1))
+            body = json.dumps({
+                'content': [{'text': ''.join(tokens)}],
+                'candidates': [{'content': {'parts': [{'text': ''.join(tokens)}]}}]
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def handle(self):
+            try:
+                super().handle()
+            except (BrokenPipeError, ConnectionResetError):
+                # The client cancelled the call (a hedge or race loser)
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    class StubServer(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 1024
+
+    server = StubServer(('127.0.0.1', 0), StubHandler)
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stub_client(client, url):
+    """Provider coroutine function in the orchestrator's calling convention"""
+    async def call(message, context, timeout=30):
+        status, result = await client.post_json(url, json={'message': message}, timeout=timeout)
+        if status != 200:
+            raise Exception(f"stub error: {status}")
+        return result['content'][0]['text']
+    return call
+
+
+def bench_ai_dispatch(args):
+    """Sequential, raced and hedged provider dispatch against local stub servers with a slow tail"""
+    def tail_latency():
+        if random.random() < args.slow_fraction:
+            return args.slow
+        return random.uniform(args.fast * 0.5, args.fast * 1.5)
+
+    servers = [start_stub_provider(tail_latency) for _ in range(args.providers)]
+    gateway = AIGateway()
+    gateway.start()
+    clients = [ProviderHTTPClient(f"stub{i}") for i in range(args.providers)]
+    providers = {
+        client.name: stub_client(client, f"http://127.0.0.1:{server.server_address[1]}/")
+        for client, server in zip(clients, servers)
+    }
+    order = list(providers)
+
+    print(f"{'mode':>12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'hedges':>7} {'failed':>7}")
+    for mode in ('sequential', 'race', 'hedged'):
+        orchestrator = ProviderOrchestrator(
+            providers, mode=mode, hedge_delay=args.hedge_delay, budget=args.budget, gateway=gateway
+        )
+        latencies = []
+        failed = 0
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            response, _ = orchestrator.complete('What is 2 + 2?', '', order)
+            latencies.append((time.perf_counter() - started) * 1000)
+            failed += 0 if response else 1
+        stats = orchestrator.stats()
+
+        print(f"{mode:>12} {percentile(latencies, 0.5):>9.1f} {percentile(latencies, 0.95):>9.1f} "
+              f"{percentile(latencies, 0.99):>9.1f} {max(latencies):>9.1f} {stats['hedges']:>7} {failed:>7}")
+
+    gateway.stop(cleanup=lambda: close_clients(clients))
+    for server in servers:
+        server.shutdown()
+
+
+async def close_clients(clients):
+    for client in clients:
+        await client.close()
+
+
+def make_self_signed_cert(directory):
+    """Write a localhost key and certificate (one PEM file) using the openssl CLI"""
+    path = os.path.join(directory, 'localhost.pem')
+    subprocess.run([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+        '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+        '-keyout', path, '-out', path
+    ], check=True, capture_output=True)
+    return path
+
+
+def bench_provider_http(args):
+    """Per-request TCP+TLS setup (requests.post) versus a pooled keep-alive ProviderHTTPClient"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cert = make_self_signed_cert(tmp)
+        server = start_stub_provider(lambda: args.server_latency, certfile=cert)
+        url = f"https://127.0.0.1:{server.server_address[1]}/v1/messages"
+        payload = {'messages': [{'role': 'user', 'content': 'What is 2 + 2?'}]}
+
+        def cold():
+            requests.post(url, json=payload, timeout=(3.05, 30), verify=cert).json()
+
+        gateway = AIGateway()
+        gateway.start()
+        client = ProviderHTTPClient('stub', pool_size=args.pool_size, ssl=ssl.create_default_context(cafile=cert))
+
+        def warm():
+            gateway.run(client.post_json(url, json=payload))
+
+        print(f"{'client':>8} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+        for label, fn in (('cold', cold), ('pooled', warm)):
+            latencies = []
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                fn()
+                latencies.append((time.perf_counter() - started) * 1000)
+            print(f"{label:>8} {sum(latencies) / len(latencies):>9.2f} "
+                  f"{percentile(latencies, 0.5):>9.2f} {percentile(latencies, 0.95):>9.2f}")
+
+        stats = client.stats()
+        print(f"\npooled client: {stats['connections_opened']} connections opened, "
+              f"{stats['connections_reused']} reused ({stats['reuse_rate']:.1%})")
+        gateway.stop(cleanup=client.close)
+        server.shutdown()
+
+
+def stub_streamer(client, url):
+    """Streaming provider (Claude SSE) async generator function in the orchestrator's calling convention"""
+    async def stream(message, context, timeout=30):
+        async for event in client.post_events(url, json={'message': message, 'stream': True}, timeout=timeout):
+            if event.get('type') == 'content_block_delta':
+                yield event['delta']['text']
+    return stream
+
+
+def bench_ai_streaming(args):
+    """Time to first token and total time: buffered complete() versus stream()"""
+    tokens = [f"word{i} " for i in range(args.tokens)]
+    server = start_stub_provider(lambda: args.first_token, tokens=tokens, token_interval=args.token_interval)
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    client = ProviderHTTPClient('stub')
+    orchestrator = ProviderOrchestrator({'stub': stub_client(client, url)}, streamers={'stub': stub_streamer(client, url)})
+
+    buffered_first, buffered_total, streamed_first, streamed_total = [], [], [], []
+    for _ in range(args.requests):
+        started = time.perf_counter()
+        orchestrator.complete('Explain photosynthesis', '', ['stub'])
+        elapsed = (time.perf_counter() - started) * 1000
+        buffered_first.append(elapsed)
+        buffered_total.append(elapsed)
+
+        started = time.perf_counter()
+        _, chunks = orchestrator.stream('Explain photosynthesis', '', ['stub'])
+        first = None
+        for _ in chunks:
+            if first is None:
+                first = (time.perf_counter() - started) * 1000
+        streamed_first.append(first)
+        streamed_total.append((time.perf_counter() - started) * 1000)
+
+    print(f"{'mode':>10} {'first token p50':>16} {'first token p95':>16} {'total p50':>10}")
+    print(f"{'buffered':>10} {percentile(buffered_first, 0.5):>16.1f} {percentile(buffered_first, 0.95):>16.1f} "
+          f"{percentile(buffered_total, 0.5):>10.1f}")
+    print(f"{'streamed':>10} {percentile(streamed_first, 0.5):>16.1f} {percentile(streamed_first, 0.95):>16.1f} "
+          f"{percentile(streamed_total, 0.5):>10.1f}")
+
+    orchestrator.gateway.run(client.close())
+    orchestrator.shutdown()
+    server.shutdown()
+
+
+def bench_ai_gateway(args):
+    """Many concurrent provider calls: a thread per call (the old executor) versus coroutines on the gateway"""
+    server = start_stub_provider(lambda: args.latency)
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    payload = {'message': 'What is 2 + 2?'}
+
+    # Every request arrives at once, so latency counts the time spent queued for a worker or slot
+    def threaded(started):
+        def call(_):
+            requests.post(url, json=payload, timeout=30).json()
+            return (time.perf_counter() - started) * 1000
+
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            return list(executor.map(call, range(args.requests))), args.workers
+
+    def gateway(started):
+        gateway = AIGateway()
+        gateway.start()
+        client = ProviderHTTPClient('stub', pool_size=args.concurrency, concurrency=args.concurrency)
+
+        async def call():
+            await client.post_json(url, json=payload)
+            return (time.perf_counter() - started) * 1000
+
+        # One submission per request, as each Flask request thread would do
+        futures = [gateway.submit(call()) for _ in range(args.requests)]
+        latencies = [future.result() for future in futures]
+        peak = client.stats()['peak_in_flight']
+        gateway.stop(cleanup=client.close)
+        return latencies, peak
+
+    print(f"{'mode':>9} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'in flight':>10} {'I/O threads':>12}")
+    for label, fn, io_threads in (('threads', threaded, args.workers), ('gateway', gateway, 1)):
+        started = time.perf_counter()
+        latencies, in_flight = fn(started)
+        elapsed = time.perf_counter() - started
+        print(f"{label:>9} {args.requests / elapsed:>8.0f} {percentile(latencies, 0.5):>9.1f} "
+              f"{percentile(latencies, 0.95):>9.1f} {in_flight:>10} {io_threads:>12}")
+
+    server.shutdown()
+
+
+def fanout_worker(index, workers, url, args, barrier, results):
+    """One worker process: hosts members of its own pods and of the previous worker's pods"""
+    server = socketio.Server(async_mode='threading', client_manager=BrokerManager(url))
+    server.manager_initialized = True
+    server.manager.initialize()
+
+    received = [0]
+    lock = threading.Lock()
+
+    def send_packet(eio_sid, pkt):
+        pkt.encode()
+        with lock:
+            received[0] += 1
+
+    server._send_eio_packet = send_packet
+
+    for owner in {index, (index - 1) % workers}:
+        for pod in range(args.pods):
+            for member in range(args.members):
+                sid = server.manager.connect(f"eio_{index}_{owner}_{pod}_{member}", '/')
+                server.manager.enter_room(sid, '/', f"pod_{owner}_{pod}")
+
+    barrier.wait()
+    time.sleep(0.5)  # let every worker's subscriptions reach the broker
+    barrier.wait()
+
+    started = time.perf_counter()
+    for i in range(args.messages):
+        server.emit('new_message', {'username': f"user{i}", 'message': 'What is 2 + 2?'},
+                    room=f"pod_{index}_{i % args.pods}")
+
+    expected = args.messages * args.members * (2 if workers > 1 else 1)
+    deadline = time.time() + 60
+    while received[0] < expected and time.time() < deadline:
+        time.sleep(0.005)
+    results.put((received[0], expected, time.perf_counter() - started))
+
+
+def bench_socket_fanout(args):
+    """Pod broadcasts across N worker processes through the Socket.IO broker"""
+    print(f"{'workers':>8} {'messages':>9} {'deliveries':>11} {'missing':>8} {'deliveries/s':>13} "
+          f"{'per worker/s':>13} {'frames/msg':>11}")
+    for workers in args.workers:
+        broker = start_broker(('127.0.0.1', 0))
+        url = f"tcp://127.0.0.1:{broker.server_address[1]}"
+        barrier = multiprocessing.Barrier(workers)
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=fanout_worker, args=(index, workers, url, args, barrier, results))
+            for index in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        delivered = sum(outcome[0] for outcome in outcomes)
+        expected = sum(outcome[1] for outcome in outcomes)
+        elapsed = max(outcome[2] for outcome in outcomes)
+        stats = broker.stats()
+        broker.shutdown()
+        broker.server_close()
+        print(f"{workers:>8} {args.messages * workers:>9} {delivered:>11} {expected - delivered:>8} "
+              f"{delivered / elapsed:>13,.0f} {delivered / elapsed / workers:>13,.0f} "
+              f"{stats['delivered'] / max(1, stats['published']):>11.2f}")
+
+
+def build_pod_db(path):
+    """Create empty users and pod_messages tables (WAL, as the app's pool configures it)"""
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('CREATE TABLE users (id TEXT PRIMARY KEY, username TEXT)')
+    conn.execute('''
+        CREATE TABLE pod_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pod_id INTEGER,
+            user_id TEXT,
+            message TEXT,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+
+def bench_pod_chat(args):
+    """Busy pod: a connection and commit per message versus ring buffer plus group-commit writer"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'pods.db')
+        build_pod_db(path)
+
+        def connect():
+            return sqlite3.connect(path, timeout=30)
+
+        def per_message(pod_id, user_id, entry):
+            db = connect()
+            db.execute('INSERT INTO pod_messages (pod_id, user_id, message) VALUES (?, ?, ?)',
+                       (pod_id, user_id, entry['message']))
+            db.commit()
+            db.close()
+
+        chat = PodChat(connect, batch_size=args.batch_size, flush_interval=0.05)
+        chat.start()
+
+        print(f"{'writer':>12} {'handler p50 ms':>15} {'handler p95 ms':>15} {'messages/s':>11}")
+        for label, post in (('per-message', per_message), ('group-commit', chat.post)):
+            latencies = []
+            lock = threading.Lock()
+
+            def student(index):
+                for i in range(args.messages):
+                    entry = {'username': f"student{index}", 'message': f"message {i}", 'timestamp': utc_timestamp()}
+                    started = time.perf_counter()
+                    post(1, f"user{index}", entry)
+                    with lock:
+                        latencies.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            threads = [threading.Thread(target=student, args=(i,)) for i in range(args.students)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            print(f"{label:>12} {percentile(latencies, 0.5):>15.3f} {percentile(latencies, 0.95):>15.3f} "
+                  f"{len(latencies) / elapsed:>11,.0f}")
+
+        chat.stop()
+        stats = chat.stats()
+        print(f"\ngroup-commit: {stats['written']} rows in {stats['batches']} batches, "
+              f"max flush lag {stats['max_flush_lag_ms']:.1f} ms, {stats['dropped']} dropped")
+
+
+def bench_pod_history(args):
+    """Pod history pages: LIMIT/OFFSET with and without idx_pod_messages_pod versus keyset cursors"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'pods.db')
+        build_pod_db(path)
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.executemany('INSERT INTO users (id, username) VALUES (?, ?)',
+                         [(f"user{i}", f"student{i}") for i in range(1000)])
+
+        # Pod 1 is the busy one; the rest share what is left
+        started = time.perf_counter()
+        pods = (1 if random.random() < args.hot_share else random.randint(2, args.pods) for _ in range(args.rows))
+        rows = ((pod_id, f"user{i % 1000}", f"message {i}") for i, pod_id in enumerate(pods))
+        conn.executemany('INSERT INTO pod_messages (pod_id, user_id, message) VALUES (?, ?, ?)', rows)
+        conn.commit()
+        print(f"built {args.rows:,} messages across {args.pods} pods in {time.perf_counter() - started:.1f}s")
+
+        offset_query = '''
+            SELECT m.id, u.username, m.message, m.sent_at
+            FROM pod_messages m
+            LEFT JOIN users u ON u.id = m.user_id
+            WHERE m.pod_id = ?
+            ORDER BY m.id DESC
+            LIMIT ? OFFSET ?
+        '''
+        chat = PodChat(lambda: conn)
+        pods = [('busy', 1), ('quiet', 2)]
+
+        def depths(pod_id):
+            """(label, offset, keyset cursor) at the newest page, halfway back and near the start"""
+            ids = [row[0] for row in conn.execute(
+                'SELECT id FROM pod_messages WHERE pod_id = ? ORDER BY id DESC', (pod_id,))]
+            points = []
+            for label, fraction in (('newest', 0), ('middle', 0.5), ('oldest', 0.99)):
+                offset = int(len(ids) * fraction)
+                points.append((label, offset, ids[offset - 1] if offset else None))
+            return len(ids), points
+
+        def measure(indexed):
+            results = {}
+            for pod_label, pod_id in pods:
+                for label, offset, cursor in plan[pod_id][1]:
+                    results[(pod_label, label, 'offset')] = timed(
+                        lambda: conn.execute(offset_query, (pod_id, args.page_size, offset)).fetchall(),
+                        args.repeat)
+                    if indexed:
+                        results[(pod_label, label, 'keyset')] = timed(
+                            lambda: chat.page(pod_id, before=cursor, limit=args.page_size), args.repeat)
+            return results
+
+        conn.execute('CREATE INDEX tmp_pod ON pod_messages(pod_id)')
+        plan = {pod_id: depths(pod_id) for _, pod_id in pods}
+        conn.execute('DROP INDEX tmp_pod')
+        unindexed = measure(False)
+
+        started = time.perf_counter()
+        conn.execute('CREATE INDEX idx_pod_messages_pod ON pod_messages(pod_id, id)')
+        print(f"built idx_pod_messages_pod in {time.perf_counter() - started:.1f}s\n")
+        indexed = measure(True)
+
+        print(f"{'pod':>6} {'messages':>10} {'page':>7} {'offset, no index ms':>20} {'offset ms':>10} {'keyset ms':>10}")
+        for pod_label, pod_id in pods:
+            count, points = plan[pod_id]
+            for label, _, _ in points:
+                print(f"{pod_label:>6} {count:>10,} {label:>7} {unindexed[(pod_label, label, 'offset')]:>20.3f} "
+                      f"{indexed[(pod_label, label, 'offset')]:>10.3f} {indexed[(pod_label, label, 'keyset')]:>10.3f}")
+
+        page = chat.page(1, limit=args.page_size)
+        compact = json.dumps({'fields': ['id', 'username', 'message', 'sentAt'], 'messages': page},
+                             separators=(',', ':'))
+        verbose = json.dumps({'messages': [{'id': row[0], 'username': row[1], 'message': row[2], 'sentAt': row[3]}
+                                           for row in page]}, indent=2)
+        print(f"\npage of {len(page)}: {len(compact):,} bytes compact, {len(verbose):,} bytes as indented objects")
+        conn.close()
+
+
+
+def bench_battle_engine(args):
+    """Concurrent battles: moves scored with a query per move versus the engine's preloaded keys, AI on a timer wheel"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'battles.db')
+        build_question_db(path, args.questions).close()
+        conn = sqlite3.connect(path)
+        conn.execute('''
+            CREATE TABLE battles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT,
+                opponent_id TEXT,
+                user_score INTEGER,
+                opponent_score INTEGER,
+                winner_id TEXT,
+                xp_earned INTEGER,
+                duration INTEGER,
+                completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+        pool = ConnectionPool(path)
+        index = QuestionIndex()
+        keys = AnswerKeyCache(pool.connection)
+        with pool.connection() as db:
+            index.load(db)
+            keys.load(db)
+
+        events = {'battle_update': 0, 'battle_complete': 0}
+
+        def notify(user_id, event, payload):
+            events[event] += 1
+
+        wheel = TimerWheel(tick=args.tick)
+        wheel.start()
+        engine = BattleEngine(StateNamespace(MemoryBackend(), 'battles', ttl=1800), index, keys, pool.connection,
+                              wheel, notify, questions_per_battle=args.rounds, time_limit=args.time_limit,
+                              ai_think=(args.think / 2, args.think * 1.5))
+
+        started = time.perf_counter()
+        engine.start()
+        battles = {}
+        for i in range(args.battles):
+            battles[f"battle_{i}"] = (f"user{i}", engine.create(
+                f"battle_{i}", f"user{i}", {'id': f"ai_{i % 4}", 'rating': random.randint(800, 1200)}))
+        created = time.perf_counter() - started
+        print(f"created {args.battles:,} battles in {created:.2f}s ({args.battles / created:,.0f}/s)")
+
+        # Each user answers one question per think interval, half of them correctly
+        moves = []
+        for battle_id, (user_id, questions) in battles.items():
+            due = started
+            for question in questions:
+                due += random.uniform(args.think / 2, args.think * 1.5)
+                answer = keys.get(question['id']).answer if random.random() < 0.5 else 'wrong'
+                moves.append((due, battle_id, user_id, question['id'], answer))
+        moves.sort()
+
+        # Scoring cost alone: fetch and grade against the database versus the preloaded matcher
+        sample = moves[:args.battles]
+
+        def query_score():
+            for _, _, _, question_id, answer in sample:
+                with pool.connection() as db:
+                    row = db.execute('SELECT correct_answer FROM questions WHERE id = ?', (question_id,)).fetchone()
+                legacy_grade(row['correct_answer'], answer)
+
+        def preloaded_score():
+            for _, _, _, question_id, answer in sample:
+                keys.get(question_id).matcher(answer)
+
+        print(f"\n{'scoring':>10} {'us per move':>12}")
+        for label, fn in (('query', query_score), ('preloaded', preloaded_score)):
+            print(f"{label:>10} {timed(fn, 1) * 1000 / len(sample):>12.1f}")
+
+        latencies = []
+
+        def play(move):
+            _, battle_id, user_id, _, answer = move
+            move_started = time.perf_counter()
+            engine.move(battle_id, user_id, answer)
+            latencies.append((time.perf_counter() - move_started) * 1000)
+
+        # Replay the moves on schedule while the AI opponents answer on the wheel
+        offset = time.perf_counter() - started
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for move in moves:
+                delay = move[0] + offset - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(play, move)
+        elapsed = time.perf_counter() - started - offset
+
+        deadline = time.time() + args.time_limit + 5
+        while engine.stats()['finished'] < args.battles and time.time() < deadline:
+            time.sleep(0.2)
+        wheel.stop()
+        engine.stop()
+
+        stats = engine.stats()
+        timers = wheel.stats()
+        with pool.connection() as db:
+            rows = db.execute('SELECT COUNT(*) FROM battles').fetchone()[0]
+        pool.close_all()
+        print(f"\n{args.battles:,} concurrent battles: {len(latencies):,} user moves at {len(latencies) / elapsed:,.0f}/s, "
+              f"p50 {percentile(latencies, 0.5):.3f} ms, p95 {percentile(latencies, 0.95):.3f} ms, "
+              f"p99 {percentile(latencies, 0.99):.3f} ms")
+        print(f"{stats['finished']:,} finished ({stats['timed_out']} timed out), {rows:,} rows in battles, "
+              f"{stats['ai_moves']:,} AI moves, {events['battle_update']:,} updates pushed")
+        print(f"timer wheel: {timers['fired']:,} fired, max lag {timers['max_lag_ms']:.1f} ms at "
+              f"{args.tick * 1000:.0f} ms ticks on one thread (a thread per battle would need {args.battles:,})")
+
+
+
+def bench_matchmaking(args):
+    """Matchmaking queue simulation: throughput, wait-time percentiles and rating gaps on a simulated clock"""
+    print(f"{'arrivals/s':>10} {'players':>8} {'enqueues/s':>11} {'us/op':>7} {'max queued':>11} {'wait p50 s':>11} "
+          f"{'p95 s':>7} {'p99 s':>7} {'bots':>6} {'gap p50':>8} {'gap p95':>8}")
+    for rate in args.rates:
+        matchmaker = Matchmaker(band_size=args.band_size, base_window=args.base_window, widen_rate=args.widen_rate,
+                                max_window=args.max_window, bot_after=args.bot_after)
+        waits, gaps = [], []
+        bots = 0
+        max_queued = 0
+
+        def paired(now, pairs):
+            nonlocal bots
+            for ticket, opponent in pairs:
+                waits.append(now - ticket.enqueued_at)
+                if opponent is None:
+                    bots += 1
+                else:
+                    waits.append(now - opponent.enqueued_at)
+                    gaps.append(abs(ticket.rating - opponent.rating))
+
+        now = 0.0
+        next_sweep = 1.0
+        elapsed = 0.0
+        for i in range(args.players):
+            now += random.expovariate(rate)
+            rating = min(2400, max(100, random.gauss(1000, args.spread)))
+            started = time.perf_counter()
+            while next_sweep <= now:
+                paired(next_sweep, matchmaker.sweep(now=next_sweep))
+                next_sweep += 1.0
+            ticket, opponent = matchmaker.enqueue(f"player{i}", rating, now=now)
+            elapsed += time.perf_counter() - started
+            if opponent is not None:
+                paired(now, [(ticket, opponent)])
+            max_queued = max(max_queued, len(matchmaker))
+
+        # Let everyone still waiting be paired or handed to a bot
+        while len(matchmaker):
+            started = time.perf_counter()
+            paired(next_sweep, matchmaker.sweep(now=next_sweep))
+            elapsed += time.perf_counter() - started
+            next_sweep += 1.0
+
+        print(f"{rate:>10,} {args.players:>8,} {args.players / elapsed:>11,.0f} {elapsed * 1e6 / args.players:>7.1f} "
+              f"{max_queued:>11,} {percentile(waits, 0.5):>11.2f} {percentile(waits, 0.95):>7.2f} "
+              f"{percentile(waits, 0.99):>7.2f} {bots / args.players:>6.1%} {percentile(gaps, 0.5):>8.1f} "
+              f"{percentile(gaps, 0.95):>8.1f}")
+
+# The original generate_fallback_response() keyword lists, in their if/elif order
+LEGACY_TOPICS = [
+    ('math', ['math', 'calculate', 'solve', 'equation', 'algebra']),
+    ('science', ['science', 'biology', 'chemistry', 'physics', 'experiment']),
+    ('english', ['english', 'writing', 'grammar', 'literature', 'reading']),
+    ('help', ['help', 'stuck', 'confused', "don't understand", 'difficult']),
+    ('motivation', ['motivation', 'encourage', 'give up', 'hard', 'tired']),
+    ('code', ['code', 'programming', 'computer', 'technology'])
+]
+
+ROUTING_MESSAGES = [
+    "Can you help me solve this equation: 2x + 5 = 11?",
+    "I'm so confused about photosynthesis in biology class",
+    "What is the difference between a metaphor and a simile in literature?",
+    "I want to give up, this is too hard",
+    "How do I start programming in Python?",
+    "Tell me something cool about black holes",
+    "My essay on the civil war needs better grammar, can you check it?",
+    "Why does ice float on water? Is that chemistry or physics?",
+    "What's 15 percent of 80",
+    "hi"
+]
+
+
+def legacy_route(message):
+    message_lower = message.lower()
+    for topic, words in LEGACY_TOPICS:
+        if any(word in message_lower for word in words):
+            return topic
+    return None
+
+
+def bench_intent_routing(args):
+    """Fallback topic routing throughput: legacy substring scans versus the compiled IntentRouter"""
+    router = IntentRouter.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fallback_intents.json'))
+    messages = [random.choice(ROUTING_MESSAGES) for _ in range(args.messages)]
+
+    # The old function also picked one of its topic's responses (same texts as the config)
+    responses = {topic['id']: topic['responses'] for topic in router.topics}
+
+    def legacy_respond(message):
+        topic = legacy_route(message)
+        return random.choice(responses[topic] if topic is not None else router.default_responses)
+
+    runs = [
+        ('legacy', lambda: [legacy_route(message) for message in messages]),
+        ('route', lambda: [router.route(message) for message in messages]),
+        ('legacy+pick', lambda: [legacy_respond(message) for message in messages]),
+        ('respond', lambda: [router.respond(message) for message in messages])
+    ]
+
+    print(f"{'router':>11} {'messages/sec':>14}")
+    for label, fn in runs:
+        seconds = timed(fn, args.repeat) / 1000
+        print(f"{label:>11} {args.messages / seconds:>14,.0f}")
+
+    print(f"\n{'message':<70} {'legacy':>10} {'router':>10}")
+    for message in ROUTING_MESSAGES:
+        index = router.route(message)
+        topic = router.topics[index]['id'] if index is not None else None
+        print(f"{message[:70]:<70} {str(legacy_route(message)):>10} {str(topic):>10}")
+
+
+BENCHMARKS = {
+    'question-sampling': bench_question_sampling,
+    'answer-grading': bench_answer_grading,
+    'ai-dispatch': bench_ai_dispatch,
+    'provider-http': bench_provider_http,
+    'ai-streaming': bench_ai_streaming,
+    'ai-gateway': bench_ai_gateway,
+    'intent-routing': bench_intent_routing,
+    'socket-fanout': bench_socket_fanout,
+    'pod-chat': bench_pod_chat,
+    'pod-history': bench_pod_history,
+    'battle-engine': bench_battle_engine,
+    'matchmaking': bench_matchmaking
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='StarGuide backend benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    sampling = subparsers.add_parser('question-sampling', help=bench_question_sampling.__doc__)
+    sampling.add_argument('--rows', type=int, nargs='+', default=[1000, 100000, 1000000])
+    sampling.add_argument('--count', type=int, default=10)
+    sampling.add_argument('--repeat', type=int, default=20)
+
+    grading = subparsers.add_parser('answer-grading', help=bench_answer_grading.__doc__)
+    grading.add_argument('--attempts', type=int, default=100000)
+    grading.add_argument('--repeat', type=int, default=100)
+
+    dispatch = subparsers.add_parser('ai-dispatch', help=bench_ai_dispatch.__doc__)
+    dispatch.add_argument('--requests', type=int, default=200)
+    dispatch.add_argument('--providers', type=int, default=3)
+    dispatch.add_argument('--fast', type=float, default=0.05, help='Typical provider latency in seconds')
+    dispatch.add_argument('--slow', type=float, default=2.0, help='Tail latency in seconds')
+    dispatch.add_argument('--slow-fraction', type=float, default=0.05)
+    dispatch.add_argument('--hedge-delay', type=float, default=None, help='Fixed hedge delay (default: observed p95)')
+    dispatch.add_argument('--budget', type=float, default=5.0)
+
+    provider_http = subparsers.add_parser('provider-http', help=bench_provider_http.__doc__)
+    provider_http.add_argument('--requests', type=int, default=200)
+    provider_http.add_argument('--pool-size', type=int, default=10)
+    provider_http.add_argument('--server-latency', type=float, default=0.0)
+
+    streaming = subparsers.add_parser('ai-streaming', help=bench_ai_streaming.__doc__)
+    streaming.add_argument('--requests', type=int, default=10)
+    streaming.add_argument('--tokens', type=int, default=60)
+    streaming.add_argument('--first-token', type=float, default=0.2, help='Provider time to first token in seconds')
+    streaming.add_argument('--token-interval', type=float, default=0.03)
+
+    gateway = subparsers.add_parser('ai-gateway', help=bench_ai_gateway.__doc__)
+    gateway.add_argument('--requests', type=int, default=1000)
+    gateway.add_argument('--latency', type=float, default=0.2, help='Provider latency in seconds')
+    gateway.add_argument('--workers', type=int, default=16, help='Threads in the thread-per-call pool')
+    gateway.add_argument('--concurrency', type=int, default=100, help='Gateway in-flight limit per provider')
+
+    routing = subparsers.add_parser('intent-routing', help=bench_intent_routing.__doc__)
+    routing.add_argument('--messages', type=int, default=100000)
+    routing.add_argument('--repeat', type=int, default=3)
+
+    fanout = subparsers.add_parser('socket-fanout', help=bench_socket_fanout.__doc__)
+    fanout.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    fanout.add_argument('--pods', type=int, default=20, help='Pods per worker')
+    fanout.add_argument('--members', type=int, default=5, help='Members per pod on each hosting worker')
+    fanout.add_argument('--messages', type=int, default=2000, help='Messages sent per worker')
+
+    pod_chat = subparsers.add_parser('pod-chat', help=bench_pod_chat.__doc__)
+    pod_chat.add_argument('--students', type=int, default=30)
+    pod_chat.add_argument('--messages', type=int, default=100, help='Messages per student')
+    pod_chat.add_argument('--batch-size', type=int, default=500)
+
+    history = subparsers.add_parser('pod-history', help=bench_pod_history.__doc__)
+    history.add_argument('--rows', type=int, default=10000000, help='Messages in pod_messages')
+    history.add_argument('--pods', type=int, default=1000)
+    history.add_argument('--hot-share', type=float, default=0.1, help='Fraction of messages in the busy pod')
+    history.add_argument('--page-size', type=int, default=50)
+    history.add_argument('--repeat', type=int, default=5)
+
+    battle = subparsers.add_parser('battle-engine', help=bench_battle_engine.__doc__)
+    battle.add_argument('--battles', type=int, default=5000)
+    battle.add_argument('--rounds', type=int, default=5, help='Questions per battle')
+    battle.add_argument('--questions', type=int, default=2000, help='Questions in the bank')
+    battle.add_argument('--workers', type=int, default=16, help='Threads submitting moves')
+    battle.add_argument('--think', type=float, default=2.0, help='Mean seconds per answer (users and AI)')
+    battle.add_argument('--tick', type=float, default=0.05)
+    battle.add_argument('--time-limit', type=float, default=60)
+
+    matchmaking = subparsers.add_parser('matchmaking', help=bench_matchmaking.__doc__)
+    matchmaking.add_argument('--players', type=int, default=50000)
+    matchmaking.add_argument('--rates', type=float, nargs='+', default=[1, 10, 100, 1000],
+                             help='Player arrivals per simulated second')
+    matchmaking.add_argument('--spread', type=float, default=250, help='Standard deviation of player ratings')
+    matchmaking.add_argument('--band-size', type=int, default=50)
+    matchmaking.add_argument('--base-window', type=float, default=100)
+    matchmaking.add_argument('--widen-rate', type=float, default=10)
+    matchmaking.add_argument('--max-window', type=float, default=400)
+    matchmaking.add_argument('--bot-after', type=float, default=20)
+
+    args = parser.parse_args()
+    random.seed(42)
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+IDFS StarGuide - Conversation Store
+Server-side tutoring history per user and conversation, packed into a token budget for the providers
+"""
+
+import re
+import threading
+import time
+import logging
+from collections import OrderedDict, deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+Turn = namedtuple('Turn', ['role', 'text', 'tokens', 'words'])
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Too common to say anything about relevance
+COMMON_WORDS = {
+    'a', 'an', 'the', 'is', 'are', 'was', 'what', 'how', 'do', 'does', 'i', 'you', 'it', 'to',
+    'of', 'and', 'or', 'in', 'on', 'for', 'that', 'this', 'can', 'me', 'my', 'with', 'be', 'so'
+}
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token for English)"""
+    return len(text) // 4 + 1
+
+
+def content_words(text):
+    return {word for word in WORD_PATTERN.findall(text.lower()) if word not in COMMON_WORDS}
+
+
+def first_sentence(text, limit=120):
+    sentence = re.split(r'(?<=[.!?])\s', text.strip(), maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit - 3].rstrip() + '...'
+
+
+class Conversation:
+    """Ring buffer of recent turns plus a rolling summary of the turns that fell out"""
+
+    __slots__ = ('turns', 'summary', 'updated_at', 'size')
+
+    def __init__(self, max_turns):
+        self.turns = deque(maxlen=max_turns)
+        self.summary = deque()
+        self.updated_at = time.time()
+        self.size = 0
+
+
+class ConversationStore:
+    """Conversations keyed by (user_id, conversation_id) with LRU eviction under a memory cap
+
+    Each conversation keeps its last max_turns turns. Older student turns are
+    summarised extractively (their first sentence) into at most summary_chars
+    characters. context_for() packs the summary, the latest exchange and the
+    older turns most relevant to the new message into token_budget tokens.
+    """
+
+    def __init__(self, max_turns=20, max_conversations=10000, max_bytes=64 * 1024 * 1024,
+                 idle_ttl=2 * 3600, token_budget=400, summary_chars=600):
+        self.max_turns = max_turns
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.token_budget = token_budget
+        self.summary_chars = summary_chars
+
+        self._conversations = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'turns': 0, 'summarised': 0, 'evicted': 0, 'expired': 0, 'packed': 0, 'packed_tokens': 0}
+
+    def add_exchange(self, user_id, conversation_id, message, response):
+        """Append a student message and the tutor's reply"""
+        key = (user_id, conversation_id or 'default')
+        with self._lock:
+            conversation = self._conversations.get(key)
+            if conversation is None:
+                conversation = self._conversations[key] = Conversation(self.max_turns)
+            self._conversations.move_to_end(key)
+
+            for role, text in (('student', message), ('tutor', response)):
+                if not text:
+                    continue
+                if len(conversation.turns) == conversation.turns.maxlen:
+                    self._summarise(conversation, conversation.turns[0])
+                turn = Turn(role, text, estimate_tokens(text), content_words(text))
+                conversation.turns.append(turn)
+                conversation.size += len(text)
+                self._bytes += len(text)
+                self._stats['turns'] += 1
+
+            conversation.updated_at = time.time()
+            self._evict()
+
+    def _summarise(self, conversation, turn):
+        """Fold a turn leaving the ring buffer into the summary"""
+        conversation.size -= len(turn.text)
+        self._bytes -= len(turn.text)
+        if turn.role != 'student':
+            return
+
+        note = first_sentence(turn.text)
+        conversation.summary.append(note)
+        conversation.size += len(note)
+        self._bytes += len(note)
+        while sum(len(part) for part in conversation.summary) > self.summary_chars:
+            dropped = conversation.summary.popleft()
+            conversation.size -= len(dropped)
+            self._bytes -= len(dropped)
+        self._stats['summarised'] += 1
+
+    def _evict(self):
+        now = time.time()
+        while self._conversations:
+            key, oldest = next(iter(self._conversations.items()))
+            idle = now - oldest.updated_at > self.idle_ttl
+            if not (idle or len(self._conversations) > self.max_conversations or self._bytes > self.max_bytes):
+                break
+            del self._conversations[key]
+            self._bytes -= oldest.size
+            self._stats['expired' if idle else 'evicted'] += 1
+
+    def context_for(self, user_id, conversation_id, message, token_budget=None):
+        """Context string for the next provider call, or None if there is no history"""
+        budget = token_budget or self.token_budget
+        key = (user_id, conversation_id or 'default')
+        with self._lock:
+            conversation = self._conversations.get(key)
+            if conversation is None:
+                return None
+            now = time.time()
+            if now - conversation.updated_at > self.idle_ttl:
+                # Drop it here: a fresher entry may sit between it and the LRU end, where _evict stops
+                del self._conversations[key]
+                self._bytes -= conversation.size
+                self._stats['expired'] += 1
+                return None
+            # Keep LRU order matching updated_at so _evict can stop at the first live entry
+            conversation.updated_at = now
+            self._conversations.move_to_end(key)
+            turns = list(conversation.turns)
+            summary = list(conversation.summary)
+
+        if not turns:
+            return None
+
+        # The latest exchange always goes in; older turns compete on overlap with the new message
+        latest = set(range(max(0, len(turns) - 2), len(turns)))
+        words = content_words(message)
+        ranked = sorted(
+            (index for index in range(len(turns)) if index not in latest),
+            key=lambda index: (len(words & turns[index].words), index),
+            reverse=True
+        )
+
+        chosen = set()
+        used = 0
+        for index in sorted(latest, reverse=True) + ranked:
+            if used + turns[index].tokens > budget:
+                continue
+            chosen.add(index)
+            used += turns[index].tokens
+
+        lines = [f"{turns[index].role}: {turns[index].text}" for index in sorted(chosen)]
+        if summary:
+            summary_line = f"Earlier the student asked: {' / '.join(summary)}"
+            if used + estimate_tokens(summary_line) <= budget:
+                lines.insert(0, summary_line)
+                used += estimate_tokens(summary_line)
+
+        with self._lock:
+            self._stats['packed'] += 1
+            self._stats['packed_tokens'] += used
+        return '\n'.join(lines) or None
+
+    def forget(self, user_id, conversation_id=None):
+        """Drop one conversation, or all of a user's conversations"""
+        with self._lock:
+            keys = [key for key in self._conversations
+                    if key[0] == user_id and (conversation_id is None or key[1] == conversation_id)]
+            for key in keys:
+                self._bytes -= self._conversations.pop(key).size
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot.update({
+                'conversations': len(self._conversations),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            })
+        snapshot['avg_packed_tokens'] = round(snapshot['packed_tokens'] / snapshot['packed'], 1) if snapshot['packed'] else 0
+        return snapshot
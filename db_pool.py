@@ -0,0 +1,207 @@
+"""
+IDFS StarGuide - SQLite Connection Pool
+Bounded pool of warm connections shared across request threads
+"""
+
+import sqlite3
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free in time"""
+
+
+class PooledConnection:
+    """Thin wrapper that returns the connection to its pool on close()
+
+    Like a raw sqlite3.Connection, `with conn:` commits on success and rolls
+    back on error without closing. Once released the wrapper refuses further
+    use, since the pool may already have handed the connection to another
+    request.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._released = False
+        self.checked_out_at = time.time()
+
+    def __getattr__(self, name):
+        if self._released:
+            raise sqlite3.ProgrammingError("Cannot operate on a pooled connection after close()")
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        if self._released:
+            raise sqlite3.ProgrammingError("Cannot operate on a pooled connection after close()")
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._released:
+            raise sqlite3.ProgrammingError("Cannot operate on a pooled connection after close()")
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    @property
+    def released(self):
+        return self._released
+
+    def close(self):
+        """Hand the connection back to the pool instead of closing it"""
+        if not self._released:
+            self._released = True
+            conn, self._conn = self._conn, None
+            self._pool._release(conn)
+
+
+class ConnectionPool:
+    """Bounded LIFO pool of SQLite connections with pragmas applied once"""
+
+    def __init__(self, path, max_size=8, timeout=10, checkout_timeout=5,
+                 mmap_size=64 * 1024 * 1024, cache_size_kb=16 * 1024):
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.checkout_timeout = checkout_timeout
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+
+        self._idle = deque()
+        self._created = 0
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_ms': 0.0,
+            'timeouts': 0,
+            'leaks': 0,
+            'rollbacks': 0,
+            'created': 0,
+            'discarded': 0
+        }
+
+    def _connect(self):
+        """Open a new connection and apply per-connection pragmas"""
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def acquire(self):
+        """Check out a connection, waiting if the pool is exhausted"""
+        with self._cond:
+            if not self._idle and self._created >= self.max_size:
+                self._stats['waits'] += 1
+                started = time.time()
+                deadline = started + self.checkout_timeout
+                while not self._idle and self._created >= self.max_size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(f"No database connection free after {self.checkout_timeout}s")
+                    self._cond.wait(remaining)
+                self._stats['wait_time_ms'] += (time.time() - started) * 1000
+
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                self._created += 1
+                self._stats['created'] += 1
+                conn = None
+
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._created -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+
+        return PooledConnection(self, conn)
+
+    def _release(self, conn):
+        """Return a raw connection to the idle list, discarding broken ones"""
+        healthy = True
+        rolled_back = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+                rolled_back = True
+        except sqlite3.Error as e:
+            logger.warning(f"Discarding broken pooled connection: {str(e)}")
+            healthy = False
+
+        with self._cond:
+            self._in_use -= 1
+            if rolled_back:
+                self._stats['rollbacks'] += 1
+            if healthy and not self._closed:
+                self._idle.append(conn)
+            else:
+                # Broken, or the pool was shut down while it was checked out
+                self._created -= 1
+                if not healthy:
+                    self._stats['discarded'] += 1
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._cond.notify()
+
+    def reclaim(self, pooled):
+        """Release a connection the caller forgot to close and record the leak"""
+        if pooled is not None and not pooled.released:
+            with self._cond:
+                self._stats['leaks'] += 1
+            pooled.close()
+
+    @contextmanager
+    def connection(self):
+        """Context manager yielding a pooled connection"""
+        pooled = self.acquire()
+        try:
+            yield pooled
+        finally:
+            pooled.close()
+
+    def stats(self):
+        """Snapshot of pool counters"""
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot.update({
+                'size': self._created,
+                'max_size': self.max_size,
+                'idle': len(self._idle),
+                'in_use': self._in_use
+            })
+        snapshot['wait_time_ms'] = round(snapshot['wait_time_ms'], 2)
+        return snapshot
+
+    def close_all(self):
+        """Close every idle connection (checked-out ones close on release)"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn = self._idle.pop()
+                self._created -= 1
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
@@ -0,0 +1,191 @@
+"""
+IDFS StarGuide - Analytics Event Pipeline
+Bounded in-process queue with a background writer that batches analytics_events inserts
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SPILL_FORMATS = ('ndjson', 'sqlite')
+
+
+class EventPipeline:
+    """Queue analytics events off the request path and write them in batches
+
+    Events are dropped (and counted) when the queue is full, so requests never
+    wait on analytics. Batches the database rejects are spilled to a per-day
+    NDJSON file or SQLite database under spill_dir when one is configured.
+    """
+
+    def __init__(self, connect, max_queue=10000, batch_size=500, flush_interval=1.0,
+                 spill_dir=None, spill_format='ndjson'):
+        if spill_format not in SPILL_FORMATS:
+            raise ValueError(f"Unknown spill format: {spill_format}")
+
+        self._connect = connect
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_dir = spill_dir
+        self.spill_format = spill_format
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'dropped': 0,
+            'written': 0,
+            'spilled': 0,
+            'failed': 0,
+            'batches': 0,
+            'queue_high_watermark': 0,
+            'last_batch_size': 0,
+            'last_batch_ms': 0.0,
+            'last_lag_ms': 0.0
+        }
+
+    def emit(self, user_id, event_type, data):
+        """Queue an event without blocking; returns False if it was dropped"""
+        event = (
+            user_id,
+            event_type,
+            json.dumps(data),
+            datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            time.time()
+        )
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+            return False
+
+        depth = self._queue.qsize()
+        with self._lock:
+            self._stats['enqueued'] += 1
+            if depth > self._stats['queue_high_watermark']:
+                self._stats['queue_high_watermark'] = depth
+        return True
+
+    def start(self):
+        """Start the background writer"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='analytics-events', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._take_batch(self.flush_interval)
+            if batch:
+                self._write(batch)
+
+    def _take_batch(self, timeout):
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        started = time.time()
+        rows = [event[:4] for event in batch]
+        try:
+            with self._connect() as db:
+                db.executemany('''
+                    INSERT INTO analytics_events (user_id, event_type, event_data, created_at)
+                    VALUES (?, ?, ?, ?)
+                ''', rows)
+                db.commit()
+            outcome = 'written'
+        except Exception as e:
+            logger.error(f"Analytics event write error: {str(e)}")
+            outcome = 'spilled' if self._spill(rows) else 'failed'
+
+        finished = time.time()
+        with self._lock:
+            self._stats[outcome] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['last_batch_ms'] = round((finished - started) * 1000, 2)
+            self._stats['last_lag_ms'] = round((finished - batch[0][4]) * 1000, 2)
+
+    def _spill(self, rows):
+        """Append rows to today's spill file; returns True on success"""
+        if not self.spill_dir:
+            return False
+
+        day = datetime.utcnow().strftime('%Y-%m-%d')
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            if self.spill_format == 'ndjson':
+                path = os.path.join(self.spill_dir, f"analytics-{day}.ndjson")
+                with open(path, 'a', encoding='utf-8') as f:
+                    for user_id, event_type, event_data, created_at in rows:
+                        f.write(json.dumps({
+                            'user_id': user_id,
+                            'event_type': event_type,
+                            'event_data': event_data,
+                            'created_at': created_at
+                        }) + '\n')
+            else:
+                path = os.path.join(self.spill_dir, f"analytics-{day}.db")
+                conn = sqlite3.connect(path, timeout=10)
+                try:
+                    conn.execute('''
+                        CREATE TABLE IF NOT EXISTS analytics_events (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            user_id TEXT,
+                            event_type TEXT,
+                            event_data TEXT,
+                            created_at TIMESTAMP
+                        )
+                    ''')
+                    conn.executemany('''
+                        INSERT INTO analytics_events (user_id, event_type, event_data, created_at)
+                        VALUES (?, ?, ?, ?)
+                    ''', rows)
+                    conn.commit()
+                finally:
+                    conn.close()
+        except Exception as e:
+            logger.error(f"Analytics event spill error: {str(e)}")
+            return False
+        return True
+
+    def flush(self):
+        """Write everything currently queued"""
+        while True:
+            batch = self._take_batch(0)
+            if not batch:
+                return
+            self._write(batch)
+
+    def stop(self):
+        """Stop the writer and drain the queue"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        """Snapshot of pipeline counters and queue depth"""
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot.update({'queue_depth': self._queue.qsize(), 'max_queue': self.max_queue})
+        return snapshot
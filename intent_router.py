@@ -0,0 +1,139 @@
+"""
+IDFS StarGuide - Fallback Intent Router
+Keyword-weighted topic routing for local responses, compiled into a single regex
+"""
+
+import json
+import random
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+HINTS_PER_SUBJECT = 200
+
+
+def trie_pattern(words):
+    """Regex source matching any of words, factored by common prefix
+
+    Python's re tries alternatives one by one; nesting them as a trie
+    ("ma(?:th|ke)") means each position is rejected after a character or two.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        ends = '' in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 and not ends else f"(?:{'|'.join(branches)})"
+        return f"{body}?" if ends else body
+
+    return build(trie)
+
+
+class IntentRouter:
+    """Route a message to a topic and answer from that topic's responses
+
+    Topics come from a JSON config (see fallback_intents.json): each has
+    weighted keywords, responses and optionally a question bank subject with
+    templates that quote a question and its hint, used for template_rate of
+    that topic's replies (0 by default, so replies are the configured
+    responses unless a deployment opts in). All keywords are compiled
+    into one prefix-factored alternation run over the lowercased text; a
+    message scores the sum of its
+    keyword weights per topic (context matches count context_weight as much)
+    and ties go to the topic listed first.
+    """
+
+    def __init__(self, config):
+        self.topics = config['topics']
+        self.default_responses = config['default']['responses']
+        self.context_weight = config.get('context_weight', 0.25)
+        self.template_rate = config.get('template_rate', 0)
+
+        self._keywords = {}  # keyword -> [(topic index, weight)]
+        for index, topic in enumerate(self.topics):
+            for keyword, weight in topic['keywords'].items():
+                self._keywords.setdefault(keyword.lower(), []).append((index, weight))
+
+        # Only the start is anchored, so "math" still matches "mathematics"; the
+        # trie is greedy, so the longest keyword at a position wins
+        self._findall = re.compile(rf"\b{trie_pattern(self._keywords)}").findall
+
+        self._hints = {}
+        self._responses = [topic['responses'] for topic in self.topics]
+        self._routed = [0] * len(self.topics)  # per topic index
+        self._stats = {'default': 0, 'templated': 0}
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def load_hints(self, db):
+        """Keep a sample of question/hint pairs per subject for the topic templates"""
+        hints = {}
+        for subject in {topic['subject'] for topic in self.topics if topic.get('subject')}:
+            rows = db.execute('''
+                SELECT question, hint FROM questions
+                WHERE subject = ? AND hint IS NOT NULL AND hint != ''
+                LIMIT ?
+            ''', (subject, HINTS_PER_SUBJECT)).fetchall()
+            hints[subject] = [(row[0], row[1]) for row in rows]
+        self._hints = hints
+
+    def _scores(self, keywords, weight, scores):
+        for keyword in keywords:
+            for index, keyword_weight in self._keywords[keyword]:
+                scores[index] = scores.get(index, 0) + keyword_weight * weight
+
+    def route(self, message, context=''):
+        """Index of the best-scoring topic, or None when no keyword matches"""
+        found = self._findall(message.lower())
+        with_context = bool(context and self.context_weight)
+        if not with_context:
+            if not found:
+                return None
+            # Most messages hit one keyword of one topic; nothing to score
+            if len(found) == 1 and len(self._keywords[found[0]]) == 1:
+                return self._keywords[found[0]][0][0]
+
+        scores = {}
+        self._scores(found, 1, scores)
+        if with_context:
+            self._scores(self._findall(context.lower()), self.context_weight, scores)
+        if not scores:
+            return None
+        return max(scores, key=lambda index: (scores[index], -index))
+
+    def respond(self, message, context=''):
+        """Pick a local response for the message's topic"""
+        index = self.route(message, context)
+        # Counters are bumped without the lock (like AnswerKeyCache hits); it cost more than the routing
+        if index is None:
+            self._stats['default'] += 1
+            return random.choice(self.default_responses)
+
+        self._routed[index] += 1
+        if self.template_rate and random.random() < self.template_rate:
+            topic = self.topics[index]
+            hints = self._hints.get(topic.get('subject'))
+            if topic.get('templates') and hints:
+                self._stats['templated'] += 1
+                question, hint = random.choice(hints)
+                return random.choice(topic['templates']).format(question=question, hint=hint)
+        return random.choice(self._responses[index])
+
+    def stats(self):
+        return {
+            'routed': {topic['id']: count for topic, count in zip(self.topics, self._routed)},
+            'default': self._stats['default'],
+            'templated': self._stats['templated'],
+            'keywords': len(self._keywords)
+        }
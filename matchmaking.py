@@ -0,0 +1,428 @@
+"""
+IDFS StarGuide - Matchmaking
+Glicko ratings per player and a rating-band queue that pairs battle opponents, falling back to rated bots
+"""
+
+import math
+import random
+import threading
+import time
+import logging
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+BOT_NAMES = ['CosmoKid', 'StarSeeker', 'GalaxyBrain', 'NebulaKnight']
+
+# Bots and AI opponents play exactly at their rating, so they are rated with little uncertainty
+BOT_DEVIATION = 50
+
+# Glicko-1 constants
+Q = math.log(10) / 400
+
+
+def _g(deviation):
+    return 1 / math.sqrt(1 + 3 * Q ** 2 * deviation ** 2 / math.pi ** 2)
+
+
+def glicko_update(rating, deviation, opponent_rating, opponent_deviation, score, min_deviation=30):
+    """(rating, deviation) after one game scoring 1 (win), 0.5 (draw) or 0 (loss)"""
+    g = _g(opponent_deviation)
+    expected = 1 / (1 + 10 ** (-g * (rating - opponent_rating) / 400))
+    expected = min(max(expected, 1e-6), 1 - 1e-6)
+    d_squared = 1 / (Q ** 2 * g ** 2 * expected * (1 - expected))
+    denominator = 1 / deviation ** 2 + 1 / d_squared
+    rating += Q / denominator * g * (score - expected)
+    return rating, max(min_deviation, math.sqrt(1 / denominator))
+
+
+def bot_opponent(rating):
+    """A bot rated like the player it stands in for"""
+    return {
+        'id': f"bot_{int(rating)}",
+        'name': random.choice(BOT_NAMES),
+        'level': max(1, min(10, int((rating - 700) / 60))),
+        'rating': int(rating),
+        'bot': True
+    }
+
+
+class RatingStore:
+    """Glicko ratings cached in memory and written behind to player_ratings
+
+    Players never seen before start at default_rating with the maximum
+    deviation, so their first games move them quickly. Updated ratings are
+    flushed every interval seconds in one executemany upsert; the cache
+    keeps at most max_players, evicting only ratings already written.
+    """
+
+    def __init__(self, connect, default_rating=1000.0, default_deviation=350.0, interval=5.0,
+                 max_players=100000):
+        self._connect = connect
+        self.default_rating = default_rating
+        self.default_deviation = default_deviation
+        self.interval = interval
+        self.max_players = max_players
+
+        self._ratings = OrderedDict()  # user id -> [rating, deviation, games]
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._stats = {'loads': 0, 'games': 0, 'flushes': 0, 'rows_flushed': 0, 'errors': 0}
+
+    def _entry(self, user_id):
+        """The cached rating for user_id, loading it first on a miss
+
+        The query runs without _lock so a slow disk never stalls other
+        players' lookups; if two threads miss at once the first insert wins.
+        """
+        with self._lock:
+            entry = self._ratings.get(user_id)
+            if entry is not None:
+                self._ratings.move_to_end(user_id)
+                return entry
+
+        with self._connect() as db:
+            row = db.execute('SELECT rating, deviation, games FROM player_ratings WHERE user_id = ?',
+                             (user_id,)).fetchone()
+        loaded = list(row) if row else [self.default_rating, self.default_deviation, 0]
+
+        with self._lock:
+            entry = self._ratings.setdefault(user_id, loaded)
+            self._ratings.move_to_end(user_id)
+            if entry is loaded:
+                self._stats['loads'] += 1
+            self._evict()
+        return entry
+
+    def _evict(self):
+        """Drop the least recently used ratings already written; caller holds _lock"""
+        while len(self._ratings) > self.max_players:
+            oldest = next(iter(self._ratings))
+            if oldest in self._dirty:
+                break
+            del self._ratings[oldest]
+
+    def get(self, user_id):
+        """(rating, deviation) for user_id"""
+        entry = self._entry(user_id)
+        return entry[0], entry[1]
+
+    def record_game(self, user_id, score, opponent_id=None, opponent_rating=None, opponent_deviation=None):
+        """Apply one result, score from user_id's side
+
+        A human opponent (opponent_id) is updated too, both from their
+        pre-game ratings. Bots and AI opponents pass opponent_rating instead
+        and are not rated themselves.
+        """
+        player = self._entry(user_id)
+        opponent = self._entry(opponent_id) if opponent_id is not None else None
+        with self._lock:
+            # Put back an entry evicted since it was loaded; it was clean, so it still matches the table
+            player = self._ratings.setdefault(user_id, player)
+            if opponent is not None:
+                opponent = self._ratings.setdefault(opponent_id, opponent)
+                opponent_rating, opponent_deviation = opponent[0], opponent[1]
+                opponent[0], opponent[1] = glicko_update(opponent[0], opponent[1], player[0], player[1], 1 - score)
+                opponent[2] += 1
+                self._dirty.add(opponent_id)
+            player[0], player[1] = glicko_update(player[0], player[1], opponent_rating,
+                                                 opponent_deviation or self.default_deviation, score)
+            player[2] += 1
+            self._dirty.add(user_id)
+            self._stats['games'] += 1
+
+    def record_battle(self, battle):
+        """Rate a finished BattleEngine battle from its final scores
+
+        BattleEngine calls this from its writer thread, so loading a rating
+        that is not cached never holds up the timer wheel.
+        """
+        if battle['user_score'] == battle['opponent_score']:
+            score = 0.5
+        else:
+            score = 1 if battle['user_score'] > battle['opponent_score'] else 0
+        opponent = battle['opponent']
+        if opponent.get('human'):
+            self.record_game(battle['user_id'], score, opponent_id=opponent['id'])
+        else:
+            self.record_game(battle['user_id'], score, opponent_rating=opponent.get('rating', self.default_rating),
+                             opponent_deviation=BOT_DEVIATION)
+
+    def flush(self):
+        """Upsert every rating changed since the last flush"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            rows = [(user_id, *self._ratings[user_id]) for user_id in dirty if user_id in self._ratings]
+
+        if not rows:
+            return 0
+
+        try:
+            with self._connect() as db:
+                db.executemany('''
+                    INSERT INTO player_ratings (user_id, rating, deviation, games, updated_at)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        rating = excluded.rating,
+                        deviation = excluded.deviation,
+                        games = excluded.games,
+                        updated_at = excluded.updated_at
+                ''', rows)
+                db.commit()
+        except Exception as e:
+            # Mark them dirty again so the next flush retries
+            logger.error(f"Rating flush error: {str(e)}")
+            with self._lock:
+                self._dirty.update(row[0] for row in rows)
+                self._stats['errors'] += 1
+            return 0
+
+        with self._lock:
+            self._stats['flushes'] += 1
+            self._stats['rows_flushed'] += len(rows)
+        return len(rows)
+
+    def start(self):
+        """Start the background flush thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='rating-store', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.flush()
+
+    def stop(self):
+        """Stop the flush thread and write out whatever is still pending"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot.update({'players': len(self._ratings), 'pending': len(self._dirty)})
+        return snapshot
+
+
+class Ticket:
+    __slots__ = ('user_id', 'rating', 'name', 'subject', 'enqueued_at', 'band')
+
+    def __init__(self, user_id, rating, name, subject, enqueued_at, band):
+        self.user_id = user_id
+        self.rating = rating
+        self.name = name
+        self.subject = subject
+        self.enqueued_at = enqueued_at
+        self.band = band
+
+
+class Matchmaker:
+    """Pair waiting players by rating, widening how far apart they may be the longer they wait
+
+    Waiting tickets sit in rating bands of band_size points, oldest first,
+    kept apart per subject so players only meet someone who queued for the
+    same one.
+    A player's window starts at base_window and grows by widen_rate points
+    per second up to max_window; two players match when their gap fits the
+    wider of their two windows. Finding an opponent is a bisect over the
+    sorted list of occupied bands plus a look at the oldest ticket of each
+    band within max_window, nearest band first, so it stays O(log n)
+    however long the queue is. A sweep every sweep_interval retries the
+    oldest ticket of each band as windows widen and hands anyone who has
+    waited bot_after seconds to a bot. on_match(ticket, opponent) is called
+    for sweep pairings; opponent is a Ticket, or None for a bot.
+    """
+
+    def __init__(self, band_size=50, base_window=100, widen_rate=10, max_window=400, bot_after=30.0,
+                 sweep_interval=1.0, on_match=None, clock=time.time):
+        self.band_size = band_size
+        self.base_window = base_window
+        self.widen_rate = widen_rate
+        self.max_window = max_window
+        self.bot_after = bot_after
+        self.sweep_interval = sweep_interval
+        self.on_match = on_match
+        self.clock = clock
+
+        self._bands = {}  # (subject, band) -> OrderedDict of user id -> Ticket, oldest first
+        self._occupied = {}  # subject -> sorted bands with at least one ticket
+        self._tickets = {}  # user id -> Ticket
+        self._waits = deque(maxlen=1000)
+        self._gaps = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._stats = {'enqueued': 0, 'matched': 0, 'bot_matches': 0, 'cancelled': 0}
+
+    def window(self, ticket, now):
+        """How many rating points away ticket will accept an opponent at time now"""
+        return min(self.max_window, self.base_window + self.widen_rate * (now - ticket.enqueued_at))
+
+    def _add(self, ticket, oldest=False):
+        key = (ticket.subject, ticket.band)
+        band = self._bands.get(key)
+        if band is None:
+            band = self._bands[key] = OrderedDict()
+            insort(self._occupied.setdefault(ticket.subject, []), ticket.band)
+        band[ticket.user_id] = ticket
+        if oldest:
+            band.move_to_end(ticket.user_id, last=False)
+        self._tickets[ticket.user_id] = ticket
+
+    def _remove(self, ticket):
+        key = (ticket.subject, ticket.band)
+        band = self._bands[key]
+        del band[ticket.user_id]
+        if not band:
+            del self._bands[key]
+            occupied = self._occupied[ticket.subject]
+            del occupied[bisect_left(occupied, ticket.band)]
+            if not occupied:
+                del self._occupied[ticket.subject]
+        del self._tickets[ticket.user_id]
+
+    def _find(self, ticket, now):
+        """The best waiting opponent for ticket (not itself queued) in its subject, or None"""
+        occupied = self._occupied.get(ticket.subject)
+        if not occupied:
+            return None
+        reach = int(self.max_window // self.band_size) + 1
+        right = bisect_left(occupied, ticket.band)
+        left = right - 1
+        window = self.window(ticket, now)
+
+        # Walk outward from ticket's band, nearest band first
+        while True:
+            left_band = occupied[left] if left >= 0 else None
+            right_band = occupied[right] if right < len(occupied) else None
+            if left_band is not None and (right_band is None or ticket.band - left_band <= right_band - ticket.band):
+                band, left = left_band, left - 1
+            elif right_band is not None:
+                band, right = right_band, right + 1
+            else:
+                return None
+            if abs(band - ticket.band) > reach:
+                return None
+
+            candidate = next(iter(self._bands[(ticket.subject, band)].values()))
+            if abs(candidate.rating - ticket.rating) <= max(window, self.window(candidate, now)):
+                return candidate
+
+    def _paired(self, ticket, opponent, now):
+        """Record a pairing; caller holds _lock"""
+        for waiting in (ticket, opponent):
+            if waiting is not None:
+                self._waits.append(now - waiting.enqueued_at)
+        if opponent is None:
+            self._stats['bot_matches'] += 1
+        else:
+            self._stats['matched'] += 1
+            self._gaps.append(abs(ticket.rating - opponent.rating))
+
+    def enqueue(self, user_id, rating, name=None, subject=None, now=None):
+        """Queue a player; returns (ticket, opponent ticket) if paired at once, else (ticket, None)"""
+        now = self.clock() if now is None else now
+        with self._lock:
+            queued = self._tickets.get(user_id)
+            if queued is not None:
+                return queued, None
+
+            ticket = Ticket(user_id, rating, name, subject, now, int(rating // self.band_size))
+            self._stats['enqueued'] += 1
+            opponent = self._find(ticket, now)
+            if opponent is None:
+                self._add(ticket)
+                return ticket, None
+
+            self._remove(opponent)
+            self._paired(ticket, opponent, now)
+            return ticket, opponent
+
+    def cancel(self, user_id):
+        """Take a player out of the queue; returns False if they were not waiting"""
+        with self._lock:
+            ticket = self._tickets.get(user_id)
+            if ticket is None:
+                return False
+            self._remove(ticket)
+            self._stats['cancelled'] += 1
+            return True
+
+    def sweep(self, now=None):
+        """Pair tickets whose windows now overlap and send long waiters to bots; returns the pairings"""
+        now = self.clock() if now is None else now
+        pairings = []
+        with self._lock:
+            # Bots for anyone past bot_after (the oldest of each band go first)
+            for key in list(self._bands):
+                for ticket in list(self._bands[key].values()):
+                    if now - ticket.enqueued_at < self.bot_after:
+                        break
+                    self._remove(ticket)
+                    self._paired(ticket, None, now)
+                    pairings.append((ticket, None))
+
+            # Each band's oldest ticket has the widest window there; retry it against the rest
+            for key in list(self._bands):
+                tickets = self._bands.get(key)
+                if not tickets:
+                    continue
+                ticket = next(iter(tickets.values()))
+                self._remove(ticket)
+                opponent = self._find(ticket, now)
+                if opponent is None:
+                    self._add(ticket, oldest=True)
+                    continue
+                self._remove(opponent)
+                self._paired(opponent, ticket, now)
+                pairings.append((opponent, ticket))
+
+        if self.on_match is not None:
+            for ticket, opponent in pairings:
+                try:
+                    self.on_match(ticket, opponent)
+                except Exception as e:
+                    logger.error(f"Match start error: {str(e)}")
+        return pairings
+
+    def start(self):
+        """Start the sweep thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='matchmaker', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Matchmaking sweep error: {str(e)}")
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.sweep_interval + 1)
+            self._thread = None
+
+    def __len__(self):
+        return len(self._tickets)
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            waits = sorted(self._waits)
+            gaps = sorted(self._gaps)
+            snapshot.update({
+                'waiting': len(self._tickets),
+                'bands': len(self._bands),
+                'wait_p50_s': round(waits[len(waits) // 2], 2) if waits else 0.0,
+                'wait_p95_s': round(waits[int(len(waits) * 0.95)], 2) if waits else 0.0,
+                'gap_p50': round(gaps[len(gaps) // 2], 1) if gaps else 0.0
+            })
+        return snapshot
@@ -0,0 +1,201 @@
+"""
+IDFS StarGuide - Pod Chat
+Recent-message rings per pod for instant history, persisted to pod_messages by a group-commit writer
+"""
+
+import queue
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# SQLite's CURRENT_TIMESTAMP format, in UTC
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def utc_timestamp():
+    """Now as pod_messages stores it, so live and reloaded messages share one clock and format"""
+    return datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+
+
+class PodChat:
+    """Keep the last history_size messages of each pod in memory and write them in batches
+
+    Handlers broadcast first and then call post(), which only appends to the
+    pod's ring and queues the row, so a busy pod never waits on the SQLite
+    write lock. The writer commits everything queued in one transaction per
+    batch. Rows are dropped (and counted) when the queue is full. Rings are
+    kept for the max_pods most recently active pods; a pod seen for the first
+    time is warmed from pod_messages.
+    """
+
+    def __init__(self, connect, history_size=50, max_pods=5000, max_queue=10000, batch_size=500,
+                 flush_interval=0.2):
+        self._connect = connect
+        self.history_size = history_size
+        self.max_pods = max_pods
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._rings = OrderedDict()  # pod id -> deque of messages
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'posted': 0,
+            'dropped': 0,
+            'written': 0,
+            'failed': 0,
+            'batches': 0,
+            'ring_loads': 0,
+            'last_batch_size': 0,
+            'last_flush_lag_ms': 0.0,
+            'max_flush_lag_ms': 0.0
+        }
+
+    def page(self, pod_id, before=None, limit=50):
+        """One page of a pod's stored messages, newest first, as (id, username, message, sent_at) rows
+
+        Keyset pagination on (pod_id, id): pass the smallest id of the previous
+        page as before to get the next older page. Each page is a range seek on
+        idx_pod_messages_pod, so its cost does not grow with the pod's history.
+        """
+        with self._connect() as db:
+            rows = db.execute('''
+                SELECT m.id, u.username, m.message, m.sent_at
+                FROM pod_messages m
+                LEFT JOIN users u ON u.id = m.user_id
+                WHERE m.pod_id = ? AND m.id < ?
+                ORDER BY m.id DESC
+                LIMIT ?
+            ''', (pod_id, before if before is not None else 2 ** 63 - 1, limit)).fetchall()
+        return [(row[0], row[1] or 'Unknown', row[2], str(row[3])) for row in rows]
+
+    def _load(self, pod_id):
+        """The pod's latest messages from pod_messages, oldest first"""
+        return [
+            {'username': username, 'message': message, 'timestamp': sent_at}
+            for _, username, message, sent_at in reversed(self.page(pod_id, limit=self.history_size))
+        ]
+
+    def _ring(self, pod_id):
+        key = str(pod_id)
+        with self._lock:
+            ring = self._rings.get(key)
+            if ring is not None:
+                self._rings.move_to_end(key)
+                return ring
+
+        try:
+            messages = self._load(pod_id)
+        except Exception as e:
+            logger.error(f"Pod history load error: {str(e)}")
+            messages = []
+
+        with self._lock:
+            ring = self._rings.get(key)
+            if ring is None:
+                ring = self._rings[key] = deque(messages, maxlen=self.history_size)
+                self._stats['ring_loads'] += 1
+                while len(self._rings) > self.max_pods:
+                    self._rings.popitem(last=False)
+            return ring
+
+    def post(self, pod_id, user_id, entry):
+        """Record a message already broadcast as entry ({'username', 'message', 'timestamp'})
+
+        entry['timestamp'] should come from utc_timestamp(); it is stored
+        as the row's sent_at. Returns False if the row was dropped because the write queue is full.
+        """
+        ring = self._ring(pod_id)
+        with self._lock:
+            ring.append(entry)
+            self._stats['posted'] += 1
+
+        row = (pod_id, user_id, entry['message'], entry['timestamp'], time.time())
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+            return False
+        return True
+
+    def history(self, pod_id):
+        """The pod's recent messages, oldest first"""
+        ring = self._ring(pod_id)
+        with self._lock:
+            return list(ring)
+
+    def start(self):
+        """Start the background writer"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='pod-chat-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._take_batch(self.flush_interval)
+            if batch:
+                self._write(batch)
+
+    def _take_batch(self, timeout):
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            with self._connect() as db:
+                db.executemany('''
+                    INSERT INTO pod_messages (pod_id, user_id, message, sent_at)
+                    VALUES (?, ?, ?, ?)
+                ''', [row[:4] for row in batch])
+                db.commit()
+            outcome = 'written'
+        except Exception as e:
+            logger.error(f"Pod message write error: {str(e)}")
+            outcome = 'failed'
+
+        lag_ms = round((time.time() - batch[0][4]) * 1000, 2)
+        with self._lock:
+            self._stats[outcome] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['last_flush_lag_ms'] = lag_ms
+            self._stats['max_flush_lag_ms'] = max(self._stats['max_flush_lag_ms'], lag_ms)
+
+    def flush(self):
+        """Write everything currently queued"""
+        while True:
+            batch = self._take_batch(0)
+            if not batch:
+                return
+            self._write(batch)
+
+    def stop(self):
+        """Stop the writer and drain the queue"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['pods'] = len(self._rings)
+        snapshot.update({'queue_depth': self._queue.qsize(), 'max_queue': self.max_queue})
+        return snapshot
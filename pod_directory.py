@@ -0,0 +1,176 @@
+"""
+IDFS StarGuide - Pod Directory
+Active learning pods held in memory with denormalised member counts, filtered without queries
+"""
+
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PodDirectory:
+    """The pod list served from memory, loaded with one query and kept current by join() and leave()
+
+    member_count and each pod's member set are adjusted as members are
+    recorded in or removed from pod_members, so listing never re-runs the
+    JOIN/GROUP BY. Joins reserve their slot in memory and write pod_members
+    after releasing the lock, so reads never wait on a disk write. invalidate()
+    (called after a pod is created) drops everything; the next read
+    reloads. max_age bounds how stale the copy can get when other worker
+    processes change membership.
+    """
+
+    def __init__(self, connect, max_age=30.0):
+        self._connect = connect
+        self.max_age = max_age
+        self._pods = None  # pod id -> pod dict
+        self._members = {}  # pod id -> set of member user ids
+        self._order = []  # pod ids, newest first
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'loads': 0, 'invalidations': 0, 'joins': 0, 'leaves': 0, 'refused': 0}
+
+    def _load(self):
+        """Rebuild from the database; caller holds _lock"""
+        with self._connect() as db:
+            rows = db.execute('''
+                SELECT p.*, u.username as creator_name,
+                       COUNT(pm.user_id) as member_count
+                FROM learning_pods p
+                JOIN users u ON p.creator_id = u.id
+                LEFT JOIN pod_members pm ON p.id = pm.pod_id
+                WHERE p.is_active = 1
+                GROUP BY p.id
+                ORDER BY p.created_at DESC, p.id DESC
+            ''').fetchall()
+            members = db.execute('''
+                SELECT pm.pod_id, pm.user_id FROM pod_members pm
+                JOIN learning_pods p ON p.id = pm.pod_id
+                WHERE p.is_active = 1
+            ''').fetchall()
+        self._pods = {row['id']: dict(row) for row in rows}
+        self._members = {pod_id: set() for pod_id in self._pods}
+        for row in members:
+            self._members[row['pod_id']].add(row['user_id'])
+        self._order = [row['id'] for row in rows]
+        self._loaded_at = time.time()
+        self._stats['loads'] += 1
+
+    def _current(self):
+        """The pod map, reloading if invalidated or older than max_age; caller holds _lock"""
+        if self._pods is None or time.time() - self._loaded_at > self.max_age:
+            self._load()
+        else:
+            self._stats['hits'] += 1
+        return self._pods
+
+    def list(self, subject=None, full=None, limit=20):
+        """Newest active pods, optionally only one subject and only full (or only open) pods"""
+        with self._lock:
+            pods = self._current()
+            result = []
+            for pod_id in self._order:
+                pod = pods[pod_id]
+                if subject is not None and pod['subject'] != subject:
+                    continue
+                if full is not None and (pod['member_count'] >= pod['max_members']) != full:
+                    continue
+                result.append(dict(pod))
+                if len(result) >= limit:
+                    break
+            return result
+
+    def join(self, pod_id, user_id):
+        """Record user_id as a member; returns 'joined', 'member', 'full' or 'missing'"""
+        with self._lock:
+            pod = self._current().get(pod_id)
+            if pod is None:
+                return 'missing'
+            members = self._members[pod_id]
+            if user_id in members:
+                return 'member'
+            if pod['member_count'] >= pod['max_members']:
+                self._stats['refused'] += 1
+                return 'full'
+            # Hold the slot while the row is written
+            members.add(user_id)
+            pod['member_count'] += 1
+
+        try:
+            with self._connect() as db:
+                added = db.execute('INSERT OR IGNORE INTO pod_members (pod_id, user_id) VALUES (?, ?)',
+                                   (pod_id, user_id)).rowcount
+                db.commit()
+        except Exception:
+            with self._lock:
+                members.discard(user_id)
+                pod['member_count'] = max(0, pod['member_count'] - 1)
+            raise
+
+        with self._lock:
+            if not added:
+                # Already in pod_members (joined through another worker); drop the extra count
+                pod['member_count'] = max(0, pod['member_count'] - 1)
+                return 'member'
+            self._stats['joins'] += 1
+            return 'joined'
+
+    def leave(self, pod_id, user_id):
+        """Remove user_id from the pod; returns 'left', 'not_member' or 'last_admin'
+
+        The pod's only admin is refused, so a pod never loses its last admin.
+        """
+        with self._connect() as db:
+            # One statement, so two admins leaving at once cannot both pass the count
+            removed = db.execute('''
+                DELETE FROM pod_members WHERE pod_id = ? AND user_id = ?
+                AND (role != 'admin' OR (SELECT COUNT(*) FROM pod_members
+                                         WHERE pod_id = ? AND role = 'admin') > 1)
+            ''', (pod_id, user_id, pod_id)).rowcount
+            db.commit()
+            if not removed:
+                row = db.execute('SELECT role FROM pod_members WHERE pod_id = ? AND user_id = ?',
+                                 (pod_id, user_id)).fetchone()
+
+        with self._lock:
+            if not removed and row is not None:
+                self._stats['refused'] += 1
+                return 'last_admin'
+            members = self._members.get(pod_id)
+            if members is not None:
+                members.discard(user_id)
+            if not removed:
+                return 'not_member'
+            pod = (self._pods or {}).get(pod_id)
+            if pod is not None:
+                pod['member_count'] = max(0, pod['member_count'] - 1)
+            self._stats['leaves'] += 1
+            return 'left'
+
+    def is_member(self, pod_id, user_id):
+        """Whether user_id belongs to the pod, asking pod_members if this copy has not seen them join"""
+        with self._lock:
+            members = self._members.get(pod_id)
+            if members is not None and user_id in members:
+                return True
+
+        # Joins through other workers reach this copy only on reload
+        with self._connect() as db:
+            return db.execute('SELECT 1 FROM pod_members WHERE pod_id = ? AND user_id = ?',
+                              (pod_id, user_id)).fetchone() is not None
+
+    def invalidate(self):
+        """Drop the cached directory so the next read reloads it"""
+        with self._lock:
+            self._pods = None
+            self._members = {}
+            self._order = []
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['pods'] = len(self._pods or {})
+        return snapshot
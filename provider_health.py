@@ -0,0 +1,198 @@
+"""
+IDFS StarGuide - AI Provider Health
+Rolling error rates, latency histograms and circuit breakers per AI provider
+"""
+
+import bisect
+import threading
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+
+class ProviderHealth:
+    """Health of one provider: outcome window, latency histogram and breaker state
+
+    The breaker opens once the rolling window holds at least min_calls calls
+    and failure_threshold of them failed, or after consecutive_failures in a
+    row. After cooldown seconds one half-open probe is let through; its
+    success closes the breaker and its failure re-opens it.
+    """
+
+    def __init__(self, name, window=60.0, min_calls=5, failure_threshold=0.5,
+                 consecutive_failures=5, cooldown=30.0):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_threshold = failure_threshold
+        self.consecutive_failures = consecutive_failures
+        self.cooldown = cooldown
+
+        self.state = CLOSED
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._streak = 0
+        self._outcomes = deque()  # (timestamp, ok, latency_ms)
+        self._histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'failures': 0, 'opened': 0, 'probes': 0, 'rejected': 0}
+
+    def _trim(self, now):
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            self._outcomes.popleft()
+
+    def current_state(self):
+        """Breaker state, reporting an open breaker past its cooldown as half-open"""
+        with self._lock:
+            if self.state == OPEN and time.time() - self.opened_at >= self.cooldown:
+                return HALF_OPEN
+            return self.state
+
+    def allow(self):
+        """Whether a call may go out now; claims the probe slot when half-open"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.time() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                self._stats['probes'] += 1
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def release(self):
+        """Give back a claimed probe slot that was never used"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record(self, ok, latency_ms):
+        """Record one call outcome and update the breaker"""
+        now = time.time()
+        with self._lock:
+            self._outcomes.append((now, ok, latency_ms))
+            self._trim(now)
+            self._histogram[bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+            self._stats['calls'] += 1
+            self._streak = 0 if ok else self._streak + 1
+
+            if not ok:
+                self._stats['failures'] += 1
+
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                if ok:
+                    self._close()
+                else:
+                    self._open(now)
+            elif self.state == CLOSED and not ok:
+                failures = sum(1 for _, success, _ in self._outcomes if not success)
+                if (self._streak >= self.consecutive_failures or
+                        (len(self._outcomes) >= self.min_calls and
+                         failures / len(self._outcomes) >= self.failure_threshold)):
+                    self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self._stats['opened'] += 1
+        logger.warning(f"Circuit breaker opened for {self.name}")
+
+    def _close(self):
+        self.state = CLOSED
+        self.opened_at = None
+        self._streak = 0
+        self._outcomes.clear()
+        logger.info(f"Circuit breaker closed for {self.name}")
+
+    def latency_quantile(self, fraction, min_samples=1):
+        """Latency (ms) at the given quantile of successful calls in the window"""
+        with self._lock:
+            self._trim(time.time())
+            samples = sorted(latency for _, ok, latency in self._outcomes if ok)
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+    def snapshot(self):
+        """Current state, rolling error rate, quantiles and histogram"""
+        with self._lock:
+            self._trim(time.time())
+            total = len(self._outcomes)
+            failures = sum(1 for _, ok, _ in self._outcomes if not ok)
+            histogram = {
+                f"le_{bound}": count for bound, count in zip(LATENCY_BUCKETS_MS, self._histogram)
+            }
+            histogram['inf'] = self._histogram[-1]
+            snapshot = dict(self._stats)
+
+        p50 = self.latency_quantile(0.5)
+        p95 = self.latency_quantile(0.95)
+        snapshot.update({
+            'state': self.current_state(),
+            'window_calls': total,
+            'error_rate': round(failures / total, 3) if total else 0.0,
+            'p50_ms': round(p50, 1) if p50 is not None else None,
+            'p95_ms': round(p95, 1) if p95 is not None else None,
+            'latency_histogram': histogram
+        })
+        return snapshot
+
+
+class HealthRegistry:
+    """ProviderHealth for every provider plus latency-aware routing"""
+
+    def __init__(self, names, routing_slack=2.0, **breaker_options):
+        self.routing_slack = routing_slack
+        self.providers = {name: ProviderHealth(name, **breaker_options) for name in names}
+
+    def allow(self, name):
+        return self.providers[name].allow()
+
+    def release(self, name):
+        self.providers[name].release()
+
+    def record(self, name, ok, latency_ms):
+        self.providers[name].record(ok, latency_ms)
+
+    def is_open(self, name):
+        """True while the breaker is open and not yet due for a probe"""
+        return self.providers[name].current_state() == OPEN
+
+    def route(self, order):
+        """Reorder providers: open breakers dropped, fastest observed p50 first
+
+        The first (requested) provider keeps its place unless its p50 is more
+        than routing_slack times the fastest healthy provider's.
+        """
+        candidates = [name for name in order if name in self.providers and not self.is_open(name)]
+        if len(candidates) < 2:
+            return candidates
+
+        latency = {name: self.providers[name].latency_quantile(0.5) for name in candidates}
+        known = [value for value in latency.values() if value is not None]
+        if not known:
+            return candidates
+
+        fastest = min(known)
+        # Providers without samples rank after measured ones, in their original order
+        ranked = sorted(candidates, key=lambda name: (latency[name] is None, latency[name] or 0))
+
+        preferred = candidates[0]
+        if latency[preferred] is None or latency[preferred] <= fastest * self.routing_slack:
+            ranked.remove(preferred)
+            ranked.insert(0, preferred)
+        return ranked
+
+    def snapshot(self):
+        return {name: health.snapshot() for name, health in self.providers.items()}
@@ -0,0 +1,143 @@
+"""
+IDFS StarGuide - AI Provider HTTP Clients
+Pooled keep-alive aiohttp sessions per AI provider with a concurrency limit and per-phase timeouts
+"""
+
+import asyncio
+import json
+import threading
+import logging
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderHTTPClient:
+    """One aiohttp session per provider, used from the AI gateway's event loop
+
+    pool_size bounds the keep-alive connections to the provider and
+    concurrency bounds the calls in flight (requests beyond it wait for a
+    slot), so chat concurrency follows provider quotas rather than threads.
+    Timeouts are split into connect and read, each capped by the caller's
+    remaining budget.
+    """
+
+    def __init__(self, name, pool_size=10, concurrency=20, connect_timeout=3.05, read_timeout=30.0, ssl=None):
+        self.name = name
+        self.pool_size = pool_size
+        self.concurrency = concurrency
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.ssl = ssl
+
+        self._session = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'requests': 0, 'errors': 0, 'timeouts': 0,
+            'connections_opened': 0, 'connections_reused': 0,
+            'in_flight': 0, 'waiting': 0, 'peak_in_flight': 0
+        }
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self._stats[key] += delta
+            if key == 'in_flight' and self._stats['in_flight'] > self._stats['peak_in_flight']:
+                self._stats['peak_in_flight'] = self._stats['in_flight']
+
+    @property
+    def session(self):
+        """The provider's session, created on first use inside the event loop"""
+        if self._session is None:
+            trace = aiohttp.TraceConfig()
+
+            async def opened(session, context, params):
+                self._count('connections_opened')
+
+            async def reused(session, context, params):
+                self._count('connections_reused')
+
+            trace.on_connection_create_end.append(opened)
+            trace.on_connection_reuseconn.append(reused)
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, ssl=self.ssl),
+                trace_configs=[trace]
+            )
+        return self._session
+
+    def timeouts(self, budget=None):
+        """aiohttp timeout with connect and read phases capped by the remaining budget"""
+        connect, read = self.connect_timeout, self.read_timeout
+        if budget is not None:
+            connect, read = min(connect, budget), min(read, budget)
+        return aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one of the provider's concurrency slots"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        self._count('waiting')
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._count('waiting', -1)
+
+        self._count('requests')
+        self._count('in_flight')
+        try:
+            yield
+        except asyncio.TimeoutError:
+            self._count('timeouts')
+            raise
+        except aiohttp.ClientError:
+            self._count('errors')
+            raise
+        finally:
+            self._count('in_flight', -1)
+            self._semaphore.release()
+
+    async def post_json(self, url, timeout=None, **kwargs):
+        """POST and return (status, decoded JSON body or None)"""
+        async with self.slot():
+            async with self.session.post(url, timeout=self.timeouts(timeout), **kwargs) as response:
+                if response.status != 200:
+                    return response.status, None
+                return response.status, await response.json(content_type=None)
+
+    async def post_events(self, url, timeout=None, **kwargs):
+        """POST and yield the JSON payloads of a server-sent events response"""
+        async with self.slot():
+            async with self.session.post(url, timeout=self.timeouts(timeout), **kwargs) as response:
+                if response.status != 200:
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, response.history,
+                        status=response.status, message=f"{self.name} API error"
+                    )
+                async for line in response.content:
+                    line = line.decode('utf-8').strip()
+                    if line.startswith('data:'):
+                        payload = line[5:].strip()
+                        if payload and payload != '[DONE]':
+                            yield json.loads(payload)
+
+    def stats(self):
+        """Request counters, concurrency and connections opened versus reused"""
+        with self._lock:
+            snapshot = dict(self._stats)
+        connections = snapshot['connections_opened'] + snapshot['connections_reused']
+        snapshot.update({
+            'pool_size': self.pool_size,
+            'concurrency': self.concurrency,
+            'reuse_rate': round(snapshot['connections_reused'] / connections, 3) if connections else 0.0
+        })
+        return snapshot
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,277 @@
+"""
+IDFS StarGuide - Question Bank Helpers
+In-memory indexes over the questions table used by the assessment routes
+"""
+
+import random
+import threading
+import logging
+from bisect import bisect_right
+from collections import namedtuple
+
+from answer_matching import compile_matcher
+
+logger = logging.getLogger(__name__)
+
+
+class QuestionIndex:
+    """Question ids bucketed by (subject, difficulty) for O(count) random sampling"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def load(self, db):
+        """Rebuild the index from the questions table"""
+        rows = db.execute('SELECT id, subject, difficulty FROM questions').fetchall()
+
+        buckets = {}
+        positions = {}
+        for row in rows:
+            key = (row['subject'], row['difficulty'])
+            bucket = buckets.setdefault(key, [])
+            positions[row['id']] = (key, len(bucket))
+            bucket.append(row['id'])
+
+        with self._lock:
+            self._buckets = buckets
+            self._positions = positions
+
+        logger.info(f"Question index loaded with {len(positions)} questions in {len(buckets)} buckets")
+
+    def add(self, question_id, subject, difficulty):
+        """Register a newly inserted question"""
+        with self._lock:
+            if question_id in self._positions:
+                self._remove_locked(question_id)
+            key = (subject, difficulty)
+            bucket = self._buckets.setdefault(key, [])
+            self._positions[question_id] = (key, len(bucket))
+            bucket.append(question_id)
+
+    def remove(self, question_id):
+        """Drop a question from the index"""
+        with self._lock:
+            self._remove_locked(question_id)
+
+    def _remove_locked(self, question_id):
+        entry = self._positions.pop(question_id, None)
+        if entry is None:
+            return
+
+        # Swap-remove keeps deletion O(1)
+        key, position = entry
+        bucket = self._buckets[key]
+        last_id = bucket.pop()
+        if last_id != question_id:
+            bucket[position] = last_id
+            self._positions[last_id] = (key, position)
+        if not bucket:
+            del self._buckets[key]
+
+    def sample(self, subject=None, difficulty=None, count=10):
+        """Pick up to `count` distinct question ids matching the filters"""
+        with self._lock:
+            buckets = [
+                ids for (bucket_subject, bucket_difficulty), ids in self._buckets.items()
+                if (subject is None or bucket_subject == subject)
+                and (difficulty is None or bucket_difficulty == difficulty)
+            ]
+
+            offsets = []
+            total = 0
+            for ids in buckets:
+                offsets.append(total)
+                total += len(ids)
+
+            if total == 0 or count <= 0:
+                return []
+
+            # random.sample over a range draws k distinct indices without materialising the range
+            picks = random.sample(range(total), min(count, total))
+            sampled = []
+            for pick in picks:
+                i = bisect_right(offsets, pick) - 1
+                sampled.append(buckets[i][pick - offsets[i]])
+
+        return sampled
+
+    def __len__(self):
+        return len(self._positions)
+
+
+AnswerKey = namedtuple('AnswerKey', ['answer', 'explanation', 'matcher'])
+
+
+class AnswerKeyCache:
+    """Preloaded answer keys with lazily built matchers so validation skips the database"""
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    @staticmethod
+    def _build(row):
+        matcher = compile_matcher(row['type'], row['correct_answer'], row['options'])
+        return AnswerKey(row['correct_answer'], row['explanation'], matcher)
+
+    def load(self, db):
+        """Rebuild every answer key from the questions table"""
+        rows = db.execute('SELECT id, type, options, correct_answer, explanation FROM questions').fetchall()
+        keys = {row['id']: self._build(row) for row in rows}
+        with self._lock:
+            self._keys = keys
+        logger.info(f"Answer key cache loaded with {len(keys)} questions")
+
+    def get(self, question_id):
+        """Answer key for a question, loading it on a cache miss"""
+        key = self._keys.get(question_id)
+        if key is not None:
+            self._stats['hits'] += 1
+            return key
+
+        self._stats['misses'] += 1
+        with self._connect() as db:
+            row = db.execute('''
+                SELECT id, type, options, correct_answer, explanation FROM questions WHERE id = ?
+            ''', (question_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        key = self._build(row)
+        with self._lock:
+            self._keys[row['id']] = key
+        return key
+
+    def invalidate(self, question_id=None):
+        """Drop one cached key after its question is edited, or all of them"""
+        with self._lock:
+            if question_id is None:
+                self._keys = {}
+            else:
+                self._keys.pop(question_id, None)
+        self._stats['invalidations'] += 1
+
+    def stats(self):
+        """Snapshot of cache counters"""
+        return dict(self._stats, size=len(self._keys))
+
+
+class UsageCounters:
+    """Write-behind aggregator for per-question usage and answer counters"""
+
+    def __init__(self, connect, interval=5.0, max_pending=500):
+        self._connect = connect
+        self.interval = interval
+        self.max_pending = max_pending
+
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._stats = {'flushes': 0, 'rows_flushed': 0, 'errors': 0}
+
+    def _delta(self, question_id):
+        delta = self._pending.get(question_id)
+        if delta is None:
+            delta = self._pending[question_id] = [0, 0, 0]
+        return delta
+
+    def record_usage(self, question_ids):
+        """Count questions served to a student"""
+        with self._lock:
+            for question_id in question_ids:
+                self._delta(question_id)[0] += 1
+            pending = len(self._pending)
+        self._maybe_wake(pending)
+
+    def record_attempt(self, question_id, is_correct):
+        """Count an answer attempt and whether it was correct"""
+        with self._lock:
+            delta = self._delta(question_id)
+            delta[1] += 1
+            delta[2] += 1 if is_correct else 0
+            pending = len(self._pending)
+        self._maybe_wake(pending)
+
+    def _maybe_wake(self, pending):
+        if pending >= self.max_pending:
+            self._wakeup.set()
+
+    def flush(self):
+        """Apply all pending deltas in a single executemany transaction"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+
+            if not pending:
+                return 0
+
+            rows = [
+                {'id': question_id, 'usage': usage, 'attempts': attempts, 'correct': correct}
+                for question_id, (usage, attempts, correct) in pending.items()
+            ]
+
+            try:
+                with self._connect() as db:
+                    db.executemany('''
+                        UPDATE questions
+                        SET usage_count = usage_count + :usage,
+                            attempt_count = attempt_count + :attempts,
+                            correct_count = correct_count + :correct,
+                            success_rate = CASE
+                                WHEN attempt_count + :attempts > 0
+                                THEN CAST(correct_count + :correct AS REAL) / (attempt_count + :attempts)
+                                ELSE success_rate
+                            END
+                        WHERE id = :id
+                    ''', rows)
+                    db.commit()
+            except Exception as e:
+                # Put the deltas back so the next flush retries them
+                logger.error(f"Question counter flush error: {str(e)}")
+                with self._lock:
+                    for question_id, (usage, attempts, correct) in pending.items():
+                        delta = self._delta(question_id)
+                        delta[0] += usage
+                        delta[1] += attempts
+                        delta[2] += correct
+                self._stats['errors'] += 1
+                return 0
+
+            self._stats['flushes'] += 1
+            self._stats['rows_flushed'] += len(rows)
+            return len(rows)
+
+    def start(self):
+        """Start the background flush thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='question-counters', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stop(self):
+        """Stop the flush thread and write out whatever is still pending"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        """Snapshot of flush counters"""
+        with self._lock:
+            pending = len(self._pending)
+        return dict(self._stats, pending=pending)
@@ -0,0 +1,97 @@
+"""
+IDFS StarGuide - Rate Limiter
+Token buckets for AI chat, per user (burst and refill by role) and per provider
+"""
+
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBucketStore:
+    """In-process token buckets keyed by string, least recently used dropped past max_keys
+
+    The limiter only calls take(), so a shared store (e.g. Redis running the
+    same arithmetic in a Lua script) can replace this one to hold limits
+    across gunicorn workers. A dropped bucket comes back full, which only
+    affects keys idle long enough to have refilled anyway.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, cost=1):
+        """Spend cost tokens from a bucket refilling at rate per second; returns (allowed, tokens left)"""
+        now = time.time()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [capacity, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+
+            if bucket[0] < cost:
+                return False, bucket[0]
+            bucket[0] -= cost
+            return True, bucket[0]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RateLimiter:
+    """AI chat limits: one bucket per user sized by role, one per provider for its quota
+
+    role_limits and provider_limits map a role or provider name to
+    (burst, per_minute). Users whose role has no entry get default_role's
+    limits; providers without an entry are not limited.
+    """
+
+    def __init__(self, role_limits, provider_limits=None, default_role='student', store=None):
+        self.role_limits = role_limits
+        self.provider_limits = provider_limits or {}
+        self.default_role = default_role
+        self.store = store or MemoryBucketStore()
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'users': {role: {'allowed': 0, 'throttled': 0} for role in role_limits},
+            'providers': {name: {'allowed': 0, 'throttled': 0} for name in self.provider_limits}
+        }
+
+    def _take(self, group, name, key, burst, per_minute):
+        allowed, _ = self.store.take(key, burst, per_minute / 60.0)
+        with self._lock:
+            self._stats[group][name]['allowed' if allowed else 'throttled'] += 1
+        return allowed
+
+    def allow_user(self, user_id, role=None):
+        """Spend one of the user's tokens; False means answer locally instead"""
+        role = role if role in self.role_limits else self.default_role
+        burst, per_minute = self.role_limits[role]
+        return self._take('users', role, f"user:{user_id}", burst, per_minute)
+
+    def allow_provider(self, name):
+        """Spend one of the provider's tokens; False means skip the provider this time"""
+        if name not in self.provider_limits:
+            return True
+        burst, per_minute = self.provider_limits[name]
+        return self._take('providers', name, f"provider:{name}", burst, per_minute)
+
+    def stats(self):
+        with self._lock:
+            snapshot = {
+                group: {name: dict(counts) for name, counts in entries.items()}
+                for group, entries in self._stats.items()
+            }
+        snapshot['buckets'] = len(self.store)
+        return snapshot
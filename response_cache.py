@@ -0,0 +1,192 @@
+"""
+IDFS StarGuide - AI Response Cache
+Exact and n-gram similarity tiers in front of the AI providers, with TTL, LRU and a memory cap
+"""
+
+import re
+import sys
+import threading
+import time
+import unicodedata
+import logging
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger(__name__)
+
+CachedResponse = namedtuple('CachedResponse', ['response', 'provider', 'response_time', 'tier'])
+
+# Words that carry no meaning for matching "what is photosynthesis" against "what's photosynthesis?"
+STOPWORDS = {
+    'a', 'an', 'the', 'is', 'are', 'was', 'were', 'what', 'whats', 'how', 'do', 'does', 'i',
+    'me', 'my', 'you', 'can', 'could', 'please', 'to', 'of', 'and', 'or', 'in', 'on', 'for',
+    'it', 'this', 'that', 'explain', 'tell', 'about', 'with', 'help'
+}
+
+
+def normalize(text):
+    """Case-fold, unify unicode forms (x² -> x2) and collapse punctuation and whitespace"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    text = text.replace("'", '').replace('^', '')
+    text = re.sub(r"[^\w\s+\-*/^=().<>]", ' ', text)
+    return ' '.join(text.split())
+
+
+def content_words(text):
+    return [word for word in text.split() if word not in STOPWORDS]
+
+
+def trigrams(words):
+    padded = f"  {' '.join(words)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def signature(text):
+    """Numbers must match exactly for a similarity hit ("2 + 3" is not "2 + 4")"""
+    return tuple(sorted(set(re.findall(r'\d+(?:\.\d+)?', text))))
+
+
+class _Entry:
+    __slots__ = ('key', 'response', 'provider', 'response_time', 'expires_at', 'grams', 'words', 'size')
+
+    def __init__(self, key, response, provider, response_time, expires_at, grams, words):
+        self.key = key
+        self.response = response
+        self.provider = provider
+        self.response_time = response_time
+        self.expires_at = expires_at
+        self.grams = grams
+        self.words = words
+        self.size = (sys.getsizeof(response) + sum(sys.getsizeof(part) for part in key) +
+                     sum(sys.getsizeof(gram) for gram in grams) + 256)
+
+
+class ResponseCache:
+    """LRU cache of provider answers with an exact tier and a trigram similarity tier
+
+    The exact tier is keyed on the normalised (message, context, provider).
+    The similarity tier only considers entries with the same context,
+    provider and set of numbers, found through an inverted index of
+    content words, and accepts the best trigram Jaccard score (over content
+    words only) at or above similarity_threshold.
+    """
+
+    def __init__(self, ttl=3600, max_entries=5000, max_bytes=32 * 1024 * 1024,
+                 similarity_threshold=0.8, max_candidates=64):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.similarity_threshold = similarity_threshold
+        self.max_candidates = max_candidates
+
+        self._entries = OrderedDict()
+        self._words = {}  # (context, provider, signature, word) -> set of keys
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'exact_hits': 0, 'similar_hits': 0, 'misses': 0, 'stores': 0,
+                       'evictions': 0, 'expired': 0, 'saved_ms': 0}
+
+    def _key(self, message, context, provider):
+        return (normalize(message), normalize(context), provider)
+
+    def _scope(self, key):
+        return (key[1], key[2], signature(key[0]))
+
+    def get(self, message, context, provider):
+        """Return a CachedResponse for this prompt, or None on a miss"""
+        key = self._key(message, context, provider)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            tier = 'exact'
+            if entry is not None and entry.expires_at <= now:
+                self._remove(entry)
+                self._stats['expired'] += 1
+                entry = None
+            if entry is None:
+                entry = self._find_similar(key, now)
+                tier = 'similar'
+
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(entry.key)
+            self._stats[f"{tier}_hits"] += 1
+            self._stats['saved_ms'] += entry.response_time
+            return CachedResponse(entry.response, entry.provider, entry.response_time, tier)
+
+    def _find_similar(self, key, now):
+        scope = self._scope(key)
+        words = content_words(key[0])
+
+        candidates = set()
+        for word in set(words):
+            candidates.update(self._words.get(scope + (word,), ()))
+            if len(candidates) >= self.max_candidates:
+                break
+        if not candidates:
+            return None
+
+        grams = trigrams(words)
+        best, best_score = None, self.similarity_threshold
+        for candidate_key in candidates:
+            entry = self._entries.get(candidate_key)
+            if entry is None or entry.expires_at <= now:
+                continue
+            shared = len(grams & entry.grams)
+            score = shared / (len(grams) + len(entry.grams) - shared)
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    def put(self, message, context, provider, response, answered_by, response_time):
+        """Store a provider answer; response_time is what a later hit saves"""
+        key = self._key(message, context, provider)
+        words = content_words(key[0])
+        entry = _Entry(key, response, answered_by, response_time, time.time() + self.ttl,
+                       trigrams(words), set(words))
+        if entry.size > self.max_bytes:
+            return
+
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None:
+                self._remove(existing)
+
+            self._entries[key] = entry
+            self._bytes += entry.size
+            scope = self._scope(key)
+            for word in words:
+                self._words.setdefault(scope + (word,), set()).add(key)
+            self._stats['stores'] += 1
+
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries.values())))
+                self._stats['evictions'] += 1
+
+    def _remove(self, entry):
+        del self._entries[entry.key]
+        self._bytes -= entry.size
+        scope = self._scope(entry.key)
+        for word in entry.words:
+            keys = self._words.get(scope + (word,))
+            if keys is not None:
+                keys.discard(entry.key)
+                if not keys:
+                    del self._words[scope + (word,)]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._words.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot.update({'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes})
+        lookups = snapshot['exact_hits'] + snapshot['similar_hits'] + snapshot['misses']
+        snapshot['hit_rate'] = round((lookups - snapshot['misses']) / lookups, 3) if lookups else 0.0
+        return snapshot
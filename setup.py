@@ -103,7 +103,9 @@ def create_tables(cursor):
             hint TEXT,
             tags TEXT,
             usage_count INTEGER DEFAULT 0,
-            success_rate REAL DEFAULT 0
+            success_rate REAL DEFAULT 0,
+            attempt_count INTEGER DEFAULT 0,
+            correct_count INTEGER DEFAULT 0
         )
     ''')
     
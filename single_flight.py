@@ -0,0 +1,188 @@
+"""
+IDFS StarGuide - Single-Flight Coalescing
+Concurrent identical AI prompts share one provider call or stream
+"""
+
+import threading
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class StreamAbandoned(Exception):
+    """Every running subscriber left a shared stream before it finished"""
+
+
+class Flight:
+    __slots__ = ('ready', 'result', 'error', 'provider', 'stream')
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.result = None
+        self.error = None
+        self.provider = None
+        self.stream = None
+
+
+class SharedStream:
+    """One chunk iterator replayed to any number of subscribers
+
+    There is no pump thread: whichever subscriber runs out of buffered chunks
+    pulls the next one from the source while the others wait on the lock.
+    A subscriber counts from its first next(), so an iterator that is never
+    started (its client left first) cannot keep the provider stream open.
+    The source is closed (cancelling the provider stream) once every
+    running subscriber has gone before it finished; an iterator started
+    after that raises StreamAbandoned rather than returning a cut-off reply.
+    """
+
+    def __init__(self, chunks, on_finish):
+        self._source = chunks
+        self._on_finish = on_finish
+        self._chunks = []
+        self._done = False
+        self._error = None
+        self._subscribers = 0
+        self._pull_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        """A fresh iterator over every chunk, from the first"""
+        return self._replay()
+
+    def _replay(self):
+        with self._lock:
+            self._subscribers += 1
+        index = 0
+        try:
+            while True:
+                if index < len(self._chunks):
+                    yield self._chunks[index]
+                    index += 1
+                    continue
+                if self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                with self._pull_lock:
+                    if index < len(self._chunks) or self._done:
+                        continue
+                    try:
+                        self._chunks.append(next(self._source))
+                    except StopIteration:
+                        self._finish()
+                    except Exception as e:
+                        self._error = e
+                        self._finish()
+        finally:
+            with self._lock:
+                self._subscribers -= 1
+                abandoned = self._subscribers == 0 and not self._done
+            if abandoned:
+                with self._pull_lock:
+                    if not self._done:
+                        if hasattr(self._source, 'close'):
+                            self._source.close()
+                        self._error = StreamAbandoned('Every subscriber left before the stream finished')
+                        self._finish()
+
+    def _finish(self):
+        self._done = True
+        self._on_finish()
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls by key
+
+    do() runs fn once for all callers that arrive while it is in flight and
+    hands each the same result. stream() does the same for
+    fn() -> (provider, chunks), giving every caller its own replay of the
+    one stream; late joiners get the chunks so far, then follow live.
+    """
+
+    def __init__(self, window=60):
+        self.window = window
+        self._flights = {}
+        self._streams = {}
+        self._coalesced_at = deque()
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'streams': 0, 'coalesced': 0}
+
+    def _join(self, flights, key, counter):
+        """Return (flight, leader) for key, registering a new flight if none is in the air"""
+        with self._lock:
+            flight = flights.get(key)
+            if flight is None:
+                flight = flights[key] = Flight()
+                self._stats[counter] += 1
+                return flight, True
+            self._stats['coalesced'] += 1
+            self._coalesced_at.append(time.time())
+            self._prune()
+            return flight, False
+
+    def _prune(self):
+        cutoff = time.time() - self.window
+        while self._coalesced_at and self._coalesced_at[0] < cutoff:
+            self._coalesced_at.popleft()
+
+    def _drop(self, flights, key, flight):
+        with self._lock:
+            if flights.get(key) is flight:
+                del flights[key]
+
+    def do(self, key, fn):
+        """Return (fn(), coalesced), running fn only if no identical call is in flight"""
+        flight, leader = self._join(self._flights, key, 'calls')
+        if not leader:
+            flight.ready.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self._drop(self._flights, key, flight)
+            flight.ready.set()
+        return flight.result, False
+
+    def stream(self, key, fn):
+        """Return (provider, chunks, coalesced) where fn() returns (provider, chunks) or (None, None)"""
+        flight, leader = self._join(self._streams, key, 'streams')
+        if leader:
+            try:
+                flight.provider, chunks = fn()
+                if chunks is not None:
+                    flight.stream = SharedStream(chunks, lambda: self._drop(self._streams, key, flight))
+            except Exception as e:
+                flight.error = e
+                raise
+            finally:
+                # No stream to share (nothing answered, or fn failed): later callers start afresh
+                if flight.stream is None:
+                    self._drop(self._streams, key, flight)
+                flight.ready.set()
+        else:
+            flight.ready.wait()
+            if flight.error is not None:
+                raise flight.error
+
+        if flight.stream is None:
+            return None, None, not leader
+        return flight.provider, flight.stream.subscribe(), not leader
+
+    def stats(self):
+        with self._lock:
+            self._prune()
+            snapshot = dict(self._stats)
+            snapshot.update({
+                'coalesced_per_minute': round(len(self._coalesced_at) * 60 / self.window, 1),
+                'in_flight': len(self._flights) + len(self._streams)
+            })
+        return snapshot
@@ -0,0 +1,275 @@
+"""
+IDFS StarGuide - Socket.IO Fan-out
+Room-routed pub/sub between worker processes, with a small TCP broker standing in for a message queue
+"""
+
+import argparse
+import json
+import queue
+import socket
+import socketserver
+import threading
+import time
+import logging
+
+import socketio
+
+logger = logging.getLogger(__name__)
+
+# Wire format, one frame per line: "S <topic>" subscribe, "U <topic>" unsubscribe,
+# "P <topic>\t<payload>" publish. Topics are JSON strings, so they never contain a tab or newline.
+
+
+def parse_url(url):
+    """(host, port) from tcp://host:port"""
+    host, _, port = url[len('tcp://'):].rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class BrokerManager(socketio.PubSubManager):
+    """Socket.IO client manager that shares emits and room changes through a broker
+
+    Each worker subscribes only to the rooms its own clients are in (plus a
+    broadcast topic), so a pod message reaches the workers hosting that pod's
+    members rather than every worker. Emits to a client connected to this
+    worker never leave the process.
+    """
+
+    name = 'broker'
+
+    def __init__(self, url='tcp://127.0.0.1:5056', channel='socketio', write_only=False, logger=None,
+                 reconnect_delay=1.0):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.address = parse_url(url)
+        self.reconnect_delay = reconnect_delay
+
+        self._socket = None
+        self._topics = set()
+        self._send_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'published': 0, 'received': 0, 'local_only': 0, 'reconnects': 0}
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _topic(self, namespace=None, room=None):
+        return json.dumps(f"{self.channel}|{namespace}|{room}" if room is not None else f"{self.channel}|*")
+
+    def _send(self, frame):
+        with self._send_lock:
+            if self._socket is None:
+                self._connect()
+            try:
+                self._socket.sendall(frame)
+            except OSError:
+                # The listener thread reconnects and resubscribes; this frame is lost
+                self._socket = None
+                raise
+
+    def _connect(self):
+        """Open the broker connection and (re)subscribe; caller holds _send_lock"""
+        sock = socket.create_connection(self.address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if not self.write_only:
+            topics = {self._topic()} | self._topics
+            sock.sendall(b''.join(f"S {topic}\n".encode() for topic in topics))
+        self._socket = sock
+
+    def _subscription(self, op, namespace, room):
+        topic = self._topic(namespace, room)
+        if op == 'S':
+            self._topics.add(topic)
+        else:
+            self._topics.discard(topic)
+        if self.write_only:
+            return
+        try:
+            self._send(f"{op} {topic}\n".encode())
+        except OSError as e:
+            self._get_logger().error(f"Broker subscription error: {str(e)}")
+
+    # Every client's own sid room is subscribed too, so messages for a client on another worker find it
+    def basic_enter_room(self, sid, namespace, room, eio_sid=None):
+        is_new = room is not None and room not in self.rooms.get(namespace, {})
+        super().basic_enter_room(sid, namespace, room, eio_sid=eio_sid)
+        if is_new:
+            self._subscription('S', namespace, room)
+
+    def basic_leave_room(self, sid, namespace, room):
+        super().basic_leave_room(sid, namespace, room)
+        if room is not None and room not in self.rooms.get(namespace, {}):
+            self._subscription('U', namespace, room)
+
+    def _publish(self, data):
+        method = data.get('method')
+        namespace = data.get('namespace')
+        if method in ('emit', 'close_room'):
+            room = data.get('room')
+        elif method in ('disconnect', 'enter_room', 'leave_room'):
+            room = data.get('sid')
+        else:
+            room = None
+
+        if method == 'emit' and isinstance(room, str) and self.is_connected(room, namespace):
+            # Addressed to one of this worker's own clients, already delivered
+            self._count('local_only')
+            return
+
+        # Broadcasts, room lists and callbacks go to every worker
+        topic = self._topic(namespace, room) if isinstance(room, str) else self._topic()
+        payload = self.json.dumps(data)
+        try:
+            self._send(f"P {topic}\t{payload}\n".encode())
+            self._count('published')
+        except OSError as e:
+            self._get_logger().error(f"Broker publish error: {str(e)}")
+
+    def _listen(self):
+        while True:
+            # Unset until connected, so a failed connect falls through to the retry delay
+            sock = None
+            try:
+                with self._send_lock:
+                    if self._socket is None:
+                        self._connect()
+                    sock = self._socket
+                for line in sock.makefile('rb'):
+                    self._count('received')
+                    yield json.loads(line)
+                raise ConnectionError('broker closed the connection')
+            except (OSError, ValueError) as e:
+                self._get_logger().error(f"Broker connection error: {str(e)}")
+                with self._send_lock:
+                    if self._socket is sock:
+                        self._socket = None
+                self._count('reconnects')
+                time.sleep(self.reconnect_delay)
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot['subscriptions'] = len(self._topics)
+        return snapshot
+
+
+class Broker(socketserver.ThreadingTCPServer):
+    """Topic-routed line broker: each publish goes to the other connections subscribed to its topic
+
+    Every connection has a bounded outbound queue drained by its own
+    writer thread, so one slow worker drops its messages (counted) rather
+    than stalling the rest.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, max_queue=10000):
+        self.max_queue = max_queue
+        self.subscribers = {}  # topic -> set of connections
+        self.lock = threading.Lock()
+        self.counters = {'connections': 0, 'published': 0, 'delivered': 0, 'dropped': 0}
+        super().__init__(address, BrokerHandler)
+
+    def count(self, key, delta=1):
+        with self.lock:
+            self.counters[key] += delta
+
+    def stats(self):
+        with self.lock:
+            snapshot = dict(self.counters)
+            snapshot['topics'] = len(self.subscribers)
+        return snapshot
+
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.outbound = queue.Queue(maxsize=self.server.max_queue)
+        self.topics = set()
+        threading.Thread(target=self._write, daemon=True).start()
+        self.server.count('connections')
+
+    def _write(self):
+        while True:
+            payload = self.outbound.get()
+            if payload is None:
+                return
+            batch = [payload]
+            # Coalesce whatever else is queued into one send
+            while len(batch) < 256:
+                try:
+                    payload = self.outbound.get_nowait()
+                except queue.Empty:
+                    break
+                if payload is None:
+                    self.outbound.put(None)
+                    break
+                batch.append(payload)
+            try:
+                self.wfile.write(b''.join(batch))
+                self.wfile.flush()
+            except OSError:
+                return
+
+    def handle(self):
+        server = self.server
+        for line in self.rfile:
+            op, _, rest = line.partition(b' ')
+            if op == b'P':
+                topic, _, payload = rest.partition(b'\t')
+                with server.lock:
+                    targets = [conn for conn in server.subscribers.get(topic, ()) if conn is not self]
+                    server.counters['published'] += 1
+                delivered = 0
+                for conn in targets:
+                    try:
+                        conn.outbound.put_nowait(payload)
+                        delivered += 1
+                    except queue.Full:
+                        server.count('dropped')
+                server.count('delivered', delivered)
+            elif op in (b'S', b'U'):
+                topic = rest.rstrip(b'\n')
+                with server.lock:
+                    if op == b'S':
+                        server.subscribers.setdefault(topic, set()).add(self)
+                        self.topics.add(topic)
+                    else:
+                        self._unsubscribe(topic)
+
+    def _unsubscribe(self, topic):
+        conns = self.server.subscribers.get(topic)
+        if conns is not None:
+            conns.discard(self)
+            if not conns:
+                del self.server.subscribers[topic]
+        self.topics.discard(topic)
+
+    def finish(self):
+        with self.server.lock:
+            for topic in list(self.topics):
+                self._unsubscribe(topic)
+            self.server.counters['connections'] -= 1
+        self.outbound.put(None)
+        super().finish()
+
+
+def start_broker(address):
+    """Run a broker in a background thread; returns it (call shutdown() to stop)"""
+    broker = Broker(address)
+    threading.Thread(target=broker.serve_forever, name='socket-broker', daemon=True).start()
+    return broker
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='StarGuide Socket.IO fan-out broker')
+    parser.add_argument('--address', default='127.0.0.1:5056')
+    args = parser.parse_args()
+    host, _, port = args.address.rpartition(':')
+    broker = Broker((host or '127.0.0.1', int(port)))
+    logger.info(f"Socket.IO broker listening on {args.address}")
+    broker.serve_forever()
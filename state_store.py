@@ -0,0 +1,272 @@
+"""
+IDFS StarGuide - Live State Store
+Sharded, lock-protected state for online users, battles and pods with idle expiry and memory accounting
+"""
+
+import argparse
+import copy
+import sys
+import threading
+import time
+import logging
+from multiprocessing.managers import BaseManager
+
+logger = logging.getLogger(__name__)
+
+
+def approximate_size(value):
+    """Rough bytes held by a JSON-like value (containers count their overhead too)"""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(approximate_size(k) + approximate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(approximate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class Entry:
+    __slots__ = ('value', 'expires_at', 'size')
+
+    def __init__(self, value, ttl):
+        self.value = value
+        self.expires_at = time.time() + ttl if ttl else None
+        self.size = approximate_size(value)
+
+
+class MemoryBackend:
+    """Namespaced key/value state split across shards, each behind its own lock
+
+    Every operation is a single call taking plain (picklable) arguments, so
+    the same interface can be served to other worker processes (see
+    serve_backend) or reimplemented over a shared store. ttl is an idle
+    timeout: each access pushes the entry's expiry forward; None keeps it
+    until it is deleted. Values are copied in and out so callers never
+    share a mutable value with the store.
+    """
+
+    def __init__(self, shards=16, sweep_interval=30.0):
+        self.sweep_interval = sweep_interval
+        self._shards = [({}, threading.Lock()) for _ in range(shards)]
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._namespaces = {}  # namespace -> {'entries', 'bytes', 'expired'}
+
+    def _shard(self, namespace, key):
+        return self._shards[hash((namespace, key)) % len(self._shards)]
+
+    def _account(self, namespace, entries=0, size=0, expired=0):
+        with self._lock:
+            counts = self._namespaces.setdefault(namespace, {'entries': 0, 'bytes': 0, 'expired': 0})
+            counts['entries'] += entries
+            counts['bytes'] += size
+            counts['expired'] += expired
+
+    def _live(self, data, namespace, key, now):
+        """The entry for key, dropping it first if it has expired"""
+        entry = data.get((namespace, key))
+        if entry is not None and entry.expires_at is not None and entry.expires_at <= now:
+            del data[(namespace, key)]
+            self._account(namespace, -1, -entry.size, 1)
+            return None
+        return entry
+
+    def _store(self, data, namespace, key, value, ttl):
+        old = data.get((namespace, key))
+        entry = data[(namespace, key)] = Entry(value, ttl)
+        if old is None:
+            self._account(namespace, 1, entry.size)
+        else:
+            self._account(namespace, 0, entry.size - old.size)
+
+    def get(self, namespace, key, ttl=None):
+        data, lock = self._shard(namespace, key)
+        with lock:
+            entry = self._live(data, namespace, key, time.time())
+            if entry is None:
+                return None
+            if ttl:
+                entry.expires_at = time.time() + ttl
+            return copy.deepcopy(entry.value)
+
+    def set(self, namespace, key, value, ttl=None):
+        data, lock = self._shard(namespace, key)
+        value = copy.deepcopy(value)
+        with lock:
+            self._store(data, namespace, key, value, ttl)
+
+    def delete(self, namespace, key):
+        """Remove key; returns True if it was there"""
+        data, lock = self._shard(namespace, key)
+        with lock:
+            entry = self._live(data, namespace, key, time.time())
+            if entry is None:
+                return False
+            del data[(namespace, key)]
+            self._account(namespace, -1, -entry.size)
+            return True
+
+    def merge(self, namespace, key, fields, ttl=None):
+        """Update fields of a dict value in place; returns the updated value, or None if key is absent"""
+        data, lock = self._shard(namespace, key)
+        with lock:
+            entry = self._live(data, namespace, key, time.time())
+            if entry is None:
+                return None
+            value = dict(entry.value)
+            value.update(copy.deepcopy(fields))
+            self._store(data, namespace, key, value, ttl)
+            return copy.deepcopy(value)
+
+    def add_member(self, namespace, key, field, member, ttl=None):
+        """Append member to the list in value[field] unless present; returns False if key is absent"""
+        data, lock = self._shard(namespace, key)
+        with lock:
+            entry = self._live(data, namespace, key, time.time())
+            if entry is None:
+                return False
+            members = entry.value.get(field, [])
+            if member not in members:
+                value = dict(entry.value)
+                value[field] = members + [member]
+                self._store(data, namespace, key, value, ttl)
+            elif ttl:
+                entry.expires_at = time.time() + ttl
+            return True
+
+    def remove_member(self, namespace, key, field, member, ttl=None):
+        """Remove member from the list in value[field]; returns False if key is absent"""
+        data, lock = self._shard(namespace, key)
+        with lock:
+            entry = self._live(data, namespace, key, time.time())
+            if entry is None:
+                return False
+            members = entry.value.get(field, [])
+            if member in members:
+                value = dict(entry.value)
+                value[field] = [m for m in members if m != member]
+                self._store(data, namespace, key, value, ttl)
+            elif ttl:
+                entry.expires_at = time.time() + ttl
+            return True
+
+    def count(self, namespace):
+        with self._lock:
+            return self._namespaces.get(namespace, {}).get('entries', 0)
+
+    def expire(self):
+        """Drop every expired entry; returns how many were removed"""
+        now = time.time()
+        removed = 0
+        for data, lock in self._shards:
+            with lock:
+                for namespace, key in [k for k, entry in data.items()
+                                       if entry.expires_at is not None and entry.expires_at <= now]:
+                    self._live(data, namespace, key, now)
+                    removed += 1
+        return removed
+
+    def stats(self):
+        with self._lock:
+            namespaces = {name: dict(counts) for name, counts in self._namespaces.items()}
+        return {
+            'shards': len(self._shards),
+            'namespaces': namespaces,
+            'bytes': sum(counts['bytes'] for counts in namespaces.values())
+        }
+
+    def start(self):
+        """Start the expiry sweeper"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='state-expiry', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.sweep_interval):
+            try:
+                self.expire()
+            except Exception as e:
+                logger.error(f"State expiry error: {str(e)}")
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+class StateNamespace:
+    """One kind of live state (e.g. battles) in a backend, with its idle TTL"""
+
+    def __init__(self, backend, name, ttl=None):
+        self.backend = backend
+        self.name = name
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        value = self.backend.get(self.name, key, self.ttl)
+        return default if value is None else value
+
+    def set(self, key, value):
+        self.backend.set(self.name, key, value, self.ttl)
+
+    def delete(self, key):
+        return self.backend.delete(self.name, key)
+
+    def merge(self, key, fields):
+        return self.backend.merge(self.name, key, fields, self.ttl)
+
+    def add_member(self, key, field, member):
+        return self.backend.add_member(self.name, key, field, member, self.ttl)
+
+    def remove_member(self, key, field, member):
+        return self.backend.remove_member(self.name, key, field, member, self.ttl)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return self.backend.count(self.name)
+
+
+# Serving one MemoryBackend to several worker processes: a local stand-in for a shared store
+class StateManager(BaseManager):
+    pass
+
+
+StateManager.register('backend')
+
+
+def connect_backend(address, authkey):
+    """Proxy to a backend served by serve_backend(); every call is one round trip"""
+    manager = StateManager(address=address, authkey=authkey)
+    manager.connect()
+    return manager.backend()
+
+
+def serve_backend(address, authkey, shards=16, sweep_interval=30.0):
+    """Serve a MemoryBackend at address until interrupted"""
+    backend = MemoryBackend(shards=shards, sweep_interval=sweep_interval)
+    backend.start()
+
+    class ServingManager(BaseManager):
+        pass
+
+    ServingManager.register('backend', callable=lambda: backend)
+    server = ServingManager(address=address, authkey=authkey).get_server()
+    logger.info(f"State store serving on {address[0]}:{address[1]}")
+    server.serve_forever()
+
+
+def parse_address(value):
+    host, _, port = value.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='StarGuide shared state store')
+    parser.add_argument('--address', default='127.0.0.1:5055')
+    parser.add_argument('--authkey', required=True)
+    parser.add_argument('--shards', type=int, default=16)
+    args = parser.parse_args()
+    serve_backend(parse_address(args.address), args.authkey.encode(), shards=args.shards)
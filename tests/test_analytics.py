@@ -0,0 +1,86 @@
+import sqlite3
+
+import pytest
+
+from analytics import apply_assessment, check_rollups, load_user_stats, rebuild_rollups
+
+SCHEMA = '''
+    CREATE TABLE assessments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, type TEXT, subject TEXT,
+        score INTEGER, total_questions INTEGER, time_taken INTEGER, questions_data TEXT,
+        completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE achievements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, achievement_id TEXT,
+        unlocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE user_stats (
+        user_id TEXT PRIMARY KEY, total_assessments INTEGER DEFAULT 0, score_sum INTEGER DEFAULT 0,
+        best_score INTEGER DEFAULT 0, total_time INTEGER DEFAULT 0, achievements_unlocked INTEGER DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE user_subject_stats (
+        user_id TEXT, subject TEXT, count INTEGER DEFAULT 0, score_sum INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, subject)
+    );
+'''
+
+
+@pytest.fixture
+def cursor():
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(SCHEMA)
+    yield conn.cursor()
+    conn.close()
+
+
+def submit(cursor, user_id, subject, score, time_taken, achievements=()):
+    """What submit_assessment() does: raw rows first, then the rollup delta"""
+    for achievement_id in achievements:
+        cursor.execute('INSERT INTO achievements (user_id, achievement_id) VALUES (?, ?)', (user_id, achievement_id))
+    cursor.execute('INSERT INTO assessments (user_id, type, subject, score, time_taken) VALUES (?, ?, ?, ?, ?)',
+                   (user_id, 'quiz', subject, score, time_taken))
+    apply_assessment(cursor, user_id, subject, score, time_taken, len(achievements))
+
+
+def test_first_submission_with_history_backfills(cursor):
+    # History from before rollups existed: three assessments and no user_stats row
+    for _ in range(3):
+        cursor.execute('INSERT INTO assessments (user_id, type, subject, score, time_taken) VALUES (?, ?, ?, ?, ?)',
+                       ('u1', 'quiz', 'math', 90, 100))
+    cursor.execute("INSERT INTO achievements (user_id, achievement_id) VALUES ('u1', 'first_steps')")
+
+    submit(cursor, 'u1', 'math', 90, 30, achievements=['math_master'])
+
+    stats, subjects = load_user_stats(cursor, 'u1')
+    assert tuple(stats) == (4, 360, 90, 330, 2)
+    assert [tuple(row) for row in subjects] == [('math', 4, 360)]
+    assert check_rollups(cursor) == []
+
+
+def test_new_user_and_later_submissions_apply_deltas(cursor):
+    submit(cursor, 'u2', 'science', 70, 40)
+    submit(cursor, 'u2', 'math', 100, 20, achievements=['perfect_score'])
+
+    stats, subjects = load_user_stats(cursor, 'u2')
+    assert tuple(stats) == (2, 170, 100, 60, 1)
+    assert sorted(tuple(row) for row in subjects) == [('math', 1, 100), ('science', 1, 70)]
+    assert check_rollups(cursor) == []
+
+
+def test_load_rebuilds_missing_rollups(cursor):
+    cursor.execute('INSERT INTO assessments (user_id, type, subject, score, time_taken) VALUES (?, ?, ?, ?, ?)',
+                   ('u3', 'quiz', 'english', 80, 50))
+
+    stats, subjects = load_user_stats(cursor, 'u3')
+    assert tuple(stats) == (1, 80, 80, 50, 0)
+    assert [tuple(row) for row in subjects] == [('english', 1, 80)]
+
+
+def test_check_reports_drift_and_rebuild_fixes_it(cursor):
+    submit(cursor, 'u4', 'math', 60, 10)
+    cursor.execute("UPDATE user_stats SET total_assessments = 5 WHERE user_id = 'u4'")
+    assert [m['field'] for m in check_rollups(cursor)] == ['total_assessments']
+
+    rebuild_rollups(cursor)
+    assert check_rollups(cursor) == []
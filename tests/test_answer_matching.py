@@ -0,0 +1,43 @@
+import pytest
+
+import answer_matching
+from answer_matching import compile_matcher
+
+
+@pytest.mark.parametrize('question_type, correct, options, answer, expected', [
+    ('calculation', '120', None, '120.0', True),
+    ('calculation', '120', None, '121', False),
+    ('fractions', '5/6', None, '0.8333', True),
+    ('fractions', '5/6', None, '0.8', False),
+    ('algebra', '(x+2)(x+3)', None, '(x+3)(x+2)', True),
+    ('algebra', '(x+2)(x+3)', None, 'x^2+5x+6', False),
+    ('algebra', 'x^2+5x+6', None, '(x+2)(x+3)', True),
+    ('algebra', '6', None, 'x = 6', True),
+    ('algebra', 'x^2', None, 'x^11', False),
+    ('biology', 'carbon dioxide', None, 'CO₂', True),
+    ('physics', '299792458', None, '299,792,458 m/s', True),
+    ('chemistry', '6.02e23', None, '6.02 × 10^23', True),
+    ('chemistry', '6.02e23', None, '1e400', False),
+    ('people', 'George Washington', None, 'washington', True),
+    ('multiple-choice', '2', '["1943", "1944", "1945", "1946"]', 'C', True),
+    ('multiple-choice', '2', '["1943", "1944", "1945", "1946"]', '1944', False),
+])
+def test_verdicts(question_type, correct, options, answer, expected):
+    matcher = compile_matcher(question_type, correct, options)
+    assert matcher(answer) is expected
+    assert matcher.uncached(answer) is expected
+
+
+def test_key_as_written_skips_building_the_matcher(monkeypatch):
+    built = []
+    factory = answer_matching.MATCHERS['algebra']
+    monkeypatch.setitem(answer_matching.MATCHERS, 'algebra',
+                        lambda correct, options: built.append(correct) or factory(correct, options))
+
+    matcher = compile_matcher('algebra', '(x+2)(x+3)')
+    assert matcher(' (X+2)(x+3) ')
+    assert built == []
+
+    assert matcher('(x+3)(x+2)')
+    assert matcher('(x+3)(x+4)') is False
+    assert built == ['(x+2)(x+3)']
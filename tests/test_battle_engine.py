@@ -0,0 +1,159 @@
+import threading
+import time
+
+import pytest
+
+from battle_engine import BattleEngine
+from db_pool import ConnectionPool
+from matchmaking import RatingStore
+from question_bank import AnswerKeyCache
+from state_store import MemoryBackend, StateNamespace
+
+SCHEMA = '''
+    CREATE TABLE questions (
+        id INTEGER PRIMARY KEY, question TEXT, type TEXT, options TEXT, correct_answer TEXT,
+        explanation TEXT, hint TEXT, difficulty TEXT
+    );
+    CREATE TABLE battles (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, opponent_id TEXT, user_score INTEGER,
+        opponent_score INTEGER, winner_id TEXT, xp_earned INTEGER, duration INTEGER,
+        completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE player_ratings (
+        user_id TEXT PRIMARY KEY, rating REAL, deviation REAL, games INTEGER DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    INSERT INTO questions (id, question, type, correct_answer, explanation, difficulty) VALUES
+        (1, '2 + 2', 'numeric', '4', 'Add', 'easy'),
+        (2, '3 * 3', 'numeric', '9', 'Multiply', 'easy');
+    INSERT INTO player_ratings (user_id, rating, deviation, games) VALUES ('ada', 1200, 80, 10);
+'''
+
+
+class QuestionIndex:
+    def sample(self, subject, difficulty, count):
+        return [1, 2][:count]
+
+
+class Wheel:
+    """Holds scheduled callbacks until the test fires them"""
+
+    def __init__(self):
+        self.timers = []
+
+    def schedule(self, delay, fn, *args):
+        timer = [fn, args, True]
+        self.timers.append(timer)
+        return timer
+
+    def cancel(self, timer):
+        was_pending, timer[2] = timer[2], False
+        return was_pending
+
+    def fire(self, fn):
+        for timer in list(self.timers):
+            if timer[2] and timer[0] == fn:
+                timer[2] = False
+                timer[0](*timer[1])
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'battles.db'))
+    with pool.connection() as db:
+        db.executescript(SCHEMA)
+    yield pool
+    pool.close_all()
+
+
+@pytest.fixture
+def ratings(pool):
+    return RatingStore(pool.connection)
+
+
+@pytest.fixture
+def engine(pool, ratings):
+    notices = []
+    finished = []
+
+    def on_finish(battle):
+        finished.append(threading.current_thread())
+        ratings.record_battle(battle)
+
+    engine = BattleEngine(StateNamespace(MemoryBackend(), 'battles'), QuestionIndex(), AnswerKeyCache(pool.connection),
+                          pool.connection, Wheel(), lambda user_id, event, payload: notices.append((user_id, event, payload)),
+                          questions_per_battle=2, ai_think=(0, 0), on_finish=on_finish)
+    engine.notices = notices
+    engine.finished = finished
+    return engine
+
+
+def battle_rows(pool):
+    with pool.connection() as db:
+        return [tuple(row) for row in db.execute('''
+            SELECT user_id, opponent_id, user_score, opponent_score, winner_id FROM battles ORDER BY id
+        ''')]
+
+
+def completions(engine):
+    return {user_id: payload for user_id, event, payload in engine.notices if event == 'battle_complete'}
+
+
+def test_human_battle_finishes_once_and_rates_both_players(pool, ratings, engine):
+    questions = engine.create('b1', 'ada', {'id': 'bo', 'human': True})
+    assert [question['id'] for question in questions] == [1, 2]
+
+    assert engine.move('b1', 'ada', '4')['correct']
+    assert engine.move('b1', 'bo', '5')['correct'] is False
+    assert not engine.move('b1', 'ada', '9')['finished']
+    assert engine.move('b1', 'bo', '9')['finished']
+    assert engine.move('b1', 'ada', '9') is None
+    assert not engine.finish('b1')
+
+    complete = completions(engine)
+    assert complete['ada']['won'] and complete['ada']['userScore'] == 20
+    assert not complete['bo']['won'] and complete['bo']['opponentScore'] == 20
+
+    # Rating waits for the writer, not the thread that ended the battle
+    assert engine.finished == []
+    engine.flush()
+    assert battle_rows(pool) == [('ada', 'bo', 20, 10, 'ada')]
+    assert engine.finished == [threading.current_thread()]
+
+    ada_rating, _ = ratings.get('ada')
+    bo_rating, _ = ratings.get('bo')
+    assert ada_rating > 1200
+    assert bo_rating < ratings.default_rating
+    assert ratings.stats()['games'] == 1
+
+
+def test_ai_battle_deadline_finishes_and_rates_on_writer_thread(pool, ratings, engine):
+    engine.create('b2', 'ada', {'id': 'ai', 'rating': 1000})
+    engine.move('b2', 'ada', '4')
+    engine.wheel.fire(engine._expire)
+
+    complete = completions(engine)
+    assert list(complete) == ['ada']
+    assert complete['ada']['timedOut'] and complete['ada']['won']
+    assert engine.stats()['timed_out'] == 1
+
+    engine.start()
+    deadline = time.time() + 5
+    while engine.stats()['persisted'] < 1 and time.time() < deadline:
+        time.sleep(0.01)
+    engine.stop()
+    assert battle_rows(pool) == [('ada', 'ai', 10, 0, 'ada')]
+    assert len(engine.finished) == 1 and engine.finished[0] is not threading.current_thread()
+    assert ratings.get('ada')[0] > 1200
+
+
+def test_finish_hook_error_does_not_lose_the_row(pool, engine):
+    def broken(battle):
+        raise RuntimeError('boom')
+
+    engine.on_finish = broken
+    engine.create('b3', 'ada', {'id': 'bo', 'human': True})
+    assert engine.finish('b3')
+    engine.flush()
+    assert battle_rows(pool) == [('ada', 'bo', 0, 0, None)]
+    assert engine.stats()['persisted'] == 1
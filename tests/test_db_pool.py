@@ -0,0 +1,101 @@
+import sqlite3
+
+import pytest
+
+from db_pool import ConnectionPool, PoolTimeout
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.db'), max_size=2, checkout_timeout=0.1)
+    with pool.connection() as db:
+        db.execute('CREATE TABLE items (value INTEGER)')
+        db.commit()
+    yield pool
+    pool.close_all()
+
+
+def values(pool):
+    with pool.connection() as db:
+        return [row[0] for row in db.execute('SELECT value FROM items ORDER BY value')]
+
+
+def test_use_after_close_raises(pool):
+    db = pool.acquire()
+    db.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        db.execute('SELECT 1')
+    with pytest.raises(sqlite3.ProgrammingError):
+        with db:
+            pass
+
+
+def test_close_twice_releases_once(pool):
+    db = pool.acquire()
+    db.close()
+    db.close()
+    assert pool.stats()['in_use'] == 0
+    assert pool.stats()['idle'] == 1
+
+
+def test_with_block_commits_or_rolls_back_without_releasing(pool):
+    db = pool.acquire()
+    with db:
+        db.execute('INSERT INTO items VALUES (1)')
+    with pytest.raises(ValueError):
+        with db:
+            db.execute('INSERT INTO items VALUES (2)')
+            raise ValueError
+    assert not db.released
+    db.close()
+    assert values(pool) == [1]
+
+
+def test_reclaim_counts_leak_and_rolls_back(pool):
+    db = pool.acquire()
+    db.execute('INSERT INTO items VALUES (3)')
+    pool.reclaim(db)
+
+    stats = pool.stats()
+    assert db.released
+    assert stats['leaks'] == 1
+    assert stats['rollbacks'] == 1
+    assert stats['in_use'] == 0
+    assert values(pool) == []
+
+
+def test_reclaim_ignores_closed_connection(pool):
+    db = pool.acquire()
+    db.close()
+    pool.reclaim(db)
+    assert pool.stats()['leaks'] == 0
+
+
+def test_reclaimed_connection_is_reused(pool):
+    first = pool.acquire()
+    second = pool.acquire()
+    pool.reclaim(first)
+    third = pool.acquire()
+    assert pool.stats()['size'] == 2
+    second.close()
+    third.close()
+
+
+def test_checkout_times_out_when_exhausted(pool):
+    held = [pool.acquire(), pool.acquire()]
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert pool.stats()['timeouts'] == 1
+    for db in held:
+        db.close()
+
+
+def test_close_all_closes_checked_out_connections_on_release(pool):
+    db = pool.acquire()
+    pool.close_all()
+    db.close()
+
+    stats = pool.stats()
+    assert stats['idle'] == 0
+    assert stats['size'] == 0
+    assert stats['discarded'] == 0
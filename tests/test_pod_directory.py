@@ -0,0 +1,74 @@
+import pytest
+
+from db_pool import ConnectionPool
+from pod_directory import PodDirectory
+
+SCHEMA = '''
+    CREATE TABLE users (id TEXT PRIMARY KEY, username TEXT);
+    CREATE TABLE learning_pods (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, description TEXT, subject TEXT, creator_id TEXT,
+        max_members INTEGER DEFAULT 10, is_active BOOLEAN DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE pod_members (
+        pod_id INTEGER, user_id TEXT, role TEXT DEFAULT 'member',
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (pod_id, user_id)
+    );
+    INSERT INTO users (id, username) VALUES ('ada', 'ada'), ('bo', 'bo'), ('cy', 'cy');
+    INSERT INTO learning_pods (id, name, subject, creator_id, max_members) VALUES (1, 'Algebra', 'math', 'ada', 3);
+    INSERT INTO pod_members (pod_id, user_id, role) VALUES (1, 'ada', 'admin');
+'''
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pods.db'))
+    with pool.connection() as db:
+        db.executescript(SCHEMA)
+    yield pool
+    pool.close_all()
+
+
+@pytest.fixture
+def directory(pool):
+    return PodDirectory(pool.connection)
+
+
+def member_count(directory):
+    return directory.list()[0]['member_count']
+
+
+def test_join_and_leave_keep_count_current(directory):
+    assert directory.join(1, 'bo') == 'joined'
+    assert directory.join(1, 'bo') == 'member'
+    assert member_count(directory) == 2
+
+    assert directory.leave(1, 'bo') == 'left'
+    assert not directory.is_member(1, 'bo')
+    assert member_count(directory) == 1
+    assert directory.leave(1, 'bo') == 'not_member'
+
+
+def test_full_pod_refuses_join(directory):
+    assert directory.join(1, 'bo') == 'joined'
+    assert directory.join(1, 'cy') == 'joined'
+    assert directory.join(1, 'dee') == 'full'
+    assert directory.join(2, 'bo') == 'missing'
+
+
+def test_last_admin_cannot_leave(directory):
+    directory.join(1, 'bo')
+    assert directory.leave(1, 'ada') == 'last_admin'
+    assert directory.is_member(1, 'ada')
+    assert member_count(directory) == 2
+
+
+def test_admin_can_leave_when_another_admin_remains(pool, directory):
+    directory.join(1, 'bo')
+    with pool.connection() as db:
+        db.execute("UPDATE pod_members SET role = 'admin' WHERE user_id = 'bo'")
+        db.commit()
+
+    assert directory.leave(1, 'ada') == 'left'
+    assert directory.leave(1, 'bo') == 'last_admin'
+    assert member_count(directory) == 1
@@ -0,0 +1,98 @@
+import queue
+import socket
+import threading
+import time
+
+import pytest
+
+from socket_fanout import BrokerManager, start_broker
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def listen(manager):
+    """Run the manager's listener in a thread; returns the queue of messages and errors it produced"""
+    received = queue.Queue()
+
+    def run():
+        try:
+            for message in manager._listen():
+                received.put(message)
+        except Exception as e:
+            received.put(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return received
+
+
+@pytest.fixture
+def port():
+    return free_port()
+
+
+def test_listener_waits_and_retries_while_broker_is_down(port):
+    manager = BrokerManager(f'tcp://127.0.0.1:{port}', reconnect_delay=0.05)
+    received = listen(manager)
+
+    time.sleep(0.3)
+    assert received.empty()
+    # Retries are paced by reconnect_delay rather than spinning
+    assert 1 <= manager.stats()['reconnects'] <= 10
+
+
+def test_listener_connects_once_broker_starts(port):
+    manager = BrokerManager(f'tcp://127.0.0.1:{port}', reconnect_delay=0.05)
+    received = listen(manager)
+    assert wait_for(lambda: manager.stats()['reconnects'] >= 1)
+
+    broker = start_broker(('127.0.0.1', port))
+    try:
+        assert wait_for(lambda: broker.stats()['topics'] >= 1)
+        publisher = BrokerManager(f'tcp://127.0.0.1:{port}', write_only=True)
+        publisher._publish({'method': 'emit', 'event': 'ping', 'data': 1, 'namespace': '/', 'room': None})
+
+        message = received.get(timeout=5)
+        assert message['event'] == 'ping'
+        assert manager.stats()['received'] == 1
+    finally:
+        broker.shutdown()
+        broker.server_close()
+
+
+def test_listener_reconnects_after_broker_restart(port):
+    broker = start_broker(('127.0.0.1', port))
+    manager = BrokerManager(f'tcp://127.0.0.1:{port}', reconnect_delay=0.05)
+    received = listen(manager)
+    assert wait_for(lambda: broker.stats()['topics'] >= 1)
+
+    # Dropping the connection sends the listener back through the retry path
+    manager._socket.shutdown(socket.SHUT_RDWR)
+    assert wait_for(lambda: manager.stats()['reconnects'] >= 1)
+    assert wait_for(lambda: manager._socket is not None)
+
+    # The broker may not have the new subscription yet, so keep publishing until one arrives
+    publisher = BrokerManager(f'tcp://127.0.0.1:{port}', write_only=True)
+    message = None
+    deadline = time.time() + 5
+    while message is None and time.time() < deadline:
+        publisher._publish({'method': 'emit', 'event': 'again', 'data': 2, 'namespace': '/', 'room': None})
+        try:
+            message = received.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    assert message is not None and message['event'] == 'again'
+    broker.shutdown()
+    broker.server_close()
@@ -0,0 +1,113 @@
+"""
+IDFS StarGuide - Timer Wheel
+Hashed timing wheel running many short-lived delayed callbacks on one thread
+"""
+
+import math
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """Schedule callbacks at tick resolution without a thread or heap entry per timer
+
+    The wheel has `slots` buckets, one per tick; a timer further out than one
+    turn of the wheel waits out the extra turns in its bucket. Scheduling and
+    cancelling are O(1) and each tick only looks at one bucket. Callbacks run
+    on the wheel's thread, so they should be short and must not block.
+    """
+
+    def __init__(self, tick=0.1, slots=512):
+        self.tick = tick
+        self.slots = slots
+        self._buckets = [[] for _ in range(slots)]
+        self._cursor = 0
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {'scheduled': 0, 'fired': 0, 'cancelled': 0, 'errors': 0, 'pending': 0,
+                       'last_lag_ms': 0.0, 'max_lag_ms': 0.0}
+
+    def schedule(self, delay, fn, *args):
+        """Run fn(*args) after roughly delay seconds; returns a handle for cancel()"""
+        ticks = max(1, math.ceil(delay / self.tick))
+        with self._lock:
+            # [turns left, fn, args, due]
+            timer = [(ticks - 1) // self.slots, fn, args, time.monotonic() + delay]
+            self._buckets[(self._cursor + ticks) % self.slots].append(timer)
+            self._stats['scheduled'] += 1
+            self._stats['pending'] += 1
+        return timer
+
+    def cancel(self, timer):
+        """Stop a scheduled callback from firing; returns False if it already ran"""
+        with self._lock:
+            if timer[1] is None:
+                return False
+            timer[1] = None
+            self._stats['cancelled'] += 1
+            self._stats['pending'] -= 1
+            return True
+
+    def start(self):
+        """Start the wheel thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='timer-wheel', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        next_tick = time.monotonic() + self.tick
+        while not self._stopped.is_set():
+            delay = next_tick - time.monotonic()
+            if delay > 0 and self._stopped.wait(delay):
+                return
+            # Catch up tick by tick if callbacks overran
+            self._advance()
+            next_tick += self.tick
+
+    def _advance(self):
+        with self._lock:
+            self._cursor = (self._cursor + 1) % self.slots
+            bucket = self._buckets[self._cursor]
+            due, waiting = [], []
+            for timer in bucket:
+                if timer[1] is None:
+                    continue
+                if timer[0] > 0:
+                    timer[0] -= 1
+                    waiting.append(timer)
+                else:
+                    due.append((timer[1], timer[2], timer[3]))
+                    timer[1] = None
+            self._buckets[self._cursor] = waiting
+            self._stats['pending'] -= len(due)
+
+        now = time.monotonic()
+        for fn, args, due_at in due:
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error(f"Timer callback error: {str(e)}")
+                with self._lock:
+                    self._stats['errors'] += 1
+
+        if due:
+            lag_ms = round(max(0.0, now - min(due_at for _, _, due_at in due)) * 1000, 2)
+            with self._lock:
+                self._stats['fired'] += len(due)
+                self._stats['last_lag_ms'] = lag_ms
+                self._stats['max_lag_ms'] = max(self._stats['max_lag_ms'], lag_ms)
+
+    def stop(self):
+        """Stop the wheel; timers still pending never fire"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.tick + 1)
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)